@@ -0,0 +1,122 @@
+"""
+Background evaluator of the conv-LSTM checkpoints.
+Start it after training_model.py: it polls save_dir for new checkpoints, scores each one on the held out flights
+listed in save_dir/test_files.txt and appends the test loss to save_dir/eval_loss.csv, so training does not wait
+on the test set.
+"""
+
+import os
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from testing_model import test_weather_lstm
+
+
+class checkpoint_evaluator(test_weather_lstm):
+
+    def __init__(self, cfg):
+        super(checkpoint_evaluator, self).__init__(cfg)
+        self.poll_interval = cfg.get('poll_interval', 60)  # seconds between looks at save_dir
+        self.idle_timeout = cfg.get('idle_timeout', 6 * 3600)  # stop after this many seconds without a new checkpoint
+
+    def load_test_index(self):
+
+        # wait for the trainer to write the held out flights
+        while not os.path.exists('{}/test_files.txt'.format(self.save_dir)):
+            time.sleep(self.poll_interval)
+        with open('{}/test_files.txt'.format(self.save_dir)) as f:
+            test_files = set(f.read().split())
+
+        self.test_idx = np.array([i for i in range(len(self.file_list)) if self.file_list[i] in test_files])
+        print("Evaluating checkpoints on {} flights.".format(len(self.test_idx)))
+
+    def training_state(self):
+        # output: start and end epoch of the current training run, written by the trainer before its first checkpoint,
+        #         None if the trainer has not written them yet
+        if not os.path.exists('{}/training_state.json'.format(self.save_dir)):
+            return None
+        with open('{}/training_state.json'.format(self.save_dir)) as f:
+            return json.load(f)
+
+    @staticmethod
+    def checkpoint_epoch(path):
+        # model.ckpt-<epoch>, model.ckpt of a model saved before the epoch counter is epoch 0
+        name = os.path.basename(path)
+        return int(name.rsplit('-', 1)[1]) if '-' in name else 0
+
+    def evaluate(self, sess):
+        # input: tensorflow session with a restored checkpoint
+        # output: loss on the held out flights, run in chunks and averaged over the flights
+        loss_sum = 0.
+        for i in range(0, len(self.test_idx), self.valid_batch_size):
+            idx = self.test_idx[i:i+self.valid_batch_size]
+            weather = self.data.weather(idx) if self.packed_data else self.valid_weather[idx]
+            feed_value_test = {self.x_weather: weather,
+                               self.x_fp: self.valid_x_fp[idx],
+                               self.y_traj: self.valid_y_traj[idx], }
+            loss_sum += len(idx) * sess.run(self.loss, feed_dict=feed_value_test)
+        return loss_sum / len(self.test_idx)
+
+    def run(self):
+
+        self.x_weather = tf.placeholder(tf.as_dtype(self.weather_dtype), [None, self.input_dimension-1, self.cube_size, self.cube_size, 1])
+        self.x_fp = tf.placeholder(tf.float32, [None, self.input_dimension, 2])
+        self.y_traj = tf.placeholder(tf.float32, [None, self.input_dimension, 2])
+
+        # build graph, the data is loaded there
+        self.conv_lstm_graph_2(self.x_fp, self.weather_input(), self.y_traj)
+        self.load_test_index()
+
+        saver = tf.train.Saver()
+        scored = set()
+        last_checkpoint = time.time()
+
+        with tf.Session() as sess:
+            while True:
+                # only checkpoints of the current run are scored, not the one a resumed or incremental run restored from
+                run_state = self.training_state()
+                state = tf.train.get_checkpoint_state(self.save_dir)
+                new_checkpoints = []
+                if run_state is not None and state is not None:
+                    new_checkpoints = [x for x in state.all_model_checkpoint_paths
+                                       if x not in scored and self.checkpoint_epoch(x) > run_state['start_epoch']]
+
+                for path in new_checkpoints:
+                    scored.add(path)
+                    try:
+                        saver.restore(sess, path)
+                    except (tf.errors.NotFoundError, ValueError):  # removed by the trainer before it was scored
+                        continue
+                    loss_test = self.evaluate(sess)
+
+                    with open('{}/eval_loss.csv'.format(self.save_dir), 'a') as f:
+                        f.write('{},{}\n'.format(os.path.basename(path), loss_test))
+                    print("Checkpoint: {} Test Loss: {}".format(os.path.basename(path), loss_test))
+
+                # the trainer saves its last epoch as model.ckpt-<end_epoch>, resumed and incremental runs included
+                if run_state is not None and any(self.checkpoint_epoch(x) == run_state['end_epoch'] for x in scored):
+                    break
+                if new_checkpoints:
+                    last_checkpoint = time.time()
+                elif time.time() - last_checkpoint > self.idle_timeout:
+                    print("No new checkpoint in {} seconds.".format(self.idle_timeout))
+                    break
+                time.sleep(self.poll_interval)
+
+        print("Finish evaluation.")
+
+
+if __name__ == '__main__':
+
+    cfg = {'input_dimension': 50,  # number of trajectory points in the data
+           'cube_size': 20,  # weather cube size
+           'epoch': 1002,
+           'poll_interval': 60,  # seconds between looks at save_dir
+           # 'packed_data': 'training data/50/packed_JFK2LAX_ET.npy',  # packed records from packed_data.py
+           }
+
+    cfg['save_dir'] = './Epoch_{}_Dimension_{}'.format(cfg['epoch'], cfg['input_dimension'])
+
+    fun = checkpoint_evaluator(cfg)
+    fun.run()
@@ -0,0 +1,151 @@
+"""
+NumPy inference for the conv-LSTM model of conv_lstm_graph_2.
+export_weights reads the trained variables from a checkpoint once and writes them to one npz file, numpy_weather_lstm
+loads that file and runs the forward pass for a batch of flight plans with numpy only, so predictions do not need
+tensorflow, the graph or the training data.
+"""
+
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from packed_data import normalize_position, normalize_weather, lat_max, lat_min, lon_max, lon_min
+
+# variables of conv_lstm_graph_2
+weight_names = ['w1', 'b1', 'w2', 'b2', 'w3', 'b3', 'w4', 'b4',
+                'conv1/kernel', 'conv1/bias', 'conv2/kernel', 'conv2/bias',
+                'fc1/kernel', 'fc1/bias', 'fc2/kernel', 'fc2/bias',
+                'fc_in/kernel', 'fc_in/bias', 'fc_mid/kernel', 'fc_mid/bias']
+
+
+def export_weights(save_dir, out_file=None, weather_max=None):
+    # input: checkpoint folder of training_model.py, output file and the max of the training weather cubes,
+    #        read from save_dir/normalization.json if not given
+    # output: path of the npz file with the weights in float32 and the weather normalization
+    import json
+    import tensorflow as tf
+
+    reader = tf.train.NewCheckpointReader(tf.train.latest_checkpoint(save_dir))
+    weights = {x: reader.get_tensor(x).astype(np.float32) for x in weight_names}
+    if weather_max is None and os.path.exists('{}/normalization.json'.format(save_dir)):
+        with open('{}/normalization.json'.format(save_dir)) as f:
+            weather_max = json.load(f)['weather_max']
+    if weather_max is not None:
+        weights['weather_max'] = np.float32(weather_max)
+
+    if out_file is None:
+        out_file = '{}/weights.npz'.format(save_dir)
+    np.savez(out_file, **weights)
+
+    print("Exported {} weights to {}.".format(len(weight_names), out_file))
+    return out_file
+
+
+def denormalize_position(x):
+    # input: normalized latitude and longitude (... x 2)
+    # output: latitude and longitude in degrees
+    x = np.array(x, dtype=np.float32)
+    x[..., 0] = x[..., 0] * (lat_max - lat_min) + lat_min
+    x[..., 1] = x[..., 1] * (lon_max - lon_min) + lon_min
+    return x
+
+
+def relu(x):
+    return np.maximum(x, 0)
+
+
+def sigmoid(x):
+    return 0.5 * (np.tanh(0.5 * x) + 1)
+
+
+def conv2d_valid(x, kernel, bias, stride):
+    # input: images (n x height x width x channels), kernel (size x size x channels x filters) and bias (filters)
+    # output: relu of the valid convolution with the given stride, same as tf.layers.conv2d
+    size = kernel.shape[0]
+    patches = sliding_window_view(x, (size, size), axis=(1, 2))[:, ::stride, ::stride]  # n x h x w x c x size x size
+    return relu(np.einsum('nhwcij,ijcf->nhwf', patches, kernel, optimize=True) + bias)
+
+
+class numpy_weather_lstm(object):
+
+    def __init__(self, weights_file):
+        data = np.load(weights_file)
+        self.weights = {x: data[x] for x in data.files}
+        self.weather_max = float(self.weights['weather_max']) if 'weather_max' in self.weights else None
+
+    def dense(self, x, name, activation=relu):
+        return activation(np.dot(x, self.weights[name + '/kernel']) + self.weights[name + '/bias'])
+
+    def encode_weather(self, weather):
+        # input: normalized weather cubes (n x dimension-1 x cube size x cube size x 1)
+        # output: weather embedding of every step (n x dimension-1 x 4)
+        n, steps = weather.shape[0:2]
+        x = np.asarray(weather, dtype=np.float32).reshape((n * steps,) + weather.shape[2:])
+        x = conv2d_valid(x, self.weights['conv1/kernel'], self.weights['conv1/bias'], 2)
+        x = conv2d_valid(x, self.weights['conv2/kernel'], self.weights['conv2/bias'], 2)
+        x = self.dense(self.dense(x.reshape(n * steps, -1), 'fc1'), 'fc2')
+        return x.reshape(n, steps, -1)
+
+    def initial_state(self, start):
+        # input: normalized first trajectory point (n x 2)
+        # output: hidden and cell tensors of the first step
+        c_t = np.asarray(start, dtype=np.float32)
+        return self.dense(c_t, 'fc_in'), c_t
+
+    def cell(self, h_t, c_t, x_t, x_embed_t):
+        # input: hidden and cell tensors, normalized flight plan point (n x 2) and weather embedding (n x 4) of the step
+        # output: normalized next trajectory point (n x 2), hidden and cell tensors of the next step
+        w = self.weights
+        h_x = np.concatenate([h_t, x_t, x_embed_t], axis=1)
+
+        # gates and cell tensor
+        f_t = sigmoid(np.dot(h_x, w['w1']) + w['b1'])
+        i_t = sigmoid(np.dot(h_x, w['w2']) + w['b2'])
+        o_t = sigmoid(np.dot(h_x, w['w4']) + w['b4'])
+        c_t = f_t * c_t + i_t * np.tanh(np.dot(h_x, w['w3']) + w['b3'])
+
+        y_t = o_t * np.tanh(c_t)
+        return y_t, self.dense(y_t, 'fc_mid'), c_t
+
+    def predict_normalized(self, fp, weather, start=None):
+        # input: normalized flight plans (n x dimension x 2), weather cubes (n x dimension-1 x cube size x cube size x 1)
+        #        and the first trajectory point (n x 2), the first flight plan point if not given
+        # output: normalized predicted trajectories (n x dimension x 2)
+        fp = np.asarray(fp, dtype=np.float32)
+        h_t, c_t = self.initial_state(fp[:, 0, :] if start is None else start)
+        x_embed = self.encode_weather(weather)
+
+        y_pred = np.empty(fp.shape, dtype=np.float32)
+        y_pred[:, 0, :] = fp[:, 0, :]
+        for t in range(fp.shape[1] - 1):
+            y_pred[:, t+1, :], h_t, c_t = self.cell(h_t, c_t, fp[:, t, :], x_embed[:, t, :])
+
+        return y_pred
+
+    def predict(self, fp, weather, start=None):
+        # input: flight plans (n x dimension x 2 or 3) in degrees, raw weather cubes (n x dimension-1 x cube size x
+        #        cube size) and the first trajectory point (n x 2) in degrees, the first flight plan point if not given
+        # output: predicted trajectories (n x dimension x 2) in degrees
+        if self.weather_max is None:
+            raise ValueError("weather_max is not in the weights file, use predict_normalized")
+
+        if start is not None:
+            start = normalize_position(np.asarray(start, dtype=np.float32)[:, None, :])[:, 0, :]
+        y_pred = self.predict_normalized(normalize_position(fp), normalize_weather(weather, self.weather_max), start)
+        return denormalize_position(y_pred)
+
+
+if __name__ == '__main__':
+
+    import time
+    from packed_data import packed_dataset
+
+    save_dir = './Epoch_1002_Dimension_50'
+    data = packed_dataset('training data/50/packed_JFK2LAX_ET.npy')
+
+    weights_file = export_weights(save_dir)
+
+    start_time = time.time()
+    fun = numpy_weather_lstm(weights_file)
+    idx = np.arange(len(data))
+    y_pred = fun.predict(data.records['fp'][idx], data.records['weather'][idx])
+    print("Predicted {} flights in {:.3f} seconds.".format(len(idx), time.time() - start_time))
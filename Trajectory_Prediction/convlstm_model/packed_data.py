@@ -0,0 +1,278 @@
+"""
+Packed training data for the conv-LSTM models.
+pack_dataset writes the flight plan, weather cube and trajectory of every flight into one record file (.npy) with a
+json index next to it. packed_dataset memory-maps the records and only materializes the flights of a batch.
+Records are stored in float32 and the batches come out in float32. With weather_dtype 'float16' or 'uint8' the
+normalized weather cubes stay compact on the host and are cast to float32 inside the graph.
+Variable length flights (flight_data_generator with sample_interval) are packed back to back by pack_ragged_dataset,
+ragged_dataset pads every batch to its longest flight and bucket_batches groups flights of similar length.
+"""
+
+import os
+import json
+import numpy as np
+
+# data normalization
+lat_max = 53.8742945085336
+lat_min = 19.35598953632181
+lon_min = -134.3486134307298
+lon_max = -61.65138656927017
+
+# host value of the normalized weather 1.0 for each weather dtype
+weather_scale = {'float32': 1., 'float16': 1., 'uint8': 255.}
+
+
+def pack_dataset(data_dir, weather_dir='JFK2LAX_ET', out_file=None):
+    # input: directory of the training data, e.g. 'training data/50', and the weather cube folder
+    # output: path of the packed records, one record per flight with its name, flight plan, weather cube and trajectory
+
+    file_list = sorted(os.listdir('{}/weather data/{}'.format(data_dir, weather_dir)))
+    if out_file is None:
+        out_file = '{}/packed_{}.npy'.format(data_dir, weather_dir)
+
+    # record layout from the first flight, all fields in float32
+    fp = np.load('{}/flightplan data/{}'.format(data_dir, file_list[0]))
+    weather = np.load('{}/weather data/{}/{}'.format(data_dir, weather_dir, file_list[0]))
+    traj = np.load('{}/trajectory data/{}'.format(data_dir, file_list[0]))
+    dtype = np.dtype([('name', 'U{}'.format(max(len(x) for x in file_list))),
+                      ('fp', np.float32, fp.shape),
+                      ('weather', np.float32, weather.shape),
+                      ('traj', np.float32, traj.shape)])
+
+    # write flight by flight, the max of the clipped weather is kept for normalization
+    records = np.lib.format.open_memmap(out_file, mode='w+', dtype=dtype, shape=(len(file_list),))
+    weather_max = 0.
+    for i in range(len(file_list)):
+        weather = np.load('{}/weather data/{}/{}'.format(data_dir, weather_dir, file_list[i]))
+        records['name'][i] = file_list[i]
+        records['fp'][i] = np.load('{}/flightplan data/{}'.format(data_dir, file_list[i]))
+        records['weather'][i] = weather
+        records['traj'][i] = np.load('{}/trajectory data/{}'.format(data_dir, file_list[i]))
+        weather_max = max(weather_max, float(np.amax(weather)))
+    records.flush()
+    del records
+
+    index = {'names': file_list,
+             'size': len(file_list),
+             'weather_max': weather_max,
+             'fields': {x: [dtype[x].base.str, list(dtype[x].shape)] for x in ['fp', 'weather', 'traj']}}
+    with open(os.path.splitext(out_file)[0] + '.json', 'w') as f:
+        json.dump(index, f)
+
+    print("Packed {} flights into {}.".format(len(file_list), out_file))
+    return out_file
+
+
+def pack_ragged_dataset(data_dir, weather_dir='JFK2LAX_ET', out_file=None):
+    # input: directory of the variable length training data and the weather cube folder
+    # output: path of the json index, the flight plans, weather cubes and trajectories of all flights are stored
+    #         back to back in three npy files next to it with the offsets of every flight in the index
+
+    file_list = sorted(os.listdir('{}/weather data/{}'.format(data_dir, weather_dir)))
+    if out_file is None:
+        out_file = '{}/ragged_{}.json'.format(data_dir, weather_dir)
+    prefix = os.path.splitext(out_file)[0]
+
+    # length of every flight from the npy headers
+    lengths = np.array([np.load('{}/trajectory data/{}'.format(data_dir, x), mmap_mode='r').shape[0] for x in file_list])
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int).tolist()
+    fp = np.load('{}/flightplan data/{}'.format(data_dir, file_list[0]), mmap_mode='r')
+    weather = np.load('{}/weather data/{}/{}'.format(data_dir, weather_dir, file_list[0]), mmap_mode='r')
+
+    # a flight of n points has n-1 weather cubes
+    fp_all = np.lib.format.open_memmap(prefix + '_fp.npy', mode='w+', dtype=np.float32, shape=(offsets[-1], fp.shape[1]))
+    traj_all = np.lib.format.open_memmap(prefix + '_traj.npy', mode='w+', dtype=np.float32, shape=(offsets[-1], fp.shape[1]))
+    weather_all = np.lib.format.open_memmap(prefix + '_weather.npy', mode='w+', dtype=np.float32,
+                                            shape=(offsets[-1] - len(file_list),) + weather.shape[1:])
+
+    weather_max = 0.
+    for i in range(len(file_list)):
+        weather = np.load('{}/weather data/{}/{}'.format(data_dir, weather_dir, file_list[i]))
+        fp_all[offsets[i]:offsets[i+1]] = np.load('{}/flightplan data/{}'.format(data_dir, file_list[i]))
+        traj_all[offsets[i]:offsets[i+1]] = np.load('{}/trajectory data/{}'.format(data_dir, file_list[i]))
+        weather_all[offsets[i]-i:offsets[i+1]-i-1] = weather
+        weather_max = max(weather_max, float(np.amax(weather)))
+    for x in [fp_all, traj_all, weather_all]:
+        x.flush()
+    del fp_all, traj_all, weather_all
+
+    index = {'names': file_list,
+             'size': len(file_list),
+             'offsets': offsets,
+             'weather_max': weather_max}
+    with open(out_file, 'w') as f:
+        json.dump(index, f)
+
+    print("Packed {} flights with {} points into {}.".format(len(file_list), offsets[-1], out_file))
+    return out_file
+
+
+def bucket_batches(lengths, batch_size, pool=50):
+    # input: length of every flight, batch size and the number of batches sorted together
+    # output: positions of the flights of every batch, flights of similar length share a batch and the batches come
+    #         in random order
+    order = np.random.permutation(len(lengths))
+    batches = []
+    for i in range(0, len(order), batch_size * pool):
+        chunk = order[i:i + batch_size * pool]
+        chunk = chunk[np.argsort(lengths[chunk], kind='mergesort')]
+        batches += [chunk[j:j + batch_size] for j in range(0, len(chunk), batch_size)]
+    np.random.shuffle(batches)
+    return batches
+
+
+def normalize_position(x):
+    # input: flight plans or trajectories (n x dimension x 3)
+    # output: normalized latitude and longitude (n x dimension x 2)
+    x = np.array(x, dtype=np.float32)
+    x[:, :, 0] = (x[:, :, 0] - lat_min) / (lat_max - lat_min)  # normalize lat
+    x[:, :, 1] = (x[:, :, 1] - lon_min) / (lon_max - lon_min)  # normalize lon
+    return x[:, :, 0:2]
+
+
+def normalize_weather(x, weather_max):
+    # input: weather cubes (n x dimension-1 x cube size x cube size) and the max over the dataset
+    # output: weather cubes clipped to 0 and scaled, with a channel axis
+    x = np.array(x, dtype=np.float32)
+    x[x < 0] = 0
+    x /= weather_max
+    return np.expand_dims(x, axis=4)
+
+
+def compact_weather(x, weather_dtype='float32'):
+    # input: normalized weather cubes in [0, 1] and the host dtype, 'float32', 'float16' or 'uint8'
+    # output: weather cubes in the host dtype, uint8 is scaled to 0-255 and values above the model max saturate
+    if weather_dtype not in weather_scale:
+        raise ValueError("weather_dtype should be one of {}".format(sorted(weather_scale)))
+    if weather_dtype == 'uint8':
+        return np.round(np.clip(x, 0, 1) * weather_scale[weather_dtype]).astype(np.uint8)
+    return x.astype(weather_dtype, copy=False)
+
+
+class packed_dataset(object):
+
+    def __init__(self, path, weather_dtype='float32', weather_max=None):
+        self.weather_dtype = weather_dtype
+        self.records = np.load(path, mmap_mode='r')
+        with open(os.path.splitext(path)[0] + '.json') as f:
+            self.index = json.load(f)
+
+        self.file_list = self.index['names']
+        self.weather_max = self.index['weather_max'] if weather_max is None else weather_max  # max of the model data
+
+    def __len__(self):
+        return len(self.records)
+
+    def flight_plan(self, idx):
+        return normalize_position(self.records['fp'][idx])
+
+    def trajectory(self, idx):
+        return normalize_position(self.records['traj'][idx])
+
+    def weather(self, idx):
+        return compact_weather(normalize_weather(self.records['weather'][idx], self.weather_max), self.weather_dtype)
+
+    def batch(self, idx):
+        # input: flight indices of the batch
+        # output: normalized flight plan, weather cube and trajectory of the batch
+        idx = np.asarray(idx)
+        return self.flight_plan(idx), self.weather(idx), self.trajectory(idx)
+
+
+class concat_dataset(object):
+    # packed datasets read as one, e.g. newly packed days followed by the archive
+
+    def __init__(self, datasets):
+        self.datasets = datasets
+        self.offsets = np.cumsum([0] + [len(x) for x in datasets])
+        self.file_list = [x for data in datasets for x in data.file_list]
+        self.weather_max = datasets[0].weather_max
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def gather(self, field, idx):
+        # input: name of the packed_dataset method and global flight indices
+        # output: result of the method for the flights, in the order of idx
+        idx = np.asarray(idx)
+        part = np.searchsorted(self.offsets, idx, side='right') - 1
+        out = None
+        for k in np.unique(part):
+            values = getattr(self.datasets[k], field)(idx[part == k] - self.offsets[k])
+            if out is None:
+                out = np.empty((len(idx),) + values.shape[1:], dtype=values.dtype)
+            out[part == k] = values
+        return out
+
+    def flight_plan(self, idx):
+        return self.gather('flight_plan', idx)
+
+    def trajectory(self, idx):
+        return self.gather('trajectory', idx)
+
+    def weather(self, idx):
+        return self.gather('weather', idx)
+
+    def batch(self, idx):
+        return self.flight_plan(idx), self.weather(idx), self.trajectory(idx)
+
+
+class ragged_dataset(object):
+    # variable length flights of pack_ragged_dataset, batches are padded with zeros to the longest flight
+
+    def __init__(self, path, weather_dtype='float32', weather_max=None):
+        self.weather_dtype = weather_dtype
+        with open(path) as f:
+            self.index = json.load(f)
+        prefix = os.path.splitext(path)[0]
+        self.fp = np.load(prefix + '_fp.npy', mmap_mode='r')
+        self.traj = np.load(prefix + '_traj.npy', mmap_mode='r')
+        self.records_weather = np.load(prefix + '_weather.npy', mmap_mode='r')
+
+        self.file_list = self.index['names']
+        self.weather_max = self.index['weather_max'] if weather_max is None else weather_max  # max of the model data
+        self.offsets = np.asarray(self.index['offsets'])
+        self.lengths = np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @staticmethod
+    def pad(values, start, lengths):
+        # input: ragged values, first row and length of every flight
+        # output: values of the flights padded to the longest one (n x max length x ...) and the padding mask
+        valid = np.arange(lengths.max()) < lengths[:, None]
+        out = values[np.where(valid, start[:, None] + np.arange(lengths.max()), 0)]
+        return out, valid
+
+    def flight_plan(self, idx):
+        x, valid = self.pad(self.fp, self.offsets[idx], self.lengths[idx])
+        x = normalize_position(x)
+        x[~valid] = 0
+        return x
+
+    def trajectory(self, idx):
+        x, valid = self.pad(self.traj, self.offsets[idx], self.lengths[idx])
+        x = normalize_position(x)
+        x[~valid] = 0
+        return x
+
+    def weather(self, idx):
+        idx = np.asarray(idx)
+        x, valid = self.pad(self.records_weather, self.offsets[idx] - idx, self.lengths[idx] - 1)
+        x = normalize_weather(x, self.weather_max)
+        x[~valid] = 0
+        return compact_weather(x, self.weather_dtype)
+
+    def batch(self, idx):
+        # input: flight indices of the batch
+        # output: padded flight plan, weather cube and trajectory of the batch and the length of every flight
+        idx = np.asarray(idx)
+        return self.flight_plan(idx), self.weather(idx), self.trajectory(idx), self.lengths[idx]
+
+
+if __name__ == '__main__':
+
+    input_dimension = 50  # number of trajectory points in the data
+
+    pack_dataset('training data/{}'.format(input_dimension))
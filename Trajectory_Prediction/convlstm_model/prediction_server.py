@@ -0,0 +1,239 @@
+"""
+Local trajectory prediction server for the conv-LSTM model.
+The exported weights (numpy_inference.export_weights) are loaded once and the server answers on local HTTP:
+POST /predict with a json body
+    {"flight_plan": [[lat, lon], ...], "weather": [cube, ...]}  raw weather cubes, one less than the flight plan
+    {"flight_plan": [[lat, lon], ...], "unix_time": [t, ...]}  time of every flight plan point, cubes built from CIWS
+    optional "start": [lat, lon], the first trajectory point
+returns {"trajectory": [[lat, lon], ...], "latency": seconds, "batch_size": flights in the same run}.
+GET /stats returns the request count, batch sizes and latency percentiles.
+Concurrent requests are queued and coalesced into micro-batches, one numpy run per batch.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue, Empty
+import numpy as np
+from numpy_inference import numpy_weather_lstm
+
+
+class prediction_request(object):
+
+    def __init__(self, fp, weather, start):
+        self.fp = fp
+        self.weather = weather
+        self.start = start
+        self.arrival = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.batch_size = 0
+
+
+class prediction_server(object):
+
+    def __init__(self, cfg):
+        self.model = numpy_weather_lstm(cfg['weights_file'])
+        self.host = cfg.get('host', '127.0.0.1')
+        self.port = cfg.get('port', 8000)
+        self.max_batch_size = cfg.get('max_batch_size', 64)  # flights per numpy run
+        self.max_wait = cfg.get('max_wait', 0.005)  # seconds to wait for more requests before a run
+        self.weather_path = cfg.get('weather_path')  # CIWS folder to build cubes from unix_time, None to disable
+        self.cube_size = cfg.get('cube_size', 20)
+        self.resize_ratio = cfg.get('resize_ratio', 1)
+        self.frame_cache_size = cfg.get('frame_cache_size', 16)  # decoded weather files kept in memory
+
+        self.queue = Queue()
+        self.frames = OrderedDict()
+        self.frame_lock = threading.Lock()
+
+        # statistics of the latest requests
+        self.stats_lock = threading.Lock()
+        self.num_requests = 0
+        self.num_batches = 0
+        self.latency = deque(maxlen=10000)
+        self.batch_sizes = deque(maxlen=10000)
+
+    def weather_frame(self, weather_file):
+        # input: path of a CIWS echo top file
+        # output: echo top values, decoded once and kept in a small LRU cache
+        with self.frame_lock:
+            if weather_file in self.frames:
+                self.frames.move_to_end(weather_file)
+                return self.frames[weather_file]
+
+        from netCDF4 import Dataset
+        data = Dataset(weather_file)
+        values = np.ma.filled(np.squeeze(data.variables['ECHO_TOP']), 0)
+        data.close()
+
+        with self.frame_lock:
+            self.frames[weather_file] = values
+            while len(self.frames) > self.frame_cache_size:
+                self.frames.popitem(last=False)
+        return values
+
+    def build_cubes(self, fp, unix_time):
+        # input: flight plan (n x 2) in degrees and the time of every point
+        # output: weather cubes (n-1 x cube size x cube size) along the flight plan, same as weather_cube_generator
+        if self.weather_path is None:
+            raise ValueError("weather_path is not set, send the weather cubes")
+        utils_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')  # utils of Trajectory_Prediction
+        if utils_dir not in sys.path:
+            sys.path.append(utils_dir)
+        from utils import cube_geometry, cube_index, find_mean_index, check_convective_weather_files
+
+        geometry = cube_geometry(fp[:, 1], fp[:, 0])
+        x_i, y_i = cube_index(geometry, self.cube_size, 1, self.resize_ratio)
+
+        cubes = np.zeros((len(fp) - 1, self.cube_size, self.cube_size), dtype=np.float32)
+        weather_files = [check_convective_weather_files(self.weather_path, x) for x in unix_time[1:]]
+        for weather_file in set(weather_files):
+            idx = [i for i in range(len(weather_files)) if weather_files[i] == weather_file]
+            cubes[idx] = find_mean_index(self.weather_frame(weather_file), x_i[idx], y_i[idx], self.resize_ratio)
+        return cubes
+
+    def parse(self, body):
+        # input: json body of a request
+        # output: prediction_request
+        fp = np.asarray(body['flight_plan'], dtype=np.float32)[:, 0:2]
+        if 'weather' in body:
+            weather = np.asarray(body['weather'], dtype=np.float32)
+        else:
+            weather = self.build_cubes(fp, body['unix_time'])
+        if weather.shape[0] != fp.shape[0] - 1:
+            raise ValueError("expect {} weather cubes, got {}".format(fp.shape[0] - 1, weather.shape[0]))
+        if weather.shape[1:] != (self.cube_size, self.cube_size):
+            raise ValueError("expect {} x {} weather cubes, got {}".format(self.cube_size, self.cube_size,
+                                                                         ' x '.join(str(x) for x in weather.shape[1:])))
+        start = np.asarray(body['start'], dtype=np.float32) if 'start' in body else fp[0]
+        if start.shape != (2,):
+            raise ValueError("expect start as [lat, lon], got shape {}".format(start.shape))
+        return prediction_request(fp, weather, start)
+
+    def predict(self, request):
+        # queue the request and wait for its micro-batch
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def batch_worker(self):
+
+        while True:
+            batch = [self.queue.get()]
+
+            # gather more requests until the batch is full or the wait is over
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch += [self.queue.get(timeout=max(deadline - time.time(), 0))]
+                except Empty:
+                    break
+
+            # flight plans of the same length and weather cubes of the same shape run together
+            groups = {}
+            for request in batch:
+                groups.setdefault((request.fp.shape, request.weather.shape), []).append(request)
+            for group in groups.values():
+                try:
+                    y_pred = self.model.predict(np.stack([x.fp for x in group]), np.stack([x.weather for x in group]),
+                                                np.stack([x.start for x in group]))
+                    for i in range(len(group)):
+                        group[i].result = y_pred[i]
+                except Exception as e:
+                    for request in group:
+                        request.error = e
+
+            now = time.time()
+            with self.stats_lock:
+                self.num_requests += len(batch)
+                self.num_batches += 1
+                self.batch_sizes.append(len(batch))
+                for request in batch:
+                    request.batch_size = len(batch)
+                    self.latency.append(now - request.arrival)
+            for request in batch:
+                request.done.set()
+
+    def stats(self):
+
+        with self.stats_lock:
+            latency = np.asarray(self.latency)
+            batch_sizes = np.asarray(self.batch_sizes)
+            stats = {'requests': self.num_requests, 'batches': self.num_batches}
+        if len(latency):
+            stats['mean_batch_size'] = float(np.mean(batch_sizes))
+            stats['max_batch_size'] = int(np.max(batch_sizes))
+            stats['latency_p50'] = float(np.percentile(latency, 50))
+            stats['latency_p95'] = float(np.percentile(latency, 95))
+            stats['latency_max'] = float(np.max(latency))
+        return stats
+
+    def run(self):
+
+        server = self
+
+        class handler(BaseHTTPRequestHandler):
+
+            def reply(self, code, body):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == '/stats':
+                    self.reply(200, server.stats())
+                else:
+                    self.reply(404, {'error': 'unknown path {}'.format(self.path)})
+
+            def do_POST(self):
+                if self.path != '/predict':
+                    self.reply(404, {'error': 'unknown path {}'.format(self.path)})
+                    return
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                    request = server.parse(body)
+                    y_pred = server.predict(request)
+                except Exception as e:
+                    self.reply(400, {'error': str(e)})
+                    return
+                self.reply(200, {'trajectory': y_pred.tolist(),
+                                 'latency': time.time() - request.arrival,
+                                 'batch_size': request.batch_size})
+
+            def log_message(self, format, *args):  # per request stats are in /stats
+                pass
+
+        threading.Thread(target=self.batch_worker, daemon=True).start()
+        httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        print("Serving predictions on http://{}:{}".format(self.host, self.port))
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        httpd.server_close()
+        print(json.dumps(self.stats()))
+
+
+if __name__ == '__main__':
+
+    cfg = {'weights_file': './Epoch_1002_Dimension_50/weights.npz',  # from numpy_inference.export_weights
+           'port': 8000,
+           'max_batch_size': 64,  # flights per numpy run
+           'max_wait': 0.005,  # seconds to wait for more requests before a run
+           'weather_path': '/mnt/data/Research/data/',  # CIWS folder to build cubes from unix_time
+           'cube_size': 20,  # weather cube size, same as the training data
+           }
+
+    fun = prediction_server(cfg)
+    fun.run()
@@ -0,0 +1,74 @@
+"""
+Streaming trajectory prediction with the conv-LSTM model.
+The hidden and cell tensors of every flight are kept between updates, each update takes the next flight plan point
+and weather cube of a group of flights and runs one batched step of numpy_weather_lstm, so a new position costs one
+step instead of a run from departure.
+"""
+
+import numpy as np
+from packed_data import normalize_position, normalize_weather
+from numpy_inference import numpy_weather_lstm, denormalize_position
+
+
+class streaming_predictor(object):
+
+    def __init__(self, weights_file):
+        self.model = numpy_weather_lstm(weights_file)
+        if self.model.weather_max is None:
+            raise ValueError("weather_max is not in the weights file {}".format(weights_file))
+
+        self.state = {}  # flight to (hidden tensor, cell tensor, number of steps)
+
+    def start(self, flights, start_points):
+        # input: flight ids and their first trajectory point (n x 2) in degrees
+        h_t, c_t = self.model.initial_state(normalize_position(np.asarray(start_points)[:, None, :])[:, 0, :])
+        for i in range(len(flights)):
+            self.state[flights[i]] = (h_t[i], c_t[i], 0)
+
+    def update(self, flights, fp_points, weather_cubes):
+        # input: flight ids, their current flight plan point (n x 2) in degrees and weather cube (n x cube size x
+        #        cube size), flights not started use the flight plan point as the first trajectory point
+        # output: next predicted position (n x 2) in degrees
+        fp_points = np.asarray(fp_points)
+        new = [i for i in range(len(flights)) if flights[i] not in self.state]
+        if new:
+            self.start([flights[i] for i in new], fp_points[new])
+
+        # one batched step for all flights of the update
+        h_t = np.stack([self.state[x][0] for x in flights])
+        c_t = np.stack([self.state[x][1] for x in flights])
+        x_t = normalize_position(fp_points[:, None, :])[:, 0, :]
+        weather = normalize_weather(np.asarray(weather_cubes)[:, None], self.model.weather_max)
+        x_embed_t = self.model.encode_weather(weather)[:, 0, :]
+        y_t, h_t, c_t = self.model.cell(h_t, c_t, x_t, x_embed_t)
+
+        for i in range(len(flights)):
+            self.state[flights[i]] = (h_t[i], c_t[i], self.state[flights[i]][2] + 1)
+        return denormalize_position(y_t)
+
+    def steps(self, flight):
+        return self.state[flight][2] if flight in self.state else 0
+
+    def end(self, flights):
+        # drop the state of landed flights
+        for x in flights:
+            self.state.pop(x, None)
+
+    def __len__(self):
+        return len(self.state)
+
+
+if __name__ == '__main__':
+
+    from packed_data import packed_dataset
+
+    data = packed_dataset('training data/50/packed_JFK2LAX_ET.npy')
+    fun = streaming_predictor('./Epoch_1002_Dimension_50/weights.npz')
+
+    # replay the flights step by step, all flights in one batched update
+    flights = data.file_list
+    fp, weather = data.records['fp'], data.records['weather']
+    for t in range(weather.shape[1]):
+        position = fun.update(flights, fp[:, t, 0:2], weather[:, t])
+        print("Step {}: predicted {} flights.".format(t+1, len(position)))
+    fun.end(flights)
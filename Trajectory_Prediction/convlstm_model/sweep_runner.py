@@ -0,0 +1,148 @@
+"""
+Hyperparameter sweep of the conv-LSTM model on CPU.
+Every combination of the grid trains train_weather_lstm in its own worker process and several runs go at a time.
+The packed records of each data folder are written once and memory-mapped by all runs, the threads of every run are
+limited so the runs share the cores, and the losses, wall clock and throughput of the runs go to one results csv.
+"""
+
+import os
+import sys
+import csv
+import time
+import itertools
+import multiprocessing
+import numpy as np
+from packed_data import pack_dataset
+
+result_fields = ['final_train_loss', 'final_test_loss', 'best_test_loss', 'best_epoch', 'epochs', 'train_flights',
+                 'wall_time', 'flights_per_second', 'error']
+
+
+def limit_threads(num_threads):
+    # blas and openmp read these when numpy and tensorflow are imported, numpy is already loaded in this process,
+    # so they only take effect in the spawned workers, which inherit the environment and import numpy afresh
+    for x in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+        os.environ[x] = str(num_threads)
+
+
+def train_run(args):
+    # input: name of the run, its cfg of train_weather_lstm and the log file
+    # output: name of the run and its metrics
+    name, cfg, log_file = args
+    from training_model import train_weather_lstm
+
+    stdout = sys.stdout
+    start_time = time.time()
+    try:
+        with open(log_file, 'w') as sys.stdout:
+            fun = train_weather_lstm(cfg)
+            fun.train_model()
+    except Exception as e:
+        return name, {'error': repr(e), 'wall_time': time.time() - start_time}
+    finally:
+        sys.stdout = stdout
+    wall_time = time.time() - start_time
+
+    return name, {'final_train_loss': fun.train_loss[-1],
+                  'final_test_loss': fun.test_loss[-1],
+                  'best_test_loss': np.min(fun.test_loss),
+                  'best_epoch': int(np.argmin(fun.test_loss)) + 1,
+                  'epochs': len(fun.train_loss),
+                  'train_flights': fun.train_size,
+                  'wall_time': wall_time,
+                  'flights_per_second': fun.train_size * len(fun.train_loss) / wall_time}
+
+
+class sweep_runner(object):
+
+    def __init__(self, cfg):
+        self.base_cfg = cfg['base_cfg']  # cfg of train_weather_lstm shared by all runs
+        self.grid = cfg['grid']  # values of every swept key, each combination is one run
+        self.data_dir = cfg.get('data_dir', 'training data/{input_dimension}')  # formatted with the cfg of the run
+        self.weather_dir = cfg.get('weather_dir', 'JFK2LAX_ET')  # formatted with the cfg of the run
+        self.num_workers = cfg.get('num_workers', 4)  # runs at the same time
+        self.threads_per_run = cfg.get('threads_per_run', max(multiprocessing.cpu_count() // self.num_workers, 1))
+        self.sweep_dir = cfg.get('sweep_dir', './sweep')  # checkpoints and logs of the runs
+        self.results_file = cfg.get('results_file', '{}/results.csv'.format(self.sweep_dir))
+
+        if not os.path.exists(self.sweep_dir):
+            os.makedirs(self.sweep_dir)
+
+    def run_cfgs(self):
+        # output: name and cfg of every run of the grid
+        keys = sorted(self.grid)
+        runs = []
+        for values in itertools.product(*[self.grid[x] for x in keys]):
+            cfg = dict(self.base_cfg)
+            cfg.update(zip(keys, values))
+            name = '_'.join('{}_{}'.format(x, cfg[x]) for x in keys)
+
+            data_dir = self.data_dir.format(**cfg)
+            weather_dir = self.weather_dir.format(**cfg)
+            cfg['packed_data'] = '{}/packed_{}.npy'.format(data_dir, weather_dir)
+            cfg['save_dir'] = '{}/{}'.format(self.sweep_dir, name)
+            cfg['num_threads'] = self.threads_per_run
+            runs += [(name, cfg, data_dir, weather_dir)]
+        return runs
+
+    def prepare_data(self, runs):
+        # pack each data folder once, the runs memory-map the same records
+        for packed_file, data_dir, weather_dir in sorted(set((x[1]['packed_data'], x[2], x[3]) for x in runs)):
+            if not os.path.exists(packed_file):
+                pack_dataset(data_dir, weather_dir, packed_file)
+
+    def run(self):
+
+        runs = self.run_cfgs()
+        self.prepare_data(runs)
+        keys = sorted(self.grid)
+        cfgs = {x[0]: x[1] for x in runs}
+
+        print("Sweeping {} runs, {} at a time with {} threads each.".format(len(runs), self.num_workers,
+                                                                           self.threads_per_run))
+        start_time = time.time()
+
+        # one fresh interpreter per run, every run builds its own graph, a forked worker would keep the blas threads
+        # of this process
+        limit_threads(self.threads_per_run)
+        pool = multiprocessing.get_context('spawn').Pool(self.num_workers, maxtasksperchild=1)
+        tasks = [(x[0], x[1], '{}/{}.log'.format(self.sweep_dir, x[0])) for x in runs]
+
+        # rows are written as the runs finish, the table of an interrupted sweep is kept
+        with open(self.results_file, 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=['run'] + keys + result_fields)
+            writer.writeheader()
+            for name, metrics in pool.imap_unordered(train_run, tasks):
+                row = {'run': name}
+                row.update({x: cfgs[name][x] for x in keys})
+                row.update(metrics)
+                writer.writerow(row)
+                f.flush()
+                print("Finished {}: {}".format(name, metrics.get('error', metrics.get('final_test_loss'))))
+
+        pool.close()
+        pool.join()
+        print("Sweep done in {:.1f} seconds, results in {}.".format(time.time() - start_time, self.results_file))
+
+
+if __name__ == '__main__':
+
+    cfg = {'base_cfg': {'lr': 0.005,
+                        'epoch': 100,
+                        'batch_size': 64,
+                        'input_dimension': 50,
+                        'cube_size': 20,
+                        'split_ratio': 0.25,
+                        'weather_dtype': 'uint8',  # compact weather cubes, the runs share the cores and the memory
+                        },
+           'grid': {'lr': [0.001, 0.005, 0.01],
+                    'batch_size': [32, 64],
+                    'input_dimension': [50, 100],
+                    },
+           'data_dir': 'training data/{input_dimension}',  # packed once per input dimension
+           'num_workers': 4,  # runs at the same time
+           'sweep_dir': './sweep',
+           }
+
+    fun = sweep_runner(cfg)
+    fun.run()
@@ -1,6 +1,8 @@
 import os
+import json
 import numpy as np
 import tensorflow as tf
+from packed_data import packed_dataset, compact_weather, weather_scale
 
 
 class test_weather_lstm(object):
@@ -9,18 +11,31 @@ class test_weather_lstm(object):
         self.input_dimension = cfg['input_dimension']
         self.cube_size = cfg['cube_size']
         self.save_dir = cfg['save_dir']
+        self.packed_data = cfg.get('packed_data')  # packed records from packed_data.py, load the npy files if not given
+        self.weather_dtype = cfg.get('weather_dtype', 'float32')  # weather cubes on the host, 'float16' or 'uint8' to save memory
+        self.valid_batch_size = cfg.get('valid_batch_size', 256)  # flights per run with packed records
+
+        # weather normalization saved by training_model.py, the max of the loaded data if not found
+        self.weather_max = None
+        if os.path.exists('{}/normalization.json'.format(self.save_dir)):
+            with open('{}/normalization.json'.format(self.save_dir)) as f:
+                self.weather_max = json.load(f)['weather_max']
 
     def load_data(self):
 
+        if self.packed_data:
+            self.load_packed_data()
+            return
+
         print("Loading the testing data..............................................")
         # get file list
         self.file_list = sorted(os.listdir('training data/{}/weather data/JFK2LAX_ET'.format(self.input_dimension)))
         data_size = len(self.file_list)
 
         # create array to store files
-        x_fp = np.empty((data_size, self.input_dimension, 3), dtype=float)
-        x_weather = np.empty((data_size, self.input_dimension-1, self.cube_size, self.cube_size), dtype=float)
-        y_traj = np.empty((data_size, self.input_dimension, 3), dtype=float)
+        x_fp = np.empty((data_size, self.input_dimension, 3), dtype=np.float32)
+        x_weather = np.empty((data_size, self.input_dimension-1, self.cube_size, self.cube_size), dtype=np.float32)
+        y_traj = np.empty((data_size, self.input_dimension, 3), dtype=np.float32)
 
         # load files and store into one array
         for i in range(data_size):
@@ -42,8 +57,8 @@ class test_weather_lstm(object):
 
         # normalize weather cubes, clip to 0
         x_weather[x_weather < 0] = 0
-        x_weather = x_weather/np.amax(x_weather)
-        x_weather = np.expand_dims(x_weather, axis=4)
+        x_weather /= self.weather_max if self.weather_max else np.amax(x_weather)
+        x_weather = compact_weather(np.expand_dims(x_weather, axis=4), self.weather_dtype)
 
         # only consider 2d case now
         self.valid_x_fp = x_fp[:, :, 0:2]
@@ -52,6 +67,27 @@ class test_weather_lstm(object):
 
         print("Done loading the validation data.")
 
+    def load_packed_data(self):
+
+        print("Loading the testing data..............................................")
+        self.data = packed_dataset(self.packed_data, self.weather_dtype, self.weather_max)
+        self.file_list = self.data.file_list
+
+        # weather cubes are read from the packed records batch by batch in valid_model
+        all_idx = np.arange(len(self.data))
+        self.valid_x_fp = self.data.flight_plan(all_idx)
+        self.valid_y_traj = self.data.trajectory(all_idx)
+        self.valid_weather = None
+
+        print("Done loading the validation data.")
+
+    def weather_input(self):
+
+        # compact weather cubes are cast to float32 in the graph
+        if self.weather_dtype == 'float32':
+            return self.x_weather
+        return tf.cast(self.x_weather, tf.float32) / weather_scale[self.weather_dtype]
+
     def inverse_normalization(self, tensor):
 
         lat_max = 53.8742945085336
@@ -93,33 +129,37 @@ class test_weather_lstm(object):
         c_t_0 = y_true[:, 0, :]
         h_t_0 = y_true[:, 0, :]
 
-        x_t = x[:, 0, :]
-        self.y_pred = tf.expand_dims(x[:, 0, :], axis=1)
-
-        for t in range(time_steps-1):
-
-            # convnet layers
-            x_conv1 = tf.layers.conv2d(x_conv[:, t, :, :],
-                                       filters=2,
-                                       strides=2,
-                                       kernel_size=6,
-                                       padding='valid',
-                                       activation=tf.nn.relu,
-                                       name='conv1',
-                                       reuse=tf.AUTO_REUSE)
-
-            x_conv2 = tf.layers.conv2d(x_conv1,
-                                       filters=4,
-                                       strides=2,
-                                       kernel_size=3,
-                                       padding='valid',
-                                       activation=tf.nn.relu,
-                                       name='conv2',
-                                       reuse=tf.AUTO_REUSE)
-
-            x_flat1 = tf.reshape(x_conv2, [-1, 3*3*4])
-            x_fc1 = tf.layers.dense(x_flat1, 16, activation=tf.nn.relu, name='fc1', reuse=tf.AUTO_REUSE)
-            x_fc2 = tf.layers.dense(x_fc1, 4, activation=tf.nn.relu, name='fc2', reuse=tf.AUTO_REUSE)
+        # convnet layers run once over all time steps, the weather encoder does not depend on the hidden tensor
+        x_conv_steps = tf.reshape(x_conv, [-1] + x_conv.get_shape().as_list()[2:])
+        x_conv1 = tf.layers.conv2d(x_conv_steps,
+                                   filters=2,
+                                   strides=2,
+                                   kernel_size=6,
+                                   padding='valid',
+                                   activation=tf.nn.relu,
+                                   name='conv1',
+                                   reuse=tf.AUTO_REUSE)
+
+        x_conv2 = tf.layers.conv2d(x_conv1,
+                                   filters=4,
+                                   strides=2,
+                                   kernel_size=3,
+                                   padding='valid',
+                                   activation=tf.nn.relu,
+                                   name='conv2',
+                                   reuse=tf.AUTO_REUSE)
+
+        x_flat1 = tf.reshape(x_conv2, [-1, 3*3*4])
+        x_fc1 = tf.layers.dense(x_flat1, 16, activation=tf.nn.relu, name='fc1', reuse=tf.AUTO_REUSE)
+        x_fc2 = tf.layers.dense(x_fc1, 4, activation=tf.nn.relu, name='fc2', reuse=tf.AUTO_REUSE)
+        x_embed = tf.reshape(x_fc2, [-1, time_steps-1, 4])
+
+        def lstm_step(t, h_t_0, c_t_0):
+
+            x_t = x[:, t, :]
+
+            # weather embedding of the step
+            x_fc2 = x_embed[:, t, :]
 
             # x_t_2 = x_t * x_fc2
             # h_x = tf.concat([h_t_0, x_t_2], 1)
@@ -139,13 +179,26 @@ class test_weather_lstm(object):
             # hidden tensor
             h_t = o_t * tf.nn.tanh(c_t)
 
-            # update parameters
-            h_t_0 = h_t
-            c_t_0 = c_t
+            return f_t, h_t, c_t, h_t
+
+        # the first step is built outside the loop, layer variables of the step are created outside control flow
+        f_t, h_t_0, c_t_0, h_t = lstm_step(0, h_t_0, c_t_0)
+        y_steps = tf.TensorArray(tf.float32, size=time_steps-1).write(0, h_t)
+
+        def loop_body(t, h_t_0, c_t_0, y_steps):
+            _, h_t_0, c_t_0, h_t = lstm_step(t, h_t_0, c_t_0)
+            return t+1, h_t_0, c_t_0, y_steps.write(t, h_t)
+
+        # steps in between run in a symbolic loop, the graph size does not depend on the number of steps
+        _, h_t_0, c_t_0, y_steps = tf.while_loop(lambda t, h_t_0, c_t_0, y_steps: t < time_steps-2, loop_body,
+                                                 [tf.constant(1), h_t_0, c_t_0, y_steps])
 
-            x_t = x[:, t+1, :]
+        # the last step is built after the loop, the gradient to its forget gate is taken
+        if time_steps-2 > 0:
+            f_t, h_t_0, c_t_0, h_t = lstm_step(time_steps-2, h_t_0, c_t_0)
+            y_steps = y_steps.write(time_steps-2, h_t)
 
-            self.y_pred = tf.concat([self.y_pred, tf.expand_dims(h_t, axis=1)], axis=1)
+        self.y_pred = tf.concat([tf.expand_dims(x[:, 0, :], axis=1), tf.transpose(y_steps.stack(), [1, 0, 2])], axis=1)
 
         self.loss = tf.reduce_mean(tf.sqrt(tf.square(self.y_pred[:, :, 0] - y_true[:, :, 0]) +
                                            tf.square(self.y_pred[:, :, 1] - y_true[:, :, 1])), axis=None)
@@ -178,33 +231,37 @@ class test_weather_lstm(object):
         c_t_0 = y_true[:, 0, :]
         h_t_0 = tf.layers.dense(y_true[:, 0, :], dim_hid-4-2, activation=tf.nn.relu, name='fc_in', reuse=tf.AUTO_REUSE)
 
-        x_t = x[:, 0, :]
-        self.y_pred = tf.expand_dims(x[:, 0, :], axis=1)
-
-        for t in range(time_steps-1):
-
-            # convnet layers
-            x_conv1 = tf.layers.conv2d(x_conv[:, t, :, :],
-                                       filters=2,
-                                       strides=2,
-                                       kernel_size=6,
-                                       padding='valid',
-                                       activation=tf.nn.relu,
-                                       name='conv1',
-                                       reuse=tf.AUTO_REUSE)
-
-            x_conv2 = tf.layers.conv2d(x_conv1,
-                                       filters=4,
-                                       strides=2,
-                                       kernel_size=3,
-                                       padding='valid',
-                                       activation=tf.nn.relu,
-                                       name='conv2',
-                                       reuse=tf.AUTO_REUSE)
-
-            x_flat1 = tf.reshape(x_conv2, [-1, 3*3*4])
-            x_fc1 = tf.layers.dense(x_flat1, 16, activation=tf.nn.relu, name='fc1', reuse=tf.AUTO_REUSE)
-            x_fc2 = tf.layers.dense(x_fc1, 4, activation=tf.nn.relu, name='fc2', reuse=tf.AUTO_REUSE)
+        # convnet layers run once over all time steps, the weather encoder does not depend on the hidden tensor
+        x_conv_steps = tf.reshape(x_conv, [-1] + x_conv.get_shape().as_list()[2:])
+        x_conv1 = tf.layers.conv2d(x_conv_steps,
+                                   filters=2,
+                                   strides=2,
+                                   kernel_size=6,
+                                   padding='valid',
+                                   activation=tf.nn.relu,
+                                   name='conv1',
+                                   reuse=tf.AUTO_REUSE)
+
+        x_conv2 = tf.layers.conv2d(x_conv1,
+                                   filters=4,
+                                   strides=2,
+                                   kernel_size=3,
+                                   padding='valid',
+                                   activation=tf.nn.relu,
+                                   name='conv2',
+                                   reuse=tf.AUTO_REUSE)
+
+        x_flat1 = tf.reshape(x_conv2, [-1, 3*3*4])
+        x_fc1 = tf.layers.dense(x_flat1, 16, activation=tf.nn.relu, name='fc1', reuse=tf.AUTO_REUSE)
+        x_fc2 = tf.layers.dense(x_fc1, 4, activation=tf.nn.relu, name='fc2', reuse=tf.AUTO_REUSE)
+        x_embed = tf.reshape(x_fc2, [-1, time_steps-1, 4])
+
+        def lstm_step(t, h_t_0, c_t_0):
+
+            x_t = x[:, t, :]
+
+            # weather embedding of the step
+            x_fc2 = x_embed[:, t, :]
 
             # x_t_2 = x_t * x_fc2
             # h_x = tf.concat([h_t_0, x_t_2], 1)
@@ -227,16 +284,27 @@ class test_weather_lstm(object):
 
             h_t_new = tf.layers.dense(h_t, dim_hid-4-2, activation=tf.nn.relu, name='fc_mid',
                                       reuse=tf.AUTO_REUSE)
-            # update parameters
-            h_t_0 = h_t_new
-            c_t_0 = c_t
 
-            x_t = x[:, t+1, :]
+            return f_t, h_t_new, c_t, h_t
 
-            #self.y_pred = tf.concat([self.y_pred, tf.expand_dims(h_t, axis=1)], axis=1)
-            #h_out = tf.layers.dense(tf.reshape(h_t, [-1, self.batch_size*100]), 2, activation=tf.nn.relu, name='fc_out', reuse=tf.AUTO_REUSE)
-            self.y_pred = tf.concat([self.y_pred, tf.expand_dims(h_t, axis=1)], axis=1)
+        # the first step is built outside the loop, layer variables of the step are created outside control flow
+        f_t, h_t_0, c_t_0, h_t = lstm_step(0, h_t_0, c_t_0)
+        y_steps = tf.TensorArray(tf.float32, size=time_steps-1).write(0, h_t)
 
+        def loop_body(t, h_t_0, c_t_0, y_steps):
+            _, h_t_0, c_t_0, h_t = lstm_step(t, h_t_0, c_t_0)
+            return t+1, h_t_0, c_t_0, y_steps.write(t, h_t)
+
+        # steps in between run in a symbolic loop, the graph size does not depend on the number of steps
+        _, h_t_0, c_t_0, y_steps = tf.while_loop(lambda t, h_t_0, c_t_0, y_steps: t < time_steps-2, loop_body,
+                                                 [tf.constant(1), h_t_0, c_t_0, y_steps])
+
+        # the last step is built after the loop, the gradient to its forget gate is taken
+        if time_steps-2 > 0:
+            f_t, h_t_0, c_t_0, h_t = lstm_step(time_steps-2, h_t_0, c_t_0)
+            y_steps = y_steps.write(time_steps-2, h_t)
+
+        self.y_pred = tf.concat([tf.expand_dims(x[:, 0, :], axis=1), tf.transpose(y_steps.stack(), [1, 0, 2])], axis=1)
 
         self.loss = tf.reduce_mean(tf.sqrt(tf.square(self.y_pred[:, :, 0] - y_true[:, :, 0]) +
                                            tf.square(self.y_pred[:, :, 1] - y_true[:, :, 1])), axis=None)
@@ -248,7 +316,7 @@ class test_weather_lstm(object):
 
     def valid_model(self):
 
-        self.x_weather = tf.placeholder(tf.float32, [None, self.input_dimension-1, self.cube_size, self.cube_size, 1])
+        self.x_weather = tf.placeholder(tf.as_dtype(self.weather_dtype), [None, self.input_dimension-1, self.cube_size, self.cube_size, 1])
         self.x_fp = tf.placeholder(tf.float32, [None, self.input_dimension, 2])
         self.y_traj = tf.placeholder(tf.float32, [None, self.input_dimension, 2])
         # self.x_weather = tf.placeholder(tf.float32, [None, 9, self.cube_size, self.cube_size, 1])
@@ -258,7 +326,7 @@ class test_weather_lstm(object):
 
         # build graph
         #self.conv_lstm_graph(self.x_fp, self.x_weather, self.y_traj, valid_size)
-        self.conv_lstm_graph_2(self.x_fp, self.x_weather, self.y_traj)
+        self.conv_lstm_graph_2(self.x_fp, self.weather_input(), self.y_traj)
 
         print("Start validation.")
 
@@ -271,12 +339,25 @@ class test_weather_lstm(object):
             # Restore latest checkpoint
             saver.restore(sess, tf.train.latest_checkpoint('./{}/'.format(self.save_dir)))
 
-            feed_value_validation = {self.x_weather: self.valid_weather,
-                                     self.x_fp: self.valid_x_fp,
-                                     self.y_traj: self.valid_y_traj,
-                                     valid_size: self.valid_weather.shape[0], }
-
-            self.y_pred = sess.run(self.y_pred, feed_dict=feed_value_validation)
+            if self.packed_data:
+                # run the packed records batch by batch
+                y_pred = []
+                for i in range(0, len(self.data), self.valid_batch_size):
+                    idx = np.arange(i, min(i + self.valid_batch_size, len(self.data)))
+                    feed_value_validation = {self.x_weather: self.data.weather(idx),
+                                             self.x_fp: self.valid_x_fp[idx],
+                                             self.y_traj: self.valid_y_traj[idx],
+                                             valid_size: len(idx), }
+                    y_pred += [sess.run(self.y_pred, feed_dict=feed_value_validation)]
+                self.y_pred = np.concatenate(y_pred)
+
+            else:
+                feed_value_validation = {self.x_weather: self.valid_weather,
+                                         self.x_fp: self.valid_x_fp,
+                                         self.y_traj: self.valid_y_traj,
+                                         valid_size: self.valid_weather.shape[0], }
+
+                self.y_pred = sess.run(self.y_pred, feed_dict=feed_value_validation)
 
         self.y_pred = self.inverse_normalization(self.y_pred)
         self.y_true = self.inverse_normalization(self.valid_y_traj)
@@ -400,6 +481,8 @@ if __name__ == '__main__':
     cfg = {'input_dimension': 50,  # number of trajectory points in the data
            'cube_size': 20,  # weather cube size
            'epoch': 1002,
+           # 'packed_data': 'training data/50/packed_JFK2LAX_ET.npy',  # packed records from packed_data.py
+           # 'weather_dtype': 'uint8',  # keep the weather cubes in uint8 on the host
            }
 
     cfg['save_dir'] = './Epoch_{}_Dimension_{}'.format(cfg['epoch'], cfg['input_dimension'])
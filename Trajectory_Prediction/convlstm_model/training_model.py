@@ -1,7 +1,10 @@
 import os
+import json
+import hashlib
 import numpy as np
 import tensorflow as tf
 from sklearn.model_selection import train_test_split
+from packed_data import packed_dataset, concat_dataset, ragged_dataset, bucket_batches, compact_weather, weather_scale
 
 
 class train_weather_lstm(object):
@@ -14,10 +17,33 @@ class train_weather_lstm(object):
         self.split_ratio = cfg['split_ratio']
         self.batch_size = cfg['batch_size']
         self.save_dir = cfg['save_dir']
+        self.packed_data = cfg.get('packed_data')  # packed records from packed_data.py, load the npy files if not given
+        self.weather_dtype = cfg.get('weather_dtype', 'float32')  # weather cubes on the host, 'float16' or 'uint8' to save memory
+        self.input_pipeline = cfg.get('input_pipeline', False)  # stream training batches from packed_data with tf.data
+        self.shuffle_buffer = cfg.get('shuffle_buffer', 1000)  # number of flights in the shuffle buffer
+        self.num_parallel_calls = cfg.get('num_parallel_calls', 4)  # flights decoded in parallel
+        self.pipeline_cache = cfg.get('pipeline_cache')  # '' caches decoded flights in memory, a file name on disk in save_dir
+        self.eval_every = cfg.get('eval_every', 0)  # batches between test evaluations, 0 evaluates once per epoch
+        self.eval_batch_size = cfg.get('eval_batch_size', 256)  # test flights per run in evaluation
+        self.checkpoint_every = cfg.get('checkpoint_every', 0)  # epochs between checkpoints, 0 saves the last epoch only
+        self.keep_checkpoints = cfg.get('keep_checkpoints', 5)  # checkpoints kept in save_dir for the evaluator
+        self.resume = cfg.get('resume', False)  # continue the latest checkpoint of save_dir up to epoch
+        self.incremental_data = cfg.get('incremental_data')  # packed records of new days, fine-tune on them for epoch more epochs
+        self.replay_ratio = cfg.get('replay_ratio', 0.)  # archive flights of packed_data replayed per new flight in incremental mode
+        self.tbptt_window = cfg.get('tbptt_window', 0)  # steps per window of truncated backpropagation, 0 for the full sequence
+        self.ragged_data = cfg.get('ragged_data')  # index of variable length flights from pack_ragged_dataset, batched by length
+        self.num_threads = cfg.get('num_threads', 0)  # cpu threads of the session, 0 lets tensorflow use all cores
+
+        # weather normalization of the model, kept in save_dir so resumed and incremental runs use the same scale
+        self.restore = self.resume or self.incremental_data is not None
+        self.weather_max = cfg.get('weather_max')  # scale of a model trained before normalization.json, the max of its weather data
+        if self.restore and os.path.exists('{}/normalization.json'.format(self.save_dir)):
+            with open('{}/normalization.json'.format(self.save_dir)) as f:
+                self.weather_max = json.load(f)['weather_max']
 
         if not os.path.exists(self.save_dir):
             os.makedirs(self.save_dir)
-        else:
+        elif not self.restore:
             for the_file in os.listdir(self.save_dir):
                 file_path = os.path.join(self.save_dir, the_file)
                 try:
@@ -26,17 +52,40 @@ class train_weather_lstm(object):
                 except Exception as e:
                     print(e)
 
+    def split_data(self, file_list):
+        # input: file names of the data
+        # output: train and test indices, a restored model keeps the test flights of save_dir/test_files.txt
+        if self.restore and os.path.exists('{}/test_files.txt'.format(self.save_dir)):
+            with open('{}/test_files.txt'.format(self.save_dir)) as f:
+                test_files = set(f.read().split())
+            is_test = np.array([x in test_files for x in file_list], dtype=bool)
+            return np.where(~is_test)[0], np.where(is_test)[0]
+
+        return train_test_split(np.arange(len(file_list)), test_size=self.split_ratio, shuffle=True, random_state=None)
+
     def load_data(self):
 
+        if self.ragged_data:
+            self.load_ragged_data()
+            return
+
+        if self.incremental_data:
+            self.load_incremental_data()
+            return
+
+        if self.packed_data:
+            self.load_packed_data()
+            return
+
         print("Loading Data................................")
         # get file list
         file_list = sorted(os.listdir('training data/{}/weather data/JFK2LAX_ET'.format(self.input_dimension)))
         data_size = len(file_list)
 
         # create array to store files
-        x_fp = np.empty((data_size, self.input_dimension, 3), dtype=float)
-        x_weather = np.empty((data_size, self.input_dimension-1, self.cube_size, self.cube_size), dtype=float)
-        y_traj = np.empty((data_size, self.input_dimension, 3), dtype=float)
+        x_fp = np.empty((data_size, self.input_dimension, 3), dtype=np.float32)
+        x_weather = np.empty((data_size, self.input_dimension-1, self.cube_size, self.cube_size), dtype=np.float32)
+        y_traj = np.empty((data_size, self.input_dimension, 3), dtype=np.float32)
 
         # load files and store into one array
         for i in range(data_size):
@@ -58,12 +107,17 @@ class train_weather_lstm(object):
 
         # normalize weather cubes, clip to 0
         x_weather[x_weather < 0] = 0
-        x_weather = x_weather/np.amax(x_weather)
-        x_weather = np.expand_dims(x_weather, axis=4)
-
-        # do train test split use sklearn function
-        self.train_x_fp, self.test_x_fp, self.train_x_weather, self.test_x_weather, self.train_y_traj, self.test_y_traj \
-            = train_test_split(x_fp, x_weather, y_traj, test_size=self.split_ratio, shuffle=True, random_state=None)
+        if self.weather_max is None:
+            self.weather_max = float(np.amax(x_weather))
+        x_weather /= self.weather_max
+        x_weather = compact_weather(np.expand_dims(x_weather, axis=4), self.weather_dtype)
+
+        # do train test split
+        train_idx, test_idx = self.split_data(file_list)
+        self.train_x_fp, self.test_x_fp = x_fp[train_idx], x_fp[test_idx]
+        self.train_x_weather, self.test_x_weather = x_weather[train_idx], x_weather[test_idx]
+        self.train_y_traj, self.test_y_traj = y_traj[train_idx], y_traj[test_idx]
+        self.test_files = np.array(file_list)[test_idx]
 
         # only consider 2d case now (longitude and latitude)
         #self.train_x_weather = self.train_x_weather[:, :, :, :, :]
@@ -73,13 +127,170 @@ class train_weather_lstm(object):
         self.test_x_fp = self.test_x_fp[:, :, 0:2]
         self.train_y_traj = self.train_y_traj[:, :, 0:2]
         self.test_y_traj = self.test_y_traj[:, :, 0:2]
+        self.train_size = self.train_x_fp.shape[0]
 
         print("Done loading the data!")
 
-    def conv_lstm_graph(self, x, x_conv, y_true, batch_size):
+    def load_packed_data(self):
 
-        # load data
-        self.load_data()
+        print("Loading Data................................")
+        self.data = packed_dataset(self.packed_data, self.weather_dtype, self.weather_max)
+        self.weather_max = self.data.weather_max
+
+        # split the flight indices, training batches are read from the packed records when used
+        self.train_idx, self.test_idx = self.split_data(self.data.file_list)
+        self.train_size = len(self.train_idx)
+        self.test_x_fp, self.test_x_weather, self.test_y_traj = self.data.batch(self.test_idx)
+        self.test_files = np.array(self.data.file_list)[self.test_idx]
+
+        print("Done loading the data!")
+
+    def load_ragged_data(self):
+
+        if self.input_pipeline or self.tbptt_window or self.incremental_data:
+            raise ValueError("ragged_data does not support input_pipeline, tbptt_window or incremental_data")
+
+        print("Loading Data................................")
+        self.data = ragged_dataset(self.ragged_data, self.weather_dtype, self.weather_max)
+        self.weather_max = self.data.weather_max
+
+        # test flights are sorted by length so the evaluation chunks carry little padding
+        self.train_idx, test_idx = self.split_data(self.data.file_list)
+        self.test_idx = test_idx[np.argsort(self.data.lengths[test_idx], kind='stable')]
+        self.train_size = len(self.train_idx)
+        self.test_files = np.array(self.data.file_list)[self.test_idx]
+
+        print("Done loading the data!")
+
+    def load_incremental_data(self):
+
+        if self.weather_max is None:
+            raise ValueError("incremental_data needs the checkpoint of a trained model in save_dir and its normalization.json "
+                             "or cfg['weather_max']")
+
+        print("Loading Data................................")
+        new_data = packed_dataset(self.incremental_data, self.weather_dtype, self.weather_max)
+        new_train_idx, new_test_idx = train_test_split(np.arange(len(new_data)), test_size=self.split_ratio,
+                                                       shuffle=True, random_state=None)
+
+        # archive flights for replay, the held out flights of the model stay out of training
+        self.replay_idx = np.array([], dtype=int)
+        datasets = [new_data]
+        if self.replay_ratio > 0:
+            if not self.packed_data:
+                raise ValueError("replay_ratio needs the archive in cfg['packed_data']")
+            old_data = packed_dataset(self.packed_data, self.weather_dtype, self.weather_max)
+            datasets += [old_data]
+            if os.path.exists('{}/test_files.txt'.format(self.save_dir)):
+                self.replay_idx = self.split_data(old_data.file_list)[0] + len(new_data)
+            else:
+                self.replay_idx = np.arange(len(old_data)) + len(new_data)
+
+        # new flights are indexed first, then the archive
+        self.data = concat_dataset(datasets)
+        self.train_idx = new_train_idx
+        self.train_size = len(self.train_idx) + min(int(self.replay_ratio * len(self.train_idx)), len(self.replay_idx))
+        self.test_x_fp, self.test_x_weather, self.test_y_traj = self.data.batch(new_test_idx)
+        self.test_files = np.array(new_data.file_list)[new_test_idx]
+
+        print("Fine-tuning on {} new flights with {} replayed flights per epoch.".
+              format(len(self.train_idx), self.train_size - len(self.train_idx)))
+        print("Done loading the data!")
+
+    def epoch_indices(self):
+        # output: flights of the epoch, new flights and a fresh sample of replayed archive flights in incremental mode
+        if not self.incremental_data:
+            return self.train_idx
+
+        replay = np.random.choice(self.replay_idx, self.train_size - len(self.train_idx), replace=False)
+        idx = np.concatenate([self.train_idx, replay]).astype(int)
+        np.random.shuffle(idx)
+        return idx
+
+    def weather_input(self):
+
+        # compact weather cubes are cast to float32 in the graph
+        if self.weather_dtype == 'float32':
+            return self.x_weather
+        return tf.cast(self.x_weather, tf.float32) / weather_scale[self.weather_dtype]
+
+    def train_batch(self, i):
+
+        if self.ragged_data:
+            return self.data.batch(self.epoch_batches[i])
+
+        if self.packed_data or self.incremental_data:
+            return self.data.batch(self.epoch_idx[self.batch_size * i:self.batch_size * (i+1)])
+
+        return (self.train_x_fp[self.batch_size * i:self.batch_size * (i+1), :, :],
+                self.train_x_weather[self.batch_size * i:self.batch_size * (i+1), :, :, :, :],
+                self.train_y_traj[self.batch_size * i:self.batch_size * (i+1), :, :])
+
+    def evaluate(self, sess):
+        # input: tensorflow session
+        # output: loss on the test set, run in chunks and averaged over the flights
+        if self.ragged_data:
+            # variable length flights are averaged over their points
+            loss_sum, points = 0., 0
+            for i in range(0, len(self.test_idx), self.eval_batch_size):
+                fp, weather, traj, lengths = self.data.batch(self.test_idx[i:i+self.eval_batch_size])
+                feed_value_test = {self.x_weather: weather, self.x_fp: fp, self.y_traj: traj, self.seq_len: lengths}
+                loss_sum += np.sum(lengths) * sess.run(self.loss, feed_dict=feed_value_test)
+                points += np.sum(lengths)
+            return loss_sum / points
+
+        loss_sum = 0.
+        for i in range(0, self.test_x_fp.shape[0], self.eval_batch_size):
+            if self.tbptt_window:
+                y_pred = self.run_windows(sess, self.test_x_fp[i:i+self.eval_batch_size],
+                                          self.test_x_weather[i:i+self.eval_batch_size],
+                                          self.test_y_traj[i:i+self.eval_batch_size])
+                loss_sum += len(y_pred) * self.sequence_loss(y_pred, self.test_y_traj[i:i+self.eval_batch_size])
+                continue
+            feed_value_test = {self.x_weather: self.test_x_weather[i:i+self.eval_batch_size, :, :, :, :],
+                               self.x_fp: self.test_x_fp[i:i+self.eval_batch_size, :, :],
+                               self.y_traj: self.test_y_traj[i:i+self.eval_batch_size, :, :], }
+            loss_sum += len(self.test_x_fp[i:i+self.eval_batch_size]) * sess.run(self.loss, feed_dict=feed_value_test)
+        return loss_sum / self.test_x_fp.shape[0]
+
+    def build_input_pipeline(self):
+
+        if not (self.packed_data or self.incremental_data):
+            raise ValueError("input_pipeline needs cfg['packed_data']")
+
+        def read_flight(i):
+            fp, weather, traj = self.data.batch([i])
+            return fp[0], weather[0], traj[0]
+
+        def set_shape(fp, weather, traj):
+            fp.set_shape([self.input_dimension, 2])
+            weather.set_shape([self.input_dimension-1, self.cube_size, self.cube_size, 1])
+            traj.set_shape([self.input_dimension, 2])
+            return fp, weather, traj
+
+        # decode flights in parallel, reshuffle every epoch and prepare the next batch while the current one runs
+        self.pipeline_idx = tf.placeholder(tf.int64, [None])  # flights of the epoch, fed at iterator initialization
+        dataset = tf.data.Dataset.from_tensor_slices(self.pipeline_idx)
+        dataset = dataset.map(lambda i: tuple(tf.py_func(read_flight, [i], [tf.float32, tf.as_dtype(self.weather_dtype), tf.float32])),
+                              num_parallel_calls=self.num_parallel_calls)
+        dataset = dataset.map(set_shape)
+        if self.pipeline_cache:
+            # a file cache ignores the indices fed after its first pass, it is only valid for one fixed training split
+            if self.incremental_data:
+                raise ValueError("a file pipeline_cache would freeze the replayed flights, use '' to cache in memory")
+            split_key = hashlib.md5(np.asarray(self.train_idx, dtype=np.int64).tobytes() +
+                                    self.weather_dtype.encode()).hexdigest()[:12]
+            dataset = dataset.cache('{}/{}_{}'.format(self.save_dir, os.path.basename(self.pipeline_cache), split_key))
+        elif self.pipeline_cache is not None:
+            dataset = dataset.cache(self.pipeline_cache)
+        dataset = dataset.shuffle(self.shuffle_buffer)
+        dataset = dataset.batch(self.batch_size, drop_remainder=True)
+        dataset = dataset.prefetch(2)
+
+        self.iterator = dataset.make_initializable_iterator()
+        return self.iterator.get_next()
+
+    def conv_lstm_graph(self, x, x_conv, y_true, batch_size):
 
         # set dimensions
         _, time_steps, y_dim = x.get_shape().as_list()
@@ -102,33 +313,37 @@ class train_weather_lstm(object):
         c_t_0 = y_true[:, 0, :]
         h_t_0 = y_true[:, 0, :]
 
-        x_t = x[:, 0, :]
-        self.y_pred = tf.expand_dims(x[:, 0, :], axis=1)
-
-        for t in range(time_steps-1):
-
-            # convnet layers
-            x_conv1 = tf.layers.conv2d(x_conv[:, t, :, :],
-                                       filters=2,
-                                       strides=2,
-                                       kernel_size=6,
-                                       padding='valid',
-                                       activation=tf.nn.relu,
-                                       name='conv1',
-                                       reuse=tf.AUTO_REUSE)
-
-            x_conv2 = tf.layers.conv2d(x_conv1,
-                                       filters=4,
-                                       strides=2,
-                                       kernel_size=3,
-                                       padding='valid',
-                                       activation=tf.nn.relu,
-                                       name='conv2',
-                                       reuse=tf.AUTO_REUSE)
-
-            x_flat1 = tf.reshape(x_conv2, [-1, 3*3*4])
-            x_fc1 = tf.layers.dense(x_flat1, 16, activation=tf.nn.relu, name='fc1', reuse=tf.AUTO_REUSE)
-            x_fc2 = tf.layers.dense(x_fc1, 4, activation=tf.nn.relu, name='fc2', reuse=tf.AUTO_REUSE)
+        # convnet layers run once over all time steps, the weather encoder does not depend on the hidden tensor
+        x_conv_steps = tf.reshape(x_conv, [-1] + x_conv.get_shape().as_list()[2:])
+        x_conv1 = tf.layers.conv2d(x_conv_steps,
+                                   filters=2,
+                                   strides=2,
+                                   kernel_size=6,
+                                   padding='valid',
+                                   activation=tf.nn.relu,
+                                   name='conv1',
+                                   reuse=tf.AUTO_REUSE)
+
+        x_conv2 = tf.layers.conv2d(x_conv1,
+                                   filters=4,
+                                   strides=2,
+                                   kernel_size=3,
+                                   padding='valid',
+                                   activation=tf.nn.relu,
+                                   name='conv2',
+                                   reuse=tf.AUTO_REUSE)
+
+        x_flat1 = tf.reshape(x_conv2, [-1, 3*3*4])
+        x_fc1 = tf.layers.dense(x_flat1, 16, activation=tf.nn.relu, name='fc1', reuse=tf.AUTO_REUSE)
+        x_fc2 = tf.layers.dense(x_fc1, 4, activation=tf.nn.relu, name='fc2', reuse=tf.AUTO_REUSE)
+        x_embed = tf.reshape(x_fc2, [-1, time_steps-1, 4])
+
+        def lstm_step(t, h_t_0, c_t_0):
+
+            x_t = x[:, t, :]
+
+            # weather embedding of the step
+            x_fc2 = x_embed[:, t, :]
 
             # x_t_2 = x_t * x_fc2
             # h_x = tf.concat([h_t_0, x_t_2], 1)
@@ -148,26 +363,38 @@ class train_weather_lstm(object):
             # hidden tensor
             h_t = o_t * tf.nn.tanh(c_t)
 
-            # update parameters
-            h_t_0 = h_t
-            c_t_0 = c_t
+            return f_t, h_t, c_t, h_t
+
+        # the first step is built outside the loop, layer variables of the step are created outside control flow
+        f_t, h_t_0, c_t_0, h_t = lstm_step(0, h_t_0, c_t_0)
+        y_steps = tf.TensorArray(tf.float32, size=time_steps-1).write(0, h_t)
 
-            x_t = x[:, t+1, :]
+        def loop_body(t, h_t_0, c_t_0, y_steps):
+            _, h_t_0, c_t_0, h_t = lstm_step(t, h_t_0, c_t_0)
+            return t+1, h_t_0, c_t_0, y_steps.write(t, h_t)
 
-            self.y_pred = tf.concat([self.y_pred, tf.expand_dims(h_t, axis=1)], axis=1)
+        # steps in between run in a symbolic loop, the graph size does not depend on the number of steps
+        _, h_t_0, c_t_0, y_steps = tf.while_loop(lambda t, h_t_0, c_t_0, y_steps: t < time_steps-2, loop_body,
+                                                 [tf.constant(1), h_t_0, c_t_0, y_steps])
+
+        # the last step is built after the loop, the gradient to its forget gate is taken
+        if time_steps-2 > 0:
+            f_t, h_t_0, c_t_0, h_t = lstm_step(time_steps-2, h_t_0, c_t_0)
+            y_steps = y_steps.write(time_steps-2, h_t)
+
+        self.y_pred = tf.concat([tf.expand_dims(x[:, 0, :], axis=1), tf.transpose(y_steps.stack(), [1, 0, 2])], axis=1)
 
         self.loss = tf.reduce_mean(tf.sqrt(tf.square(self.y_pred[:, :, 0] - y_true[:, :, 0]) +
                                            tf.square(self.y_pred[:, :, 1] - y_true[:, :, 1])), axis=None)
 
         self.gradient = tf.gradients(self.loss, f_t)
 
-    def conv_lstm_graph_2(self, x, x_conv, y_true):
-
-        # load data
-        self.load_data()
+    def conv_lstm_graph_2(self, x, x_conv, y_true, seq_len=None):
 
-        # set dimensions
+        # set dimensions, with seq_len the batch is padded to its longest flight and the number of steps is dynamic
         _, time_steps, y_dim = x.get_shape().as_list()
+        if seq_len is not None:
+            time_steps = tf.shape(x)[1]
         dim_out = x.get_shape().as_list()[-1]
         dim_hid = 100  # add fc to hidden tensor
 
@@ -187,33 +414,37 @@ class train_weather_lstm(object):
         c_t_0 = y_true[:, 0, :]
         h_t_0 = tf.layers.dense(y_true[:, 0, :], dim_hid-2-4, activation=tf.nn.relu, name='fc_in', reuse=tf.AUTO_REUSE)
 
-        x_t = x[:, 0, :]
-        self.y_pred = tf.expand_dims(x[:, 0, :], axis=1)
-
-        for t in range(time_steps-1):
-
-            # convnet layers
-            x_conv1 = tf.layers.conv2d(x_conv[:, t, :, :],
-                                       filters=2,
-                                       strides=2,
-                                       kernel_size=6,
-                                       padding='valid',
-                                       activation=tf.nn.relu,
-                                       name='conv1',
-                                       reuse=tf.AUTO_REUSE)
-
-            x_conv2 = tf.layers.conv2d(x_conv1,
-                                       filters=4,
-                                       strides=2,
-                                       kernel_size=3,
-                                       padding='valid',
-                                       activation=tf.nn.relu,
-                                       name='conv2',
-                                       reuse=tf.AUTO_REUSE)
-
-            x_flat1 = tf.reshape(x_conv2, [-1, 3*3*4])
-            x_fc1 = tf.layers.dense(x_flat1, 16, activation=tf.nn.relu, name='fc1', reuse=tf.AUTO_REUSE)
-            x_fc2 = tf.layers.dense(x_fc1, 4, activation=tf.nn.relu, name='fc2', reuse=tf.AUTO_REUSE)
+        # convnet layers run once over all time steps, the weather encoder does not depend on the hidden tensor
+        x_conv_steps = tf.reshape(x_conv, [-1] + x_conv.get_shape().as_list()[2:])
+        x_conv1 = tf.layers.conv2d(x_conv_steps,
+                                   filters=2,
+                                   strides=2,
+                                   kernel_size=6,
+                                   padding='valid',
+                                   activation=tf.nn.relu,
+                                   name='conv1',
+                                   reuse=tf.AUTO_REUSE)
+
+        x_conv2 = tf.layers.conv2d(x_conv1,
+                                   filters=4,
+                                   strides=2,
+                                   kernel_size=3,
+                                   padding='valid',
+                                   activation=tf.nn.relu,
+                                   name='conv2',
+                                   reuse=tf.AUTO_REUSE)
+
+        x_flat1 = tf.reshape(x_conv2, [-1, 3*3*4])
+        x_fc1 = tf.layers.dense(x_flat1, 16, activation=tf.nn.relu, name='fc1', reuse=tf.AUTO_REUSE)
+        x_fc2 = tf.layers.dense(x_fc1, 4, activation=tf.nn.relu, name='fc2', reuse=tf.AUTO_REUSE)
+        x_embed = tf.reshape(x_fc2, [-1, time_steps-1, 4])
+
+        def lstm_step(t, h_t_0, c_t_0):
+
+            x_t = x[:, t, :]
+
+            # weather embedding of the step
+            x_fc2 = x_embed[:, t, :]
 
             # x_t_2 = x_t * x_fc2
             # h_x = tf.concat([h_t_0, x_t_2], 1)
@@ -236,19 +467,37 @@ class train_weather_lstm(object):
 
             h_t_new = tf.layers.dense(h_t, dim_hid - 2 - 4, activation=tf.nn.relu, name='fc_mid',
                                       reuse=tf.AUTO_REUSE)
-            # update parameters
-            h_t_0 = h_t_new
-            c_t_0 = c_t
 
-            x_t = x[:, t+1, :]
+            return f_t, h_t_new, c_t, h_t
 
-            #self.y_pred = tf.concat([self.y_pred, tf.expand_dims(h_t, axis=1)], axis=1)
-            #h_out = tf.layers.dense(tf.reshape(h_t, [-1, self.batch_size*100]), 2, activation=tf.nn.relu, name='fc_out', reuse=tf.AUTO_REUSE)
-            self.y_pred = tf.concat([self.y_pred, tf.expand_dims(h_t, axis=1)], axis=1)
+        # the first step is built outside the loop, layer variables of the step are created outside control flow
+        f_t, h_t_0, c_t_0, h_t = lstm_step(0, h_t_0, c_t_0)
+        y_steps = tf.TensorArray(tf.float32, size=time_steps-1).write(0, h_t)
 
+        def loop_body(t, h_t_0, c_t_0, y_steps):
+            _, h_t_0, c_t_0, h_t = lstm_step(t, h_t_0, c_t_0)
+            return t+1, h_t_0, c_t_0, y_steps.write(t, h_t)
 
-        self.loss = tf.reduce_mean(tf.sqrt(tf.square(self.y_pred[:, :, 0] - y_true[:, :, 0]) +
-                                           tf.square(self.y_pred[:, :, 1] - y_true[:, :, 1])), axis=None)
+        # steps in between run in a symbolic loop, the graph size does not depend on the number of steps
+        last_step = time_steps-2 if seq_len is None else time_steps-1  # padded batches run all steps in the loop
+        _, h_t_0, c_t_0, y_steps = tf.while_loop(lambda t, h_t_0, c_t_0, y_steps: t < last_step, loop_body,
+                                                 [tf.constant(1), h_t_0, c_t_0, y_steps])
+
+        # the last step is built after the loop, the gradient to its forget gate is taken
+        if seq_len is None and time_steps-2 > 0:
+            f_t, h_t_0, c_t_0, h_t = lstm_step(time_steps-2, h_t_0, c_t_0)
+            y_steps = y_steps.write(time_steps-2, h_t)
+
+        self.y_pred = tf.concat([tf.expand_dims(x[:, 0, :], axis=1), tf.transpose(y_steps.stack(), [1, 0, 2])], axis=1)
+
+        dist = tf.sqrt(tf.square(self.y_pred[:, :, 0] - y_true[:, :, 0]) +
+                       tf.square(self.y_pred[:, :, 1] - y_true[:, :, 1]))
+        if seq_len is None:
+            self.loss = tf.reduce_mean(dist, axis=None)
+        else:
+            # padded points are masked out, the loss is the mean over the points of the flights
+            mask = tf.sequence_mask(seq_len, time_steps, dtype=tf.float32)
+            self.loss = tf.reduce_sum(dist * mask) / tf.reduce_sum(mask)
 
         # self.loss = tf.reduce_max(tf.sqrt(tf.square(self.y_pred[:, :, 0] - y_true[:, :, 0]) +
         #                                    tf.square(self.y_pred[:, :, 1] - y_true[:, :, 1])), axis=None)
@@ -256,11 +505,160 @@ class train_weather_lstm(object):
         self.gradient = tf.gradients(self.loss, f_t)
 
 
+    def conv_lstm_window_graph(self, x, x_conv, y_next, y_first):
+
+        # one window of truncated backpropagation through time, x and x_conv are the inputs of the window steps and
+        # y_next the trajectory points they predict, the state of the previous window is fed to h_in and c_in
+        _, _, y_dim = x.get_shape().as_list()
+        dim_out = x.get_shape().as_list()[-1]
+        dim_hid = 100  # add fc to hidden tensor
+        window = tf.shape(x)[1]
+
+        # build w and b tensors, same variables as conv_lstm_graph_2
+        w_f = tf.Variable(tf.truncated_normal([dim_hid, dim_out], stddev=0.1), name='w1')
+        b_f = tf.Variable(tf.truncated_normal([dim_out], stddev=0.1), name='b1')
+        w_i = tf.Variable(tf.truncated_normal([dim_hid, dim_out], stddev=0.1), name='w2')
+        b_i = tf.Variable(tf.truncated_normal([dim_out], stddev=0.1), name='b2')
+        w_c = tf.Variable(tf.truncated_normal([dim_hid, dim_out], stddev=0.1), name='w3')
+        b_c = tf.Variable(tf.truncated_normal([dim_out], stddev=0.1), name='b3')
+        w_o = tf.Variable(tf.truncated_normal([dim_hid, dim_out], stddev=0.1), name='w4')
+        b_o = tf.Variable(tf.truncated_normal([dim_out], stddev=0.1), name='b4')
+
+        # initial state of the first window is built in the graph so fc_in is trained, the next windows start from the
+        # state of the previous one fed to h_in and c_in
+        self.h_init = tf.layers.dense(y_first, dim_hid-2-4, activation=tf.nn.relu, name='fc_in', reuse=tf.AUTO_REUSE)
+        self.h_in = tf.placeholder_with_default(self.h_init, [None, dim_hid-2-4])
+        self.c_in = tf.placeholder_with_default(y_first, [None, dim_out])
+
+        # convnet layers run once over all steps of the window
+        x_conv_steps = tf.reshape(x_conv, [-1] + x_conv.get_shape().as_list()[2:])
+        x_conv1 = tf.layers.conv2d(x_conv_steps,
+                                   filters=2,
+                                   strides=2,
+                                   kernel_size=6,
+                                   padding='valid',
+                                   activation=tf.nn.relu,
+                                   name='conv1',
+                                   reuse=tf.AUTO_REUSE)
+
+        x_conv2 = tf.layers.conv2d(x_conv1,
+                                   filters=4,
+                                   strides=2,
+                                   kernel_size=3,
+                                   padding='valid',
+                                   activation=tf.nn.relu,
+                                   name='conv2',
+                                   reuse=tf.AUTO_REUSE)
+
+        x_flat1 = tf.reshape(x_conv2, [-1, 3*3*4])
+        x_fc1 = tf.layers.dense(x_flat1, 16, activation=tf.nn.relu, name='fc1', reuse=tf.AUTO_REUSE)
+        x_fc2 = tf.layers.dense(x_fc1, 4, activation=tf.nn.relu, name='fc2', reuse=tf.AUTO_REUSE)
+        x_embed = tf.reshape(x_fc2, [tf.shape(x)[0], window, 4])
+
+        def lstm_step(t, h_t_0, c_t_0):
+
+            # concatenate hidden tensor, x and the weather embedding of the step
+            h_x = tf.concat([h_t_0, x[:, t, :], x_embed[:, t, :]], 1)
+
+            # compute three gates
+            f_t = tf.sigmoid(tf.nn.xw_plus_b(h_x, w_f, b_f))
+            i_t = tf.sigmoid(tf.nn.xw_plus_b(h_x, w_i, b_i))
+            o_t = tf.sigmoid(tf.nn.xw_plus_b(h_x, w_o, b_o))
+
+            # compute cell tensor
+            c_t_hat = tf.nn.tanh(tf.nn.xw_plus_b(h_x, w_c, b_c))
+            c_t = f_t * c_t_0 + i_t * c_t_hat
+
+            # hidden tensor
+            h_t = o_t * tf.nn.tanh(c_t)
+
+            h_t_new = tf.layers.dense(h_t, dim_hid-4-2, activation=tf.nn.relu, name='fc_mid',
+                                      reuse=tf.AUTO_REUSE)
+
+            return h_t_new, c_t, h_t
+
+        # the first step is built outside the loop, layer variables of the step are created outside control flow
+        h_t_0, c_t_0, h_t = lstm_step(0, self.h_in, self.c_in)
+        y_steps = tf.TensorArray(tf.float32, size=window).write(0, h_t)
+
+        def loop_body(t, h_t_0, c_t_0, y_steps):
+            h_t_0, c_t_0, h_t = lstm_step(t, h_t_0, c_t_0)
+            return t+1, h_t_0, c_t_0, y_steps.write(t, h_t)
+
+        _, self.h_out, self.c_out, y_steps = tf.while_loop(lambda t, h_t_0, c_t_0, y_steps: t < window, loop_body,
+                                                           [tf.constant(1), h_t_0, c_t_0, y_steps])
+
+        self.window_pred = tf.transpose(y_steps.stack(), [1, 0, 2])
+
+        self.loss = tf.reduce_mean(tf.sqrt(tf.square(self.window_pred[:, :, 0] - y_next[:, :, 0]) +
+                                           tf.square(self.window_pred[:, :, 1] - y_next[:, :, 1])), axis=None)
+
+    def run_windows(self, sess, fp, weather, traj, train_step=None):
+        # input: tensorflow session, a batch of full sequences and the train step to fit the windows, None to predict
+        # output: predicted trajectories of the batch, the state is carried from window to window and the gradient
+        #         stops at the window boundaries
+        y_pred = np.empty(traj.shape, dtype=np.float32)
+        y_pred[:, 0, :] = fp[:, 0, :]
+        h_t, c_t = None, None
+
+        for a in range(0, self.input_dimension-1, self.tbptt_window):
+            b = min(a + self.tbptt_window, self.input_dimension-1)
+            feed_value_window = {self.x_weather: weather[:, a:b, :, :, :],
+                                 self.x_fp: fp[:, a:b, :],
+                                 self.y_traj: traj[:, a+1:b+1, :],
+                                 self.y_first: traj[:, 0, :], }
+            if a > 0:
+                # later windows start from the state of the previous window, the gradient stops there
+                feed_value_window.update({self.h_in: h_t, self.c_in: c_t})
+            fetches = [self.window_pred, self.h_out, self.c_out] + ([train_step] if train_step is not None else [])
+            y_pred[:, a+1:b+1, :], h_t, c_t = sess.run(fetches, feed_dict=feed_value_window)[0:3]
+
+        return y_pred
+
+    @staticmethod
+    def sequence_loss(y_pred, y_true):
+        # same as self.loss of conv_lstm_graph_2, mean distance over all points of the sequences
+        return float(np.mean(np.sqrt(np.sum((y_pred - y_true) ** 2, axis=2))))
+
     def train_model(self):
 
-        self.x_weather = tf.placeholder(tf.float32, [None, self.input_dimension-1, self.cube_size, self.cube_size, 1])
-        self.x_fp = tf.placeholder(tf.float32, [None, self.input_dimension, 2])
-        self.y_traj = tf.placeholder(tf.float32, [None, self.input_dimension, 2])
+        # load data
+        self.load_data()
+
+        # the epochs of the previous run in save_dir are rewritten once this run has restored its checkpoint
+        if os.path.exists('{}/training_state.json'.format(self.save_dir)):
+            os.remove('{}/training_state.json'.format(self.save_dir))
+
+        # held out flights, checkpoint_evaluator.py scores the checkpoints on them, new days add their own
+        with open('{}/test_files.txt'.format(self.save_dir), 'a' if self.incremental_data else 'w') as f:
+            f.write('\n'.join(self.test_files) + '\n')
+        with open('{}/normalization.json'.format(self.save_dir), 'w') as f:
+            json.dump({'weather_max': self.weather_max}, f)
+
+        if self.tbptt_window:
+            # windows of the sequences are fed one after the other, the pipeline only prepares the batches
+            if self.input_pipeline:
+                self.pipeline_batch = self.build_input_pipeline()
+            self.x_weather = tf.placeholder(tf.as_dtype(self.weather_dtype), [None, None, self.cube_size, self.cube_size, 1])
+            self.x_fp = tf.placeholder(tf.float32, [None, None, 2])
+            self.y_traj = tf.placeholder(tf.float32, [None, None, 2])
+            self.y_first = tf.placeholder(tf.float32, [None, 2])
+        elif self.ragged_data:
+            # batches are padded to their longest flight, seq_len masks the padded points
+            self.x_weather = tf.placeholder(tf.as_dtype(self.weather_dtype), [None, None, self.cube_size, self.cube_size, 1])
+            self.x_fp = tf.placeholder(tf.float32, [None, None, 2])
+            self.y_traj = tf.placeholder(tf.float32, [None, None, 2])
+            self.seq_len = tf.placeholder(tf.int32, [None])
+        elif self.input_pipeline:
+            # training batches come from the pipeline, the test set is still fed through the same tensors
+            fp_batch, weather_batch, traj_batch = self.build_input_pipeline()
+            self.x_weather = tf.placeholder_with_default(weather_batch, [None, self.input_dimension-1, self.cube_size, self.cube_size, 1])
+            self.x_fp = tf.placeholder_with_default(fp_batch, [None, self.input_dimension, 2])
+            self.y_traj = tf.placeholder_with_default(traj_batch, [None, self.input_dimension, 2])
+        else:
+            self.x_weather = tf.placeholder(tf.as_dtype(self.weather_dtype), [None, self.input_dimension-1, self.cube_size, self.cube_size, 1])
+            self.x_fp = tf.placeholder(tf.float32, [None, self.input_dimension, 2])
+            self.y_traj = tf.placeholder(tf.float32, [None, self.input_dimension, 2])
         # self.x_weather = tf.placeholder(tf.float32, [None, 9, self.cube_size, self.cube_size, 1])
         # self.x_fp = tf.placeholder(tf.float32, [None, 10, 2])
         # self.y_traj = tf.placeholder(tf.float32, [None, 10, 2])
@@ -268,7 +666,12 @@ class train_weather_lstm(object):
 
         # build graph
         #self.conv_lstm_graph(self.x_fp, self.x_weather, self.y_traj, self.batch_size)
-        self.conv_lstm_graph_2(self.x_fp, self.x_weather, self.y_traj)
+        if self.tbptt_window:
+            self.conv_lstm_window_graph(self.x_fp, self.weather_input(), self.y_traj, self.y_first)
+        elif self.ragged_data:
+            self.conv_lstm_graph_2(self.x_fp, self.weather_input(), self.y_traj, self.seq_len)
+        else:
+            self.conv_lstm_graph_2(self.x_fp, self.weather_input(), self.y_traj)
 
         # store loss values
         self.train_loss = []
@@ -278,51 +681,93 @@ class train_weather_lstm(object):
         train_step = tf.train.AdamOptimizer(self.lr).minimize(self.loss)
         #train_step = tf.train.GradientDescentOptimizer(self.lr).minimize(self.loss)
 
+        # epoch counter is saved with the weights and the optimizer state
+        global_epoch = tf.Variable(0, trainable=False, name='global_epoch')
+        next_epoch = tf.assign_add(global_epoch, 1)
+
         # batch number
-        batch_num = int(self.train_x_fp.shape[0] / self.batch_size)
+        batch_num = int(self.train_size / self.batch_size)
+
+        saver = tf.train.Saver(max_to_keep=self.keep_checkpoints)
 
-        from seaborn import distplot
-        import matplotlib.pylab as plt
+        # limit the cpu threads when several models train side by side
+        session_config = tf.ConfigProto(intra_op_parallelism_threads=self.num_threads,
+                                        inter_op_parallelism_threads=min(self.num_threads, 2))
 
         print("Start training.")
-        with tf.Session() as sess:
+        with tf.Session(config=session_config) as sess:
             sess.run(tf.global_variables_initializer())
-            for j in range(self.epoch):
-                for i in range(batch_num):
-
-                    train_x_fp_batch = self.train_x_fp[self.batch_size * i:self.batch_size * (i+1), :, :]
-                    train_x_weather_batch = self.train_x_weather[self.batch_size * i:self.batch_size * (i+1), :, :, :, :]
-                    train_y_traj_batch = self.train_y_traj[self.batch_size * i:self.batch_size * (i+1), :, :]
-
-                    feed_value_train = {self.x_weather: train_x_weather_batch,
-                                        self.x_fp: train_x_fp_batch,
-                                        self.y_traj: train_y_traj_batch,}
-                                        #self.batch_size: self.batch_size, }
 
-                    feed_value_test = {self.x_weather: self.test_x_weather,
-                                       self.x_fp: self.test_x_fp,
-                                       self.y_traj: self.test_y_traj,}
-                                       #self.batch_size: self.test_x_fp.shape[0]}
+            start_epoch = 0
+            checkpoint = tf.train.latest_checkpoint(self.save_dir)
+            if self.restore and checkpoint:
+                # restore the variables the checkpoint has, models saved before the epoch counter start at epoch 0
+                saved = dict(tf.train.list_variables(checkpoint))
+                restore_list = [x for x in tf.global_variables() if saved.get(x.op.name) == x.shape.as_list()]
+                tf.train.Saver(restore_list).restore(sess, checkpoint)
+                if 'global_epoch' in saved:
+                    start_epoch = sess.run(global_epoch)
+                print("Restored {} of {} variables from {} at epoch {}.".format(len(restore_list), len(tf.global_variables()),
+                                                                              checkpoint, start_epoch))
+            elif self.incremental_data:
+                raise ValueError("no checkpoint in {} to fine-tune".format(self.save_dir))
+            end_epoch = start_epoch + self.epoch if self.incremental_data else self.epoch
+
+            # epochs of this run, checkpoint_evaluator.py stops after the end_epoch checkpoint
+            with open('{}/training_state.json'.format(self.save_dir), 'w') as f:
+                json.dump({'start_epoch': int(start_epoch), 'end_epoch': int(end_epoch)}, f)
+
+            for j in range(start_epoch, end_epoch):
+                self.epoch_idx = self.epoch_indices() if (self.packed_data or self.incremental_data) else None
+                if self.input_pipeline:
+                    sess.run(self.iterator.initializer, feed_dict={self.pipeline_idx: self.epoch_idx})
+                if self.ragged_data:
+                    # flights of similar length are batched together, batches are reshuffled every epoch
+                    self.epoch_batches = [self.train_idx[x] for x in
+                                          bucket_batches(self.data.lengths[self.train_idx], self.batch_size)]
+                    batch_num = len(self.epoch_batches)
 
-                    [_, loss_train] = sess.run([train_step, self.loss], feed_dict=feed_value_train)
-
-                    loss_test = sess.run(self.loss, feed_dict=feed_value_test)
-
-                    gradient = sess.run(self.gradient, feed_dict=feed_value_test)
-
-                    gradient_flat = np.reshape(gradient[0], [-1])
-
-                    # plt.figure("grad_{}".format(str(i+j)), figsize=(20, 20))
-                    # distplot(np.asarray(gradient_flat))
-                    # plt.show()
-                    # #plt.savefig("grad_{}".format(str(i+j)))
+                for i in range(batch_num):
 
-                    print("Epoch: {} Batch: {} Train Loss: {} Test Loss: {}".format(j+1, i+1, loss_train, loss_test))
+                    if self.tbptt_window:
+                        # windows of the batch are fitted one after the other
+                        batch = sess.run(self.pipeline_batch) if self.input_pipeline else self.train_batch(i)
+                        loss_train = self.sequence_loss(self.run_windows(sess, *batch, train_step=train_step), batch[2])
+                    elif self.input_pipeline:
+                        feed_value_train = {}
+                    elif self.ragged_data:
+                        train_x_fp_batch, train_x_weather_batch, train_y_traj_batch, seq_len_batch = self.train_batch(i)
+
+                        feed_value_train = {self.x_weather: train_x_weather_batch,
+                                            self.x_fp: train_x_fp_batch,
+                                            self.y_traj: train_y_traj_batch,
+                                            self.seq_len: seq_len_batch, }
+                    else:
+                        train_x_fp_batch, train_x_weather_batch, train_y_traj_batch = self.train_batch(i)
+
+                        feed_value_train = {self.x_weather: train_x_weather_batch,
+                                            self.x_fp: train_x_fp_batch,
+                                            self.y_traj: train_y_traj_batch,}
+                                            #self.batch_size: self.batch_size, }
+
+                    if not self.tbptt_window:
+                        [_, loss_train] = sess.run([train_step, self.loss], feed_dict=feed_value_train)
+
+                    # test set is evaluated every eval_every batches and after the last batch of the epoch
+                    if (self.eval_every and (i+1) % self.eval_every == 0) or i == batch_num-1:
+                        loss_test = self.evaluate(sess)
+                        print("Epoch: {} Batch: {} Train Loss: {} Test Loss: {}".format(j+1, i+1, loss_train, loss_test))
+                    else:
+                        print("Epoch: {} Batch: {} Train Loss: {}".format(j+1, i+1, loss_train))
 
                 self.train_loss = np.append(self.train_loss, loss_train)
                 self.test_loss = np.append(self.test_loss, loss_test)
 
-            save_path = tf.train.Saver().save(sess, '{}/model.ckpt'.format(self.save_dir))
+                sess.run(next_epoch)
+                if self.checkpoint_every and (j+1) % self.checkpoint_every == 0 and j+1 < end_epoch:
+                    saver.save(sess, '{}/model.ckpt'.format(self.save_dir), global_step=j+1)
+
+            save_path = saver.save(sess, '{}/model.ckpt'.format(self.save_dir), global_step=end_epoch)
             print("Model saved in path: {}".format(save_path))
 
         sess.close()
@@ -353,6 +798,16 @@ if __name__ == '__main__':
            'input_dimension': 50,  # number of trajectory points in the data
            'cube_size': 20,  # weather cube size
            'split_ratio': 0.25,  # train test split ratio
+           # 'packed_data': 'training data/50/packed_JFK2LAX_ET.npy',  # packed records from packed_data.py
+           # 'weather_dtype': 'uint8',  # keep the weather cubes in uint8 on the host
+           # 'input_pipeline': True,  # stream training batches from packed_data with tf.data
+           'eval_every': 0,  # batches between test evaluations, 0 evaluates once per epoch
+           # 'checkpoint_every': 50,  # epochs between checkpoints scored by checkpoint_evaluator.py
+           # 'resume': True,  # continue the latest checkpoint of save_dir
+           # 'incremental_data': 'training data/50/packed_new_days.npy',  # fine-tune on newly packed days
+           # 'replay_ratio': 0.5,  # archive flights replayed per new flight
+           # 'tbptt_window': 100,  # steps per window of truncated backpropagation for long sequences
+           # 'ragged_data': 'training data/ragged/ragged_JFK2LAX_ET.json',  # variable length flights, batched by length
            }
 
     cfg['save_dir'] = './Epoch_{}_Dimension_{}'.format(cfg['epoch'], cfg['input_dimension'])
@@ -19,11 +19,104 @@ import csv
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
+from multiprocessing import Pool
 os.environ['PROJ_LIB'] = '/home/ypang6/anaconda3/share/proj'
 from mpl_toolkits.basemap import Basemap
 from netCDF4 import Dataset as NetCDFFile
 import utils as utl
 
+frame_worker = {}  # figure of a frame rendering process, built once by init_frame_worker
+
+
+def init_frame_worker(track, flight_plan):
+    # input: track points and flight plan of the flight
+    # builds the figure, the projection, the background layers and the flight lines once per worker process
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+
+    # a headless figure of the worker, nothing is shared with pyplot
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+
+    # setup lambert azimuthal equal area projection of the CIWS grid
+    m = Basemap(width=2559500*2, height=1759500*2, resolution='l', projection='laea', lat_ts=50, lat_0=38, lon_0=-98, ax=ax)
+
+    m.drawcoastlines()
+    m.drawstates(linewidth=.25)
+    m.drawcountries(linewidth=1)
+
+    # draw parallels
+    m.drawparallels(np.arange(0, 90, 15), labels=[1, 1, 0, 1])
+    # draw meridians
+    m.drawmeridians(np.arange(-180, 180, 30), labels=[1, 1, 0, 1])
+
+    # Plot track points
+    lon, lat = m(track[:, 2], track[:, 1])
+    m.plot(lon, lat, marker=None, color='r')
+
+    # plot flight plan
+    lon_fp, lat_fp = m(flight_plan[:, 1], flight_plan[:, 0])
+    m.plot(lon_fp, lat_fp, marker=None, color='b')
+
+    # add legend
+    red_patch = mpatches.Patch(color='red', label='Track Points')
+    blue_patch = mpatches.Patch(color='blue', label='Flight Plan')
+    ax.legend(handles=[red_patch, blue_patch])
+
+    # axes of the color bar, redrawn for every frame
+    cax = make_axes_locatable(ax).append_axes('bottom', size='5%', pad='5%')
+
+    frame_worker.update({'fig': fig, 'ax': ax, 'cax': cax, 'map': m, 'grid': {}, 'contour': None})
+
+
+def render_frame(task):
+    # input: weather file name, its path and the png file to save, None to only return the image
+    # output: rgb image of the frame
+    filename, nc_file, png_file = task
+    fig, ax, cax, m = frame_worker['fig'], frame_worker['ax'], frame_worker['cax'], frame_worker['map']
+
+    # load weather file
+    nc = NetCDFFile(nc_file)
+    data = nc.variables['ECHO_TOP'][:]
+    nc.close()
+
+    # get lat/lons of ny by nx evenly space grid and the map proj coordinates, once per grid size
+    ny = data.shape[2]
+    nx = data.shape[3]
+    if (nx, ny) not in frame_worker['grid']:
+        lons, lats = m.makegrid(nx, ny)
+        frame_worker['grid'][(nx, ny)] = m(lons, lats)
+    x, y = frame_worker['grid'][(nx, ny)]
+
+    data = data[0, 0, :, :].clip(min=0)
+
+    # contours of the previous frame are replaced
+    if frame_worker['contour'] is not None:
+        try:
+            frame_worker['contour'].remove()
+        except AttributeError:  # contour sets are not artists before matplotlib 3.8
+            for c in frame_worker['contour'].collections:
+                c.remove()
+
+    # draw filled contours
+    cs = m.contour(x, y, data)
+    frame_worker['contour'] = cs
+
+    # add color bar
+    cax.clear()
+    cbar = fig.colorbar(cs, cax=cax, orientation='horizontal')
+    cbar.set_label('ET Unit')
+    ax.set_title('{}'.format(filename))
+
+    # draw once, the same image goes to the png and the gif
+    fig.canvas.draw()
+    image = np.asarray(fig.canvas.buffer_rgba())[:, :, :3].copy()
+    if png_file is not None:
+        plt.imsave(png_file, image)
+    return image
+
 
 class draw_figure(object):
 
@@ -33,6 +126,7 @@ class draw_figure(object):
         self.weather_dir = cfg['weather_directory']
         self.date = cfg['date']
         self.call_sign_to_draw = cfg['call_sign_to_draw']
+        self.num_workers = cfg.get('num_workers')  # frame rendering processes, one per cpu if not given
 
     def plot2D(self):
 
@@ -68,7 +162,8 @@ class draw_figure(object):
         plt.savefig('{}.png'.format(self.obj_dir))
         #plt.show()
 
-    def draw_weather_contour(self):
+    def weather_frames(self):
+        # output: track points, flight plan and the frames of the flight, one frame per weather file every 150 seconds
         # load track data
         track = np.genfromtxt('{}/{}_{}.csv'.format(self.obj_dir, self.call_sign_to_draw, self.date),
                               delimiter=',', skip_header=1)
@@ -97,92 +192,55 @@ class draw_figure(object):
 
         unix_time_seq = np.arange(track[0, 0], track[-1, 0], 150)
 
-        # clear folder before run functions
-        folder = './Plots'
-        for the_file in os.listdir(folder):
-            file_path = os.path.join(folder, the_file)
-            try:
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
-            except Exception as e:
-                print(e)
-
+        # weather file and plot name of every frame, times that fall on the same weather file give the same frame
+        frames = []
         for i in range(len(unix_time_seq)):
-            print("Generating plot {}/{}".format(i+1, len(unix_time_seq)))
             pin, nearest_value = utl.get_weather_file(unix_time_seq[i])
-
-            # load weather file
             filename = "ciws.EchoTop." + pin[:8] + "T" + str(pin[-6:-4]) + nearest_value + "Z"
+            if filename not in set(x[0] for x in frames):
+                frames.append((filename, '{}_{}'.format(self.call_sign_to_draw, str(pin[-6:-4]) + nearest_value)))
+
+        return track, flight_plan, frames
+
+    def render_frames(self, save_plots=True):
+        # input: save every frame as a png in Plots as well
+        # output: plot name and rgb image of every frame in time order, rendered by the worker processes
+        track, flight_plan, frames = self.weather_frames()
+
+        if save_plots:
+            # clear folder before run functions
+            folder = './Plots'
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            for the_file in os.listdir(folder):
+                file_path = os.path.join(folder, the_file)
+                try:
+                    if os.path.isfile(file_path):
+                        os.unlink(file_path)
+                except Exception as e:
+                    print(e)
+
+        tasks = [(x[0], '{}/{}.nc'.format(self.weather_dir, x[0]), 'Plots/{}.png'.format(x[1]) if save_plots else None)
+                 for x in frames]
+
+        # every worker builds the map once, frames come back in order while the next ones render
+        with Pool(self.num_workers, initializer=init_frame_worker, initargs=(track, flight_plan)) as pool:
+            for i, image in enumerate(pool.imap(render_frame, tasks)):
+                print("Generating plot {}/{}".format(i+1, len(tasks)))
+                yield frames[i][1], image
 
-            nc = NetCDFFile('{}/{}.nc'.format(self.weather_dir, filename))
-            data = nc.variables['ECHO_TOP'][:]
-            loncorners = nc.variables['x0'][:]
-            latcorners = nc.variables['y0'][:]
-
-            # create new figure, axes instances.
-            fig = plt.figure()
-            plt.title('{}'.format(filename))
-
-            # setup mercator map projection
-            m = Basemap(width=2559500*2, height=1759500*2, resolution='l', projection='laea', lat_ts=50, lat_0=38, lon_0=-98)
-
-            m.drawcoastlines()
-            m.drawstates(linewidth=.25)
-            m.drawcountries(linewidth=1)
-            # m.fillcontinents()
-
-            # draw parallels
-            m.drawparallels(np.arange(0, 90, 15), labels=[1, 1, 0, 1])
-            # draw meridians
-            m.drawmeridians(np.arange(-180, 180, 30), labels=[1, 1, 0, 1])
-
-            ny = data.shape[2]
-            nx = data.shape[3]
-            lons, lats = m.makegrid(nx, ny)
-
-            # import scipy.io
-            # scipy.io.savemat('lats.mat', mdict={'arr': lats})
-            # scipy.io.savemat('lons.mat', mdict={'arr': lons})
-            # np.save('lats.npy', lats)
-            # np.save('lons.npy', lons)
-
-            # get lat/lons of ny by nx evenly space grid
-            x, y = m(lons, lats)  # compute map proj coordinates
-
-            data = data[0, 0, :, :].clip(min=0)
-
-            # draw filled contours
-            cs = m.contour(x, y, data)
-
-            # Plot track points
-            lon, lat = m(track[:, 2], track[:, 1])
-            plot_1 = m.plot(lon, lat, marker=None, color='r')
-
-            # plot flight plan
-            lon_fp, lat_fp = m(flight_plan[:, 1], flight_plan[:, 0])
-            plot_2 = m.plot(lon_fp, lat_fp, marker=None, color='b')
-
-            # add color bar
-            cbar = m.colorbar(cs, location='bottom', pad="5%")
-            cbar.set_label('ET Unit')
-
-            # add legend
-            red_patch = mpatches.Patch(color='red', label='Track Points')
-            blue_patch = mpatches.Patch(color='blue', label='Flight Plan')
-            plt.legend(handles=[red_patch, blue_patch])
+    def draw_weather_contour(self):
 
-            #plt.show()
-            plt.savefig('Plots/{}_{}.png'.format(self.call_sign_to_draw, str(pin[-6:-4]) + nearest_value))
-            plt.close(fig)
+        # plots saved in Plots
+        for _ in self.render_frames(save_plots=True):
+            pass
 
-    def make_gif(self):
-        # make a gif
+    def make_gif(self, save_plots=False):
+        # make a gif, the frames go straight from the workers into the animation
         import imageio
 
-        filenames = sorted([x.split('.')[0] for x in os.listdir("Plots/")])
         with imageio.get_writer('{}.gif'.format(self.call_sign_to_draw), mode='I') as writer:
-            for filename in filenames:
-                image = imageio.imread("Plots/"+filename+".png")
+            for filename, image in self.render_frames(save_plots):
                 writer.append_data(image)
                 print("Appending Frame {}".format(filename))
 
@@ -192,7 +250,9 @@ if __name__ == '__main__':
     cfg = {'departure_airport': 'JFK',
            'arrival_airport': 'LAX',
            'date': '20170405',
-           'call_sign_to_draw': 'AAL133'}
+           'call_sign_to_draw': 'AAL133',
+           # 'num_workers': 8,  # frame rendering processes, one per cpu if not given
+           }
 
     cfg['object_directory'] = "track_point_{}_{}2{}".format(cfg['date'], cfg['departure_airport'], cfg['arrival_airport'])
     cfg['weather_directory'] = '/mnt/data/Research/data/{}ET'.format(cfg['date'])
@@ -203,5 +263,5 @@ if __name__ == '__main__':
 
     fun.draw_weather_contour() # plots saved in '/Plots'
 
-    #fun.make_gif() # make gif use the plots in '/Plots
+    #fun.make_gif() # make gif, the frames are rendered straight into it
 
@@ -0,0 +1,191 @@
+#! /home/anaconda3 python
+#-*- coding: utf-8 -*-
+
+"""
+@Date: 2026-10-19
+
+This Python script normalizes all trajectories of one day in a batch.
+All flights of a route (or a sector track file) are loaded into one ragged array, values of every flight stored
+back to back with an offsets array, then all flights are resampled to a fixed length with one vectorized kernel
+and written to one packed file.
+The sampling follows flight_data_generator.process_trajectory point by point.
+
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from utils import interpolate_linear
+
+
+def resample_ragged(unix_time, values, offsets, sample_time):
+    # input: unix time and values (n x m) of all flights back to back, offsets (F+1) of every flight
+    #        and the sample time (F x K) of every flight
+    # output: values (F x K x m) linearly interpolated at the sample time, nan before the first valid value and
+    #         the last valid value after it, same as utils.interpolate_linear on each flight
+    num_flights = len(offsets) - 1
+    flight = np.repeat(np.arange(num_flights), np.diff(offsets))
+
+    # put the flights next to each other on one increasing axis
+    origin = np.zeros(num_flights)
+    span = np.zeros(num_flights)
+    nonempty = np.diff(offsets) > 0
+    origin[nonempty] = np.minimum.reduceat(unix_time, offsets[:-1][nonempty])
+    span[nonempty] = np.maximum.reduceat(unix_time, offsets[:-1][nonempty]) - origin[nonempty]
+    base = np.concatenate([[0], np.cumsum(span + 1)[:-1]])
+
+    x = unix_time - origin[flight] + base[flight]
+    x_new = sample_time - origin[:, None] + base[:, None]
+
+    order = np.argsort(x, kind='mergesort')
+    x, flight, values = x[order], flight[order], values[order]
+
+    values_new = np.full(sample_time.shape + values.shape[1:], np.nan)
+    for i in range(values.shape[1]):
+        valid = ~np.isnan(values[:, i])
+        x_valid, flight_valid = x[valid], flight[valid]
+
+        # first and last valid point of every flight, the sample time is kept inside them
+        first = np.searchsorted(flight_valid, np.arange(num_flights), side='left')
+        last = np.searchsorted(flight_valid, np.arange(num_flights), side='right') - 1
+        has_valid = last >= first
+        if not has_valid.any():
+            continue
+        x_first = x_valid[np.minimum(first, len(x_valid) - 1)][:, None]
+        x_last = x_valid[np.maximum(last, 0)][:, None]
+
+        column = np.interp(np.clip(x_new, x_first, x_last), x_valid, values[valid, i])
+        column[(x_new < x_first) | ~has_valid[:, None]] = np.nan
+        values_new[:, :, i] = column
+
+    return values_new
+
+
+class flight_batch_generator(object):
+    def __init__(self, cfg):
+        self.date = cfg['date']
+        self.departure_airport = cfg['departure_airport']
+        self.arrival_airport = cfg['arrival_airport']
+        self.dimension = cfg['output_dimension']
+        self.altitude_threshold = cfg['altitude_buffer']
+
+        try:
+            os.makedirs('trajectory data')
+        except OSError:
+            pass
+
+    def load_route(self):
+        # load all raw tracks of the route into one ragged array
+        track_dir = 'raw_track/track_point_{}_{}2{}'.format(self.date, self.departure_airport, self.arrival_airport)
+        file_list = sorted(os.listdir(track_dir))
+
+        call_sign = [x.split('_')[0] for x in file_list]
+        tracks = [pd.read_csv('{}/{}'.format(track_dir, x)) for x in file_list]
+        self.columns = tracks[0].columns.drop('UNIX TIME')
+        self.build_ragged(call_sign, [np.asarray(x['UNIX TIME']) for x in tracks],
+                          [np.asarray(x[self.columns], dtype=float) for x in tracks])
+
+    def load_sector(self, tracks_file):
+        # load the track dictionary of SECTOR_FLIGHT_PARSER_RAW.py into one ragged array
+        tracks = np.load(tracks_file, encoding='latin1').item()
+
+        call_sign = sorted(tracks.keys())
+        self.columns = pd.Index(['LATITUDE', 'LONGITUDE', 'ALTITUDE'])
+        self.build_ragged(call_sign, [np.asarray(tracks[x][1], dtype=float) for x in call_sign],
+                          [np.asarray(tracks[x][[9, 10, 11]], dtype=float) for x in call_sign])
+
+    def build_ragged(self, call_sign, unix_time, values):
+
+        self.call_sign = np.asarray(call_sign)
+        self.offsets = np.concatenate([[0], np.cumsum([len(x) for x in unix_time])]).astype(int)
+        self.unix_time = np.concatenate(unix_time).astype(float).astype(int)  # convert time to int
+        self.values = np.concatenate(values).astype(float)
+
+        # remove duplicate time after int operation, keep the first point of each flight and time
+        flight = np.repeat(np.arange(len(self.call_sign)), np.diff(self.offsets))
+        _, first_idx = np.unique(np.column_stack([flight, self.unix_time]), axis=0, return_index=True)
+        keep = np.zeros(len(flight), dtype=bool)
+        keep[first_idx] = True
+
+        self.unix_time, self.values, flight = self.unix_time[keep], self.values[keep], flight[keep]
+        self.offsets = np.searchsorted(flight, np.arange(len(self.call_sign) + 1))
+
+        print("Loaded {} flights with {} track points on {}.".format(len(self.call_sign), len(self.unix_time), self.date))
+
+    def resample(self):
+
+        num_flights = len(self.call_sign)
+        length = np.diff(self.offsets)
+        flight = np.repeat(np.arange(num_flights), length)
+
+        # 1 second time grid of every flight starts at the first point and stops before the last point
+        start_time = np.zeros(num_flights, dtype=int)
+        end_time = np.zeros(num_flights, dtype=int)
+        start_time[length > 0] = self.unix_time[self.offsets[:-1][length > 0]]
+        end_time[length > 0] = self.unix_time[self.offsets[1:][length > 0] - 1]
+        grid_length = np.maximum(end_time - start_time, 0)
+
+        # only the points on the grid are used by the linear interpolation
+        on_grid = (self.unix_time >= start_time[flight]) & (self.unix_time < end_time[flight])
+        unix_time, values = self.unix_time[on_grid], self.values[on_grid]
+        offsets = np.searchsorted(flight[on_grid], np.arange(num_flights + 1))
+
+        # buffer altitude over a given threshold, interpolated altitude never goes below the lowest point
+        buffered_length = grid_length.copy()
+        nonempty = np.diff(offsets) > 0
+        lowest = np.full(num_flights, np.nan)
+        altitude = values[:, self.columns.get_loc('ALTITUDE')]
+        lowest[nonempty] = np.minimum.reduceat(altitude, offsets[:-1][nonempty])
+        for i in np.where(nonempty & ~(lowest >= self.altitude_threshold))[0]:
+            total_time = np.arange(start_time[i], end_time[i])
+            buffered_altitude = interpolate_linear(unix_time[offsets[i]:offsets[i+1]],
+                                                   altitude[offsets[i]:offsets[i+1]], total_time)
+            buffered_length[i] = np.sum(buffered_altitude >= self.altitude_threshold)
+
+        # flights too short for the output dimension are skipped
+        sample_interval = buffered_length // self.dimension
+        valid = (sample_interval > 0) & nonempty
+        for i in np.where(~valid)[0]:
+            print("Error in flight data for {}".format(self.call_sign[i]))
+
+        # sample time of every flight, centered on the grid
+        first_sample = start_time + (grid_length - sample_interval * self.dimension) // 2
+        self.sample_time = first_sample[:, None] + sample_interval[:, None] * np.arange(self.dimension)
+
+        # one vectorized kernel for all flights of the day
+        self.traj_return = resample_ragged(unix_time, values, offsets, self.sample_time)
+
+        # fix the first and last point as the airport coordinates
+        ends = resample_ragged(unix_time, values, offsets, np.column_stack([start_time, start_time + grid_length - 1]))
+        self.traj_return[:, 0], self.traj_return[:, -1] = ends[:, 0], ends[:, 1]
+
+        self.call_sign = self.call_sign[valid]
+        self.sample_time = self.sample_time[valid]
+        self.traj_return = self.traj_return[valid]
+
+    def save(self):
+
+        # save fix size trajectories of the day in one packed file
+        np.savez('trajectory data/{}_{}2{}.npz'.format(self.date, self.departure_airport, self.arrival_airport),
+                 call_sign=self.call_sign, unix_time=self.sample_time, trajectory=self.traj_return)
+
+
+if __name__ == '__main__':
+
+    date_list = [20170405, 20170406, 20170407]
+
+    cfg = {'departure_airport': 'JFK',
+           'arrival_airport': 'LAX',
+           'output_dimension': 1000,
+           'altitude_buffer': 0,
+           }
+
+    for date in date_list:
+        cfg['date'] = date
+
+        fun = flight_batch_generator(cfg)
+        fun.load_route()
+        fun.resample()
+        fun.save()
+        del fun
+        print("Finish flight data for {}.".format(date))
@@ -15,7 +15,8 @@ The source coordinates for flight plan is https://opennav.com
 import os
 import numpy as np
 import pandas as pd
-from utils import fetch_from_web
+from utils import resolve_flight_plan, interpolate_linear
+from spatial_matcher import spatial_matcher
 
 
 class flight_data_generator(object):
@@ -25,7 +26,11 @@ class flight_data_generator(object):
         self.departure_airport = cfg['departure_airport']
         self.arrival_airport = cfg['arrival_airport']
         self.dimension = cfg['output_dimension']
+        self.fixed_interval = cfg.get('sample_interval')  # seconds between samples, the length then varies by flight
         self.altitude_threshold = cfg['altitude_buffer']
+        self.fix_db = cfg.get('fix_db')  # local fix database, flight plans are fetched from the web if not given
+        self.route_db = cfg.get('route_db')  # cache of the resolved routes
+        self.geodesic = cfg.get('geodesic_matching', False)  # match waypoints by great circle distance
 
         try:
             os.makedirs('flight_plan_{}_{}2{}'.format(self.date, self.departure_airport, self.arrival_airport))
@@ -42,29 +47,40 @@ class flight_data_generator(object):
 
     def process_trajectory(self):
 
-        self.traj = self.traj.set_index('UNIX TIME', drop=True)  # set unix time column  as table index
-        self.traj = self.traj[~self.traj.index.duplicated(keep='first')]  # remove duplicate index after int operation
-
-        # interpolate trajectory data to 1 second interval
-        self.total_time = np.arange(self.traj.index[0], self.traj.index[-1])
-        self.traj = self.traj.reindex((self.total_time), fill_value=np.nan)
-
-        # fill nan values using linear interpolation
-        self.traj = self.traj.interpolate(method='linear')  # interpolated trajectory with 1 second interval
-
-        # buffer altitude over a given threshold
-        self.traj_buffered = self.traj[pd.to_numeric(self.traj['ALTITUDE']) >= self.altitude_threshold]
-
-        # get samples with sample interval
-        self.sample_interval = int(len(self.traj_buffered) / self.dimension)
-        self.traj_return = self.traj.iloc[int((len(self.traj)-self.sample_interval*self.dimension)/2):
-                                          int((len(self.traj)+self.sample_interval*self.dimension)/2):
-                                          self.sample_interval, :]
+        self.traj = self.traj[~self.traj['UNIX TIME'].duplicated(keep='first')]  # remove duplicate time after int operation
+        self.columns = self.traj.columns.drop('UNIX TIME')
+
+        # 1 second time grid of the trajectory, only the points on the grid are used by the linear interpolation
+        unix_time = np.asarray(self.traj['UNIX TIME'])
+        self.total_time = np.arange(unix_time[0], unix_time[-1])
+        on_grid = (unix_time >= unix_time[0]) & (unix_time < unix_time[-1])
+        self.traj_time = unix_time[on_grid]
+        self.traj_values = np.asarray(self.traj[self.columns], dtype=float)[on_grid]
+
+        # buffer altitude over a given threshold, interpolated altitude never goes below the lowest point
+        altitude = self.traj_values[:, self.columns.get_loc('ALTITUDE')]
+        if len(altitude) > 0 and not np.isnan(altitude).any() and altitude.min() >= self.altitude_threshold:
+            buffered_length = len(self.total_time)
+        else:
+            buffered_length = np.sum(interpolate_linear(self.traj_time, altitude, self.total_time) >= self.altitude_threshold)
+
+        # get samples with sample interval, evaluate the trajectory at the sample time only
+        if self.fixed_interval:
+            self.sample_interval = self.fixed_interval
+            dimension = int(buffered_length / self.sample_interval)
+        else:
+            self.sample_interval = int(buffered_length / self.dimension)
+            dimension = self.dimension
+        self.sample_time = self.total_time[int((len(self.total_time)-self.sample_interval*dimension)/2):
+                                           int((len(self.total_time)+self.sample_interval*dimension)/2):
+                                           self.sample_interval]
+        traj_return = interpolate_linear(self.traj_time, self.traj_values, self.sample_time)
 
         # fix the first and last point as the airport coordinates
-        self.traj_return.is_copy = False  # avoid warning
-        self.traj_return.iloc[0] = self.traj.iloc[0]
-        self.traj_return.iloc[-1] = self.traj.iloc[-1]
+        traj_return[[0, -1]] = interpolate_linear(self.traj_time, self.traj_values, self.total_time[[0, -1]])
+
+        self.traj_return = pd.DataFrame(traj_return, index=pd.Index(self.sample_time, name='UNIX TIME'),
+                                        columns=self.columns)
 
         # save fix size trajectory
         np.save('trajectory data/{}_{}.npy'.format(self.date, self.call_sign), self.traj_return)
@@ -76,7 +92,7 @@ class flight_data_generator(object):
             header=None)
 
         flight_plan_str = file[file[2] == self.call_sign].values[0][4]
-        fp = fetch_from_web(flight_plan_str)
+        fp = resolve_flight_plan(flight_plan_str, self.fix_db, self.route_db)
 
         # for debug only
         # fp = np.asarray([[40.639751, -73.778925],
@@ -96,16 +112,13 @@ class flight_data_generator(object):
         #                       [34.515769, -114.055722],
         #                       [33.942536, -118.408075]])
 
-        # find the unix time correspond to waypoints and create a new dataframe
-        lat = np.asarray(self.traj['LATITUDE'])
-        lon = np.asarray(self.traj['LONGITUDE'])
-        unix_time_fp = []
-        altitude_fp = []
-        for i in range(len(fp)):
-            nn = (fp[i][0] - lat) ** 2 + (fp[i][-1] - lon) ** 2
-            row_idx = np.unravel_index(nn.argmin(), nn.shape)
-            altitude_fp += [self.traj.iloc[row_idx]['ALTITUDE']]
-            unix_time_fp += [self.traj.index[row_idx]]
+        # find the unix time correspond to waypoints on the 1 second trajectory and create a new dataframe
+        lat_lon = interpolate_linear(self.traj_time, self.traj_values[:, [self.columns.get_loc('LATITUDE'),
+                                                                          self.columns.get_loc('LONGITUDE')]],
+                                     self.total_time)
+        unix_time_fp = list(self.total_time[spatial_matcher(lat_lon, self.geodesic).query(fp[:, [0, -1]])[1]])
+        altitude_fp = interpolate_linear(self.traj_time, self.traj_values[:, self.columns.get_loc('ALTITUDE')],
+                                         unix_time_fp)
         self.fp = np.column_stack([np.asarray(unix_time_fp), fp, altitude_fp])  # flight plan with unix time and altitude
 
         # departure and arrival time match with trajectory
@@ -117,19 +130,12 @@ class flight_data_generator(object):
 
         self.fp = self.fp.set_index('UNIX TIME', drop=True)  # set unix time column as table index
 
-        # interpolate to 1 second interval
-        self.fp = self.fp.reindex((self.total_time), fill_value=np.nan)
-
-        # fill nan values using linear interpolation
-        self.fp = self.fp.interpolate(method='linear')  # interpolated trajectory with 1 second interval
-
-        # buffer altitude over a given threshold
-        self.fp_buffered = self.fp[pd.to_numeric(self.fp['ALTITUDE']) >= self.altitude_threshold]
+        if self.fp.index.duplicated().any():
+            raise ValueError("cannot reindex from a duplicate axis")
 
-        # get samples with sample interval
-        self.fp_return = self.fp.iloc[int((len(self.fp)-self.sample_interval*self.dimension)/2):
-                                      int((len(self.fp)+self.sample_interval*self.dimension)/2):
-                                      self.sample_interval, :]
+        # linear interpolation of the flight plan at the sample time
+        self.fp_return = pd.DataFrame(interpolate_linear(self.fp.index, self.fp, self.sample_time),
+                                      index=pd.Index(self.sample_time, name='UNIX TIME'), columns=self.fp.columns)
 
         # fill nan values in self.fp_return with closest values
         self.fp_return = self.fp_return.fillna(method='bfill')
@@ -152,6 +158,7 @@ if __name__ == '__main__':
            'call_sign': 'AAL133',
            'output_dimension': 1000,
            'altitude_buffer': 0,
+           # 'sample_interval': 60,  # seconds between samples, variable length trajectories instead of output_dimension
            }
 
     fun = flight_data_generator(cfg)
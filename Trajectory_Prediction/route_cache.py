@@ -0,0 +1,130 @@
+#! /home/anaconda3 python
+#-*- coding: utf-8 -*-
+
+"""
+@Date: 2026-10-19
+
+This Python script is the persistent cache of resolved flight plan routes.
+Routes are keyed by the normalized route string (upper case fix names without the /HHMM suffix) and the resolved
+coordinates are stored in a sqlite database, so a route filed by many flights is resolved once for the whole archive.
+The database runs in WAL mode with a busy timeout and first writer wins, so several parsers can share one cache file.
+
+"""
+
+import sqlite3
+import collections
+import numpy as np
+from utils import split_flight_plan
+
+
+class route_cache(object):
+    def __init__(self, cfg):
+        self.db_file = cfg.get('route_cache', 'route_cache.db')
+        self.timeout = cfg.get('route_cache_timeout', 60)  # seconds to wait for other writers
+
+        self.memory = {}  # routes already read in this run
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = collections.Counter()  # flights counted by a prefetch and not looked up one by one yet
+
+        self.conn = sqlite3.connect(self.db_file, timeout=self.timeout)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS routes (route TEXT PRIMARY KEY, coords BLOB)')
+        self.conn.commit()
+
+    @staticmethod
+    def key(str):
+        # input: flight plan string, e.g. KJFK..COATE.Q436...KLAX/0539
+        # output: normalized route string, e.g. KJFK.COATE.Q436.KLAX
+        return '.'.join(split_flight_plan(str.strip().upper()))
+
+    def count(self, keys, found, prefetch=False):
+        # input: normalized routes of the flights, whether each one is a hit and whether the flights are looked up
+        #        again one by one later, the flights of a prefetch are counted there and not again on the second lookup
+        for k, x in zip(keys, found):
+            if prefetch:
+                self.prefetched[k] += 1
+            elif self.prefetched[k] > 0:
+                self.prefetched[k] -= 1
+                continue
+            if x:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_many(self, str_list, count=True):
+        # input: list of flight plan strings, the lookups are not counted if count is False
+        # output: list of flight plans as np.array, None for routes not in the cache
+        keys = [self.key(x) for x in str_list]
+
+        # read the routes not in memory with one query per 500 routes
+        query = sorted(set(k for k in keys if k not in self.memory))
+        for i in range(0, len(query), 500):
+            chunk = query[i:i+500]
+            rows = self.conn.execute('SELECT route, coords FROM routes WHERE route IN ({})'.
+                                     format(','.join(['?'] * len(chunk))), chunk).fetchall()
+            for route, coords in rows:
+                self.memory[route] = np.frombuffer(coords, dtype=float).reshape(-1, 2)
+
+        fp_list = [self.memory.get(k) for k in keys]
+        if count:
+            self.count(keys, [x is not None for x in fp_list])
+        return fp_list
+
+    def get(self, str):
+        return self.get_many([str])[0]
+
+    def put_many(self, str_list, fp_list):
+        # input: list of flight plan strings and the resolved flight plans, None is not stored
+        rows = []
+        for x, fp in zip(str_list, fp_list):
+            if fp is None:
+                continue
+            fp = np.asarray(fp, dtype=float).reshape(-1, 2)
+            self.memory[self.key(x)] = fp
+            rows += [(self.key(x), fp.tobytes())]
+
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO routes (route, coords) VALUES (?, ?)', rows)
+
+    def put(self, str, fp):
+        self.put_many([str], [fp])
+
+    def resolve_batch(self, str_list, resolver, prefetch=False):
+        # input: list of flight plan strings, the resolver of a list of routes missing from the cache,
+        #        e.g. fix_database.resolve_batch, and whether the flights are resolved again one by one later
+        # output: list of flight plans as np.array, each distinct route is resolved once
+        keys = [self.key(x) for x in str_list]
+        fp_list = self.get_many(str_list, count=False)
+
+        missing = {}
+        for x, k, fp in zip(str_list, keys, fp_list):
+            if fp is None:
+                missing.setdefault(k, x)
+        if missing:
+            self.put_many(list(missing.values()), resolver(list(missing.values())))
+
+        # a missing route is a miss for its first flight, the repeats are hits only if the route was resolved
+        found = []
+        for k, fp in zip(keys, fp_list):
+            if fp is None and k in missing:
+                del missing[k]
+                found += [False]
+            else:
+                found += [fp is not None or self.memory.get(k) is not None]
+        self.count(keys, found, prefetch)
+
+        return [fp if fp is not None else self.memory.get(k) for k, fp in zip(keys, fp_list)]
+
+    def resolve(self, str, resolver):
+        return self.resolve_batch([str], resolver)[0]
+
+    def hit_rate(self):
+        return self.hits / float(max(self.hits + self.misses, 1))
+
+    def report(self):
+        print("Route cache {}: {} hits, {} misses, hit rate {:.1%}.".
+              format(self.db_file, self.hits, self.misses, self.hit_rate()))
+
+    def close(self):
+        self.conn.close()
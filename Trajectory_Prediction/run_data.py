@@ -12,7 +12,10 @@ This is the main function to loop through all the flight call sign files process
 """
 from weather_cube_generator_ET import weather_cube_generator
 from process_flight_files import flight_data_generator
+from fix_database import fix_database
+from route_cache import route_cache
 import os, utils
+import pandas as pd
 
 #date_list = [20170405, 20170406, 20170407]  # folder name to loop through
 #date_list = [20170405]
@@ -27,15 +30,35 @@ cfg = {'cube_size': 20,  # the size of cube to generate
        'departure_airport': 'JFK',
        'arrival_airport': 'LAX',
        'output_dimension': 1000,  # output dimension for trajectory and flight plan
+       # 'sample_interval': 60,  # seconds between samples, variable length trajectories instead of output_dimension
        'altitude_buffer': 0,  # altitude buffer unit: feet
        'weather_path': '/media/ypang6/paralab/Research/data/',  # path to weather file
+       'fix_database': 'myFPDB.csv',  # local fix database, comment out to fetch flight plans from the web
+       'route_cache': 'route_cache.db',  # resolved routes shared by all days, comment out to disable
        }
 
+if cfg.get('fix_database'):
+    cfg['fix_db'] = fix_database(cfg)
+if cfg.get('route_cache'):
+    cfg['route_db'] = route_cache(cfg)
+
 
 for date in date_list:
     call_sign_list = sorted([x.split('.')[0] for x in os.listdir("raw_track/track_point_{}_{}2{}/".
                      format(date, cfg['departure_airport'], cfg['arrival_airport']))])
 
+    # resolve the flight plans of the day in bulk
+    if cfg.get('fix_db'):
+        try:
+            file = pd.read_csv('flight_data_{}_{}_to_{}.csv'.format(date, cfg['departure_airport'], cfg['arrival_airport']),
+                               header=None)
+            if cfg.get('route_db'):
+                cfg['route_db'].resolve_batch(list(file[4]), cfg['fix_db'].resolve_batch, prefetch=True)
+            else:
+                cfg['fix_db'].resolve_batch(list(file[4]))
+        except IOError:
+            print("Flight plan file not found for {}".format(date))
+
     for call_sign in call_sign_list:
 
         cfg['date'] = date
@@ -68,3 +91,6 @@ for date in date_list:
         except:  # ignore file not found error
             print("Error in weather data for {}".format(call_sign))
             pass
+
+if cfg.get('route_db'):
+    cfg['route_db'].report()
@@ -90,11 +90,15 @@ def check_convective_weather_files(weather_path, unix_time):
 
 
 
-def flight_plan_parser(str):  # use local waypoint database
-
+def split_flight_plan(str):  # break the flight plan string into fix names
     str = str[:-5] # remove last 5 characters
     str_list = str.split('.') # break the string
-    str_list = list(filter(None, str_list)) # remove empty strings
+    return list(filter(None, str_list)) # remove empty strings
+
+
+def flight_plan_parser(str):  # use local waypoint database
+
+    str_list = split_flight_plan(str)
     print (str_list)
 
     # store coordinates
@@ -110,49 +114,80 @@ def flight_plan_parser(str):  # use local waypoint database
     return coords
 
 
+def fetch_fix(name, kind):  # query one fix from online waypoint database source
+    # input: fix name and kind of the fix, 'airport', 'waypoint' or 'navaid'
+    # output: coordinates of the fix as strings, error if the fix is not found
+    import urllib.request
+    if kind == 'airport':
+        websource = urllib.request.urlopen("https://opennav.com/airport/{}".format(name))
+    else:
+        websource = urllib.request.urlopen("https://opennav.com/{}/US/{}".format(kind, name))
+    l = websource.readlines()[13].decode("utf-8")
+    lon, lat = l[l.find("(") + 1:l.rfind(")")].split(',')
+    return [lon, lat]
+
+
 def fetch_from_web(str):  # use online waypoint database source
 
-    str = str[:-5] # remove last 5 characters
-    str_list = str.split('.') # break the string
-    str_list = list(filter(None, str_list)) # remove empty strings
+    str_list = split_flight_plan(str)
     print ("FP:{}".format(str_list))
 
     # store coordinates
     coords = []
 
-    import urllib.request
     # query departure airports
-    websource = urllib.request.urlopen("https://opennav.com/airport/{}".format(str_list[0]))
-    l = websource.readlines()[13].decode("utf-8")
-    lon, lat = l[l.find("(") + 1:l.rfind(")")].split(',')
-    coords += [[lon, lat]]
+    coords += [fetch_fix(str_list[0], 'airport')]
 
     # query waypoints
     for n in range(1, len(str_list)-1):
         try:
-            websource = urllib.request.urlopen("https://opennav.com/waypoint/US/{}".format(str_list[n]))
-            l = websource.readlines()[13].decode("utf-8")
-            lon, lat = l[l.find("(") + 1:l.rfind(")")].split(',')
-            coords += [[lon, lat]]
+            coords += [fetch_fix(str_list[n], 'waypoint')]
         except:
             try:
-                websource = urllib.request.urlopen("https://opennav.com/navaid/US/{}".format(str_list[n]))
-                l = websource.readlines()[13].decode("utf-8")
-                lon, lat = l[l.find("(") + 1:l.rfind(")")].split(',')
-                coords += [[lon, lat]]
+                coords += [fetch_fix(str_list[n], 'navaid')]
             except:
                 print("Waypoint {} not found from {}.".format(str_list[n], "https://opennav.com"))
                 pass
 
     # query arrival airports
-    websource = urllib.request.urlopen("https://opennav.com/airport/{}".format(str_list[-1]))
-    l = websource.readlines()[13].decode("utf-8")
-    lon, lat = l[l.find("(") + 1:l.rfind(")")].split(',')
-    coords += [[lon, lat]]
+    coords += [fetch_fix(str_list[-1], 'airport')]
 
     return np.asarray(coords).astype(float)  # return flight plan as np.array
 
 
+def resolve_flight_plan(str, fix_db=None, route_db=None):
+    # input: flight plan string, an optional fix_database and an optional route_cache
+    # output: flight plan as np.array, from the route cache if the route is resolved before,
+    #         then from the local fix database if given, otherwise from the web
+    if route_db is not None:
+        return route_db.resolve(str, lambda str_list: [resolve_flight_plan(x, fix_db) for x in str_list])
+    if fix_db is None:
+        return fetch_from_web(str)
+    return fix_db.resolve(str)
+
+
+def interpolate_linear(t, values, t_new):
+    # input: time of the points, values (n or n x m array) and the time to evaluate
+    # output: values at t_new, same as reindex to a 1 second grid followed by pandas linear interpolation,
+    #         nan before the first valid value and the last valid value after it
+    t = np.asarray(t, dtype=float)
+    values = np.asarray(values, dtype=float)
+    t_new = np.asarray(t_new, dtype=float)
+
+    one_dim = values.ndim == 1
+    order = np.argsort(t, kind='mergesort')
+    t, values = t[order], values[order].reshape(len(t), -1)
+
+    values_new = np.full((len(t_new), values.shape[1]), np.nan)
+    for i in range(values.shape[1]):
+        valid = ~np.isnan(values[:, i])
+        if valid.any():
+            values_new[:, i] = np.interp(t_new, t[valid], values[valid, i])
+            values_new[t_new < t[valid][0], i] = np.nan
+
+    return values_new[:, 0] if one_dim else values_new
+
+
 def find_index_fp(x, y, resize_ratio):
     y_max, y_min, x_max, x_min = lat2y(53.8742945085336), lat2y(19.35598953632181), lot2x(-61.65138656927017), lot2x(
         -134.3486134307298)
@@ -206,6 +241,115 @@ def lot2x(a):
     return math.radians(a) * Radius
 
 
+def weather_grid(resize_ratio):
+    # input: resize ratio of the CIWS weather grid
+    # output: mercator origin and grid steps of the resized weather grid
+    y_max, y_min, x_max, x_min = lat2y(53.8742945085336), lat2y(19.35598953632181), lot2x(-61.65138656927017), lot2x(
+        -134.3486134307298)
+
+    s_y = np.linspace(y_min, y_max, int(3520 / resize_ratio))
+    s_x = np.linspace(x_min, x_max, int(5120 / resize_ratio))
+
+    return x_min, y_min, s_x[1] - s_x[0], s_y[1] - s_y[0]
+
+
+def cube_geometry(x, y):
+    # input: longitude and latitude of a trajectory
+    # output: mercator coordinates, search directions and slopes of the weather cube at points 1 to n-1,
+    #         shared by every cube size generated along the same trajectory
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    Radius = 6378137.0  # Radius of Earth
+    merc_x = np.radians(x) * Radius
+    merc_y = np.log(np.tan(np.pi / 4 + np.radians(y) / 2)) * Radius
+
+    # search direction
+    dx_ = x[1:] - x[:-1] + 1e-8
+    dy_ = y[1:] - y[:-1] + 1e-8
+
+    # Line 1 along the trajectory and Line 2 the bottom boundary
+    slope_m = (merc_y[1:] - merc_y[:-1] + 1e-8) / (merc_x[1:] - merc_x[:-1] + 1e-8)
+    slope_b = -(merc_x[1:] - merc_x[:-1] + 1e-8) / (merc_y[1:] - merc_y[:-1] + 1e-8)
+
+    return {'x': merc_x[1:],
+            'y': merc_y[1:],
+            'dire_x': dx_ / np.abs(dx_),
+            'dire_y': dy_ / np.abs(dy_),
+            'slope_b': slope_b,
+            'angle_m': np.arctan(slope_m),
+            'angle_b': np.arctan(slope_b)}
+
+
+def point_index(geometry, resize_ratio):
+    # input: geometry from cube_geometry
+    # output: weather grid index of the trajectory points
+    x_min, y_min, step_x, step_y = weather_grid(resize_ratio)
+
+    x_p = np.rint((geometry['x'] - x_min) / step_x).astype(int)
+    y_p = np.rint((geometry['y'] - y_min) / step_y).astype(int)
+
+    return x_p, y_p
+
+
+def cube_index(geometry, cube_size, spacing, resize_ratio):
+    # input: geometry from cube_geometry, cube size and spacing (in grid steps) between the cube points
+    # output: weather grid index of the cube_size x cube_size points of the cube at every trajectory point
+    x_min, y_min, step_x, step_y = weather_grid(resize_ratio)
+
+    slope_b = geometry['slope_b'][:, None]
+    angle_m = geometry['angle_m'][:, None]
+    angle_b = geometry['angle_b'][:, None]
+
+    delta_Xb = np.abs(step_x * spacing * cube_size * np.cos(angle_b))
+    Xb_2 = geometry['x'][:, None] + 0.5 * delta_Xb  # x-coord right-bottom corner
+    Yb_2 = slope_b * (Xb_2 - geometry['x'][:, None]) + geometry['y'][:, None]  # y-coord right-bottom corner
+
+    d_x0 = np.abs(step_y * np.cos(angle_m)) * spacing
+    d_y0 = np.abs(step_y * np.sin(angle_m)) * spacing
+    d_x = np.abs(step_x * np.cos(angle_b)) * spacing
+
+    # first point of every row, moving along the trajectory
+    rows = np.arange(cube_size) > 0
+    Xr = np.cumsum(np.where(rows, geometry['dire_x'][:, None] * d_x0, Xb_2), axis=1)
+    Yr = np.cumsum(np.where(rows, geometry['dire_y'][:, None] * d_y0, Yb_2), axis=1)
+
+    # points of every row, moving along the bottom boundary
+    cols = np.arange(cube_size)
+    x_ = Xr[:, :, None] - d_x[:, :, None] * cols
+    y_ = slope_b[:, :, None] * (x_ - Xr[:, :, None]) + Yr[:, :, None]
+
+    x_i = np.rint((x_ - x_min) / step_x).astype(int)
+    y_i = np.rint((y_ - y_min) / step_y).astype(int)
+
+    return x_i, y_i
+
+
+def find_mean_index(values, x, y, resize_ratio):
+    # input: weather values and arrays of grid index
+    # output: mean of the weather values in the 2r x 2r box around each index, same as find_mean of the generator
+    x = np.asarray(x)
+    y = np.asarray(y)
+    r = resize_ratio
+
+    def bounds(start, stop, n):  # follow python slicing of values[start:stop]
+        start = np.clip(np.where(start < 0, start + n, start), 0, n)
+        stop = np.clip(np.where(stop < 0, stop + n, stop), 0, n)
+        return start, np.maximum(stop, start)
+
+    y_start, y_stop = bounds(r * (y - 1), r * (y + 1), values.shape[0])
+    x_start, x_stop = bounds(r * (x - 1), r * (x + 1), values.shape[1])
+
+    total = np.zeros(x.shape)
+    for dy in range(2 * r):
+        for dx in range(2 * r):
+            row, col = y_start + dy, x_start + dx
+            inside = (row < y_stop) & (col < x_stop)
+            total += np.where(inside, values[np.minimum(row, values.shape[0] - 1), np.minimum(col, values.shape[1] - 1)], 0)
+
+    return total / (4 * r ** 2)
+
+
 def merc_index_to_wgs84(index, resize_ratio):
 
     import pyproj
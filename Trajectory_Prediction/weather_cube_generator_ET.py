@@ -28,16 +28,22 @@ class weather_cube_generator(object):
         self.call_sign = cfg['call_sign']
         print("Processing flight {}_{}".format(self.date, self.call_sign))
 
+        # cube size and spacing can be lists to generate several cubes in one sweep
+        self.cube_spacing = cfg.get('cube_spacing', 1)
+        self.cube_list = [(size, spacing) for size in np.atleast_1d(self.cube_size)
+                          for spacing in np.atleast_1d(self.cube_spacing)]
+
         self.traj = pd.read_csv(cfg['trajectory_path'])
         # self.traj = self.traj.iloc[::self.downsample_ratio, :].reset_index()  # downsample trajectory
 
         self.departure_airport = cfg['departure_airport']
         self.arrival_airport = cfg['arrival_airport']
 
-        try:
-            os.makedirs('weather data/{}2{}_ET'.format(self.departure_airport, self.arrival_airport))
-        except OSError:
-            pass
+        for cube_dir in self.cube_dirs():
+            try:
+                os.makedirs(cube_dir)
+            except OSError:
+                pass
 
         try:
             os.makedirs('weather data/{}2{}_ET_point'.format(self.departure_airport, self.arrival_airport))
@@ -47,6 +53,13 @@ class weather_cube_generator(object):
         # self.lats = np.load('lats.npy')
         # self.lons = np.load('lons.npy')
 
+    def cube_dirs(self):
+        # keep the original folder when only one cube is generated
+        if len(self.cube_list) == 1 and self.cube_list[0][1] == 1:
+            return ['weather data/{}2{}_ET'.format(self.departure_airport, self.arrival_airport)]
+        return ['weather data/{}2{}_ET_{}_{}'.format(self.departure_airport, self.arrival_airport, size, spacing)
+                for size, spacing in self.cube_list]
+
     def find_mean(self, x, y, values):
         # find mean
         x_p_index = self.resize_ratio * np.linspace(x - 1, x + 1, 2 * self.resize_ratio + 1)
@@ -63,114 +76,50 @@ class weather_cube_generator(object):
 
     def get_cube(self):
 
-        y_max, y_min, x_max, x_min = lat2y(53.8742945085336), lat2y(19.35598953632181), lot2x(-61.65138656927017), lot2x(-134.3486134307298)
-
-        dim = np.int32(np.linspace(1, len(self.traj)-1, len(self.traj)-1))
-        nn = np.int32(np.linspace(1, self.cube_size, self.cube_size))
-        nn2 = np.int32(np.linspace(2, self.cube_size, self.cube_size-1))
-
-        s_y = np.linspace(y_min, y_max, int(3520/self.resize_ratio))
-        s_x = np.linspace(x_min, x_max, int(5120/self.resize_ratio))
-
-        step_x = s_x[1] - s_x[0]
-        step_y = s_y[1] - s_y[0]
-
-        weather_tensor = []
-        point_t = []
-
         # information need from the original data file
-        x = self.traj['LONGITUDE']
-        y = self.traj['LATITUDE']
-        t = self.traj['UNIX TIME']
+        x = np.asarray(self.traj['LONGITUDE'])
+        y = np.asarray(self.traj['LATITUDE'])
+        t = np.asarray(self.traj['UNIX TIME'])
 
-        start = time.time()
-
-        #for i in range(1, 100):  # debug only
-        for i in dim:
+        # trajectory geometry is shared by all cube sizes
+        geometry = cube_geometry(x, y)
+        x_p, y_p = point_index(geometry, self.resize_ratio)
 
-            # compute index
-            if (i+1) % int((len(self.traj)/20)) == 0:
-                print("Working on Point {}/{}".format(1+i, len(self.traj)))
+        # weather file of every point, consecutive points usually share the same file
+        weather_files = [check_convective_weather_files(self.weather_path, t[i]) for i in range(1, len(t))]
+        frame_start = [i for i in range(len(weather_files)) if i == 0 or weather_files[i] != weather_files[i-1]]
+        frame_end = frame_start[1:] + [len(weather_files)]
 
-            # check weather file exists at time i
-            weather_file = check_convective_weather_files(self.weather_path, t[i])
-            data = Dataset(weather_file)
-            values = np.squeeze(data.variables['ECHO_TOP'])
+        weather_tensor = [np.zeros((len(weather_files), size, size)) for size, _ in self.cube_list]
+        point_t = np.zeros((len(weather_files), 3))
 
-            # search direction
-            dx_ = x[i] - x[i-1] + 1e-8
-            dire_x = dx_/np.abs(dx_)
-            dy_ = y[i] - y[i-1] + 1e-8
-            dire_y = dy_ / np.abs(dy_)
-
-            # Line 1  Along the Traj
-            slope_m = (lat2y(y[i]) - lat2y(y[i-1]) + 1e-8) / (lot2x(x[i]) - lot2x(x[i-1]) + 1e-8)
-            angle_m = math.atan(slope_m)
+        start = time.time()
 
-            # Line 2 Bottom Boundary
-            slope_b = -(lot2x(x[i]) - lot2x(x[i-1]) + 1e-8) / (lat2y(y[i]) - lat2y(y[i-1]) + 1e-8)
-            angle_b = math.atan(slope_b)
+        for a, b in zip(frame_start, frame_end):
 
-            delta_Xb = np.abs(step_x * self.cube_size * math.cos(angle_b))
-            Y_b = lambda s: slope_b * (s - lot2x(x[i])) + lat2y(y[i])
-            Xb_2 = lot2x(x[i]) + 0.5 * delta_Xb  # x-coord right-bottom corner
-            Yb_2 = Y_b(Xb_2)  # y-coord right-bottom corner
+            print("Working on Point {}/{}".format(b, len(self.traj)))
 
-            # point count
-            h = 0
+            # decode the weather file once for all points and cube sizes
+            data = Dataset(weather_files[a])
+            values = np.ma.filled(np.squeeze(data.variables['ECHO_TOP']), 0)
+            data.close()
 
-            # store 20x20 values
-            weather_v = np.zeros((self.cube_size**2, 1))
+            geometry_frame = {key: value[a:b] for key, value in geometry.items()}
 
             # save weather values at traj point
-            x_p = np.int(round((lot2x(x[i]) - x_min)/step_x))
-            y_p = np.int(round((lat2y(y[i]) - y_min) / step_y))
-
-            point_t_values = self.find_mean(x_p, y_p, values)
-            point_t.append((x_p, y_p, point_t_values))
-
-            # Loop to generate all points coordinates
-            for i in nn:
-
-                d_x0 = np.abs(step_y * math.cos(angle_m))
-                d_y0 = np.abs(step_y * math.sin(angle_m))
-
-                Xb_2i = np.int(round((Xb_2 - x_min) / step_x))
-                Yb_2i = np.int(round((Yb_2 - y_min) / step_y))
-
-                point = (Xb_2i, Yb_2i)
-
-                weather_v[h] = self.find_mean(Xb_2i, Yb_2i, values)
-
-                h = h + 1
-
-                for j in nn2:
-
-                    d_x = np.abs(step_x * math.cos(angle_b))
-
-                    Y_b2 = lambda s: slope_b * (s - Xb_2) + Yb_2
-                    x_ = Xb_2 - d_x * (j - 1)
-                    y_ = Y_b2(x_)
-
-                    x_i = np.int(round((x_ - x_min) / step_x))
-                    y_i = np.int(round((y_ - y_min) / step_y))
-
-                    point = (x_i, y_i)  # index of weather
-
-                    weather_v[h] = self.find_mean(x_i, y_i, values)
-
-                    h = h + 1
-
-                Xb_2 = Xb_2 + dire_x * d_x0
-                Yb_2 = Yb_2 + dire_y * d_y0
+            point_t[a:b] = np.column_stack([x_p[a:b], y_p[a:b],
+                                            find_mean_index(values, x_p[a:b], y_p[a:b], self.resize_ratio)])
 
-            weather_v = weather_v.reshape(self.cube_size, self.cube_size)
-            weather_tensor.append(weather_v)
+            # only the final gather is repeated per cube size
+            for k, (size, spacing) in enumerate(self.cube_list):
+                x_i, y_i = cube_index(geometry_frame, size, spacing, self.resize_ratio)
+                weather_tensor[k][a:b] = find_mean_index(values, x_i, y_i, self.resize_ratio)
 
         print("Total time for one trajectory is: ", time.time() - start)
 
         # save data
-        np.save('weather data/{}2{}_ET/{}_{}'.format(self.departure_airport, self.arrival_airport, self.date, self.call_sign), weather_tensor)
+        for cube_dir, tensor in zip(self.cube_dirs(), weather_tensor):
+            np.save('{}/{}_{}'.format(cube_dir, self.date, self.call_sign), tensor)
         np.save('weather data/{}2{}_ET_point/{}_{}'.format(self.departure_airport, self.arrival_airport, self.date, self.call_sign), point_t)
 
 
@@ -197,7 +146,8 @@ if __name__ == '__main__':
 
     date_list = [20170405, 20170406, 20170407]  # folder name to loop through
 
-    cfg = {'cube_size': 20,  # the size of cube to generate
+    cfg = {'cube_size': 20,  # the size of cube to generate, a list generates all sizes in one sweep
+           'cube_spacing': 1,  # grid steps between cube points, can also be a list
            'resize_ratio': 1,  # ratio of resize performs to the original weather source
            'downsample_ratio': 5,  # downsample ratio to trajectory files
            'departure_airport': 'JFK',
@@ -0,0 +1,140 @@
+import os
+import sys
+import csv
+import time
+import itertools
+import multiprocessing
+
+result_fields = ['final_train_loss', 'final_test_loss', 'best_test_loss', 'best_epoch', 'test_l1', 'test_l2',
+                 'test_l3', 'train_images', 'wall_time', 'images_per_second', 'error']
+
+
+def limit_threads(num_threads):
+    # blas and openmp read these when numpy and tensorflow are imported, the forked workers keep the blas threads of
+    # this process, so numpy is imported only after this is called in sweep_runner.run
+    for x in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+        os.environ[x] = str(num_threads)
+
+
+def train_run(args):
+    # input: name of the run, its cfg of cnn_model, save directory and log file
+    # output: name of the run and its metrics
+    name, cfg, save_dir, log_file = args
+    import numpy as np
+    from train import cnn_model
+
+    stdout = sys.stdout
+    start_time = time.time()
+    try:
+        sys.stdout = open(log_file, 'w')
+        fun = cnn_model(cfg, save_dir)
+        fun.build_graph()
+        fun.train_model()
+    except Exception as e:
+        return name, {'error': repr(e), 'wall_time': time.time() - start_time}
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+        sys.stdout = stdout
+    wall_time = time.time() - start_time
+
+    # test loss of every epoch is l1, l2 and l3, the mean is compared across runs
+    loss_test = np.reshape(fun.test_loss_tol, (-1, 3))
+    return name, {'final_train_loss': fun.train_loss_tol[-1],
+                  'final_test_loss': np.mean(loss_test[-1]),
+                  'best_test_loss': np.min(np.mean(loss_test, axis=1)),
+                  'best_epoch': int(np.argmin(np.mean(loss_test, axis=1))) + 1,
+                  'test_l1': loss_test[-1, 0],
+                  'test_l2': loss_test[-1, 1],
+                  'test_l3': loss_test[-1, 2],
+                  'train_images': fun.x_train.shape[0],
+                  'wall_time': wall_time,
+                  'images_per_second': fun.x_train.shape[0] * len(fun.train_loss_tol) / wall_time}
+
+
+class sweep_runner(object):
+
+    def __init__(self, cfg):
+        self.base_cfg = cfg['base_cfg']  # cfg of cnn_model shared by all runs
+        self.grid = cfg['grid']  # values of every swept key, each combination is one run
+        self.test_ratio = cfg.get('test_ratio', 0.05)  # used if x_train.npy is not prepared yet
+        self.num_workers = cfg.get('num_workers', 4)  # runs at the same time
+        self.threads_per_run = cfg.get('threads_per_run', max(multiprocessing.cpu_count() // self.num_workers, 1))
+        self.sweep_dir = cfg.get('sweep_dir', './sweep')  # checkpoints and logs of the runs
+        self.results_file = cfg.get('results_file', self.sweep_dir + '/results.csv')
+
+        if not os.path.exists(self.sweep_dir):
+            os.makedirs(self.sweep_dir)
+
+    def run_cfgs(self):
+        # output: name, cfg and save directory of every run of the grid
+        keys = sorted(self.grid)
+        runs = []
+        for values in itertools.product(*[self.grid[x] for x in keys]):
+            cfg = dict(self.base_cfg)
+            cfg.update(zip(keys, values))
+            cfg['mmap_data'] = True  # all runs read the same npy files
+            cfg['num_threads'] = self.threads_per_run
+            name = '_'.join('{}_{}'.format(x, cfg[x]) for x in keys)
+            runs += [(name, cfg, self.sweep_dir + '/' + name)]
+        return runs
+
+    def run(self):
+
+        # limit the threads before numpy is loaded, the workers are forked from this process
+        limit_threads(self.threads_per_run)
+        from train_test_separate import prepare_data
+
+        # prepare the dataset once, the runs memory-map the same files
+        if not os.path.exists('x_train.npy'):
+            prepare_data(test_ratio=self.test_ratio)
+
+        runs = self.run_cfgs()
+        keys = sorted(self.grid)
+        cfgs = dict((x[0], x[1]) for x in runs)
+        for x in runs:
+            if not os.path.exists(x[2]):
+                os.makedirs(x[2])
+
+        print("Sweeping {} runs, {} at a time with {} threads each.".format(len(runs), self.num_workers,
+                                                                           self.threads_per_run))
+        start_time = time.time()
+
+        # one fresh process per run, every run builds its own graph
+        pool = multiprocessing.Pool(self.num_workers, maxtasksperchild=1)
+        tasks = [(x[0], x[1], x[2], self.sweep_dir + '/' + x[0] + '.log') for x in runs]
+
+        # rows are written as the runs finish, the table of an interrupted sweep is kept
+        with open(self.results_file, 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=['run'] + keys + result_fields)
+            writer.writeheader()
+            for name, metrics in pool.imap_unordered(train_run, tasks):
+                row = {'run': name}
+                row.update(dict((x, cfgs[name][x]) for x in keys))
+                row.update(metrics)
+                writer.writerow(row)
+                f.flush()
+                print("Finished {}: {}".format(name, metrics.get('error', metrics.get('final_test_loss'))))
+
+        pool.close()
+        pool.join()
+        print("Sweep done in {:.1f} seconds, results in {}.".format(time.time() - start_time, self.results_file))
+
+
+if __name__ == '__main__':
+
+    cfg = {'base_cfg': {'lr': 0.15,
+                        'epoch': 400,
+                        'batch_size': 64,
+                        'conv1_channel': 32,
+                        },
+           'grid': {'lr': [0.05, 0.15],
+                    'batch_size': [32, 64],
+                    'conv1_channel': [16, 32],
+                    },
+           'num_workers': 4,  # runs at the same time
+           'sweep_dir': './sweep',
+           }
+
+    fun = sweep_runner(cfg)
+    fun.run()
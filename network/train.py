@@ -13,10 +13,14 @@ class cnn_model(object):
         self.epoch = cfg['epoch']
         self.lr = cfg['lr']
         self.conv1_channel = cfg['conv1_channel']
+        self.eval_every = cfg.get('eval_every', 0)  # batches between test evaluations, 0 evaluates once per epoch
+        self.eval_batch_size = cfg.get('eval_batch_size', 256)  # test images per run in evaluation
+        self.num_threads = cfg.get('num_threads', 0)  # cpu threads of the session, 0 lets tensorflow use all cores
+        mmap_mode = 'r' if cfg.get('mmap_data', False) else None  # memory-map the images, batches are read when used
 
-        self.x_train = np.load('x_train.npy')
+        self.x_train = np.load('x_train.npy', mmap_mode=mmap_mode)
         self.y_train = np.load('y_train.npy')
-        self.x_test = np.load('x_test.npy')
+        self.x_test = np.load('x_test.npy', mmap_mode=mmap_mode)
         self.y_test = np.load('y_test.npy')
         self.path = save_dir
 
@@ -34,7 +38,7 @@ class cnn_model(object):
         conv3 = tf.layers.conv2d(pool2, self.conv1_channel*4, kernel_size=5, padding='same', activation=tf.nn.relu, name='conv3')
         pool3 = tf.layers.max_pooling2d(conv3, pool_size=[2, 2], strides=2, padding='same', name='pool3')
 
-        pool3_flat = tf.reshape(pool3, [-1, 13*13*128])
+        pool3_flat = tf.reshape(pool3, [-1, 13*13*self.conv1_channel*4])
 
         fc1 = tf.layers.dense(pool3_flat, 2048, activation=tf.nn.relu, name='fc1')
         fc2 = tf.layers.dense(fc1, 512, activation=tf.nn.relu, name='fc2')
@@ -47,6 +51,17 @@ class cnn_model(object):
         self.l3 = tf.reduce_mean(tf.sqrt(tf.square(self.y[:,4]-self.y_out[:,4]) + tf.square(self.y[:,5]-self.y_out[:,5])))
         self.loss = tf.reduce_mean((self.l1 + self.l2 + self.l3)/3)
 
+    def evaluate(self, sess):
+        # input: tensorflow session
+        # output: l1, l2 and l3 on the test set, run in chunks and averaged over the images
+        loss_sum = np.zeros(3)
+        for i in range(0, self.x_test.shape[0], self.eval_batch_size):
+            x_test_batch = self.x_test[i:i+self.eval_batch_size, :, :, :]
+            y_test_batch = self.y_test[i:i+self.eval_batch_size, :]
+            loss_sum += x_test_batch.shape[0] * np.asarray(sess.run([self.l1, self.l2, self.l3], feed_dict={
+                self.x: x_test_batch, self.y: y_test_batch, self.keep_prob: 1.0}))
+        return loss_sum / self.x_test.shape[0]
+
     def train_model(self):
 
         self.train_loss_tol = []
@@ -58,7 +73,11 @@ class cnn_model(object):
         # batch number
         batch_num = int(self.x_train.shape[0]/self.batch_size)
 
-        with tf.Session() as sess:
+        # limit the cpu threads when several models train side by side
+        session_config = tf.ConfigProto(intra_op_parallelism_threads=self.num_threads,
+                                        inter_op_parallelism_threads=min(self.num_threads, 2))
+
+        with tf.Session(config=session_config) as sess:
 
             sess.run(tf.global_variables_initializer())
 
@@ -72,9 +91,12 @@ class cnn_model(object):
 
                     [_, loss_train] = sess.run([train_step, self.loss], feed_dict={self.x: x_train_batch, self.y: y_train_batch, self.keep_prob: 0.5})
 
-                    test_l1, test_l2, test_l3 = sess.run([self.l1, self.l2, self.l3], feed_dict={self.x: self.x_test, self.y: self.y_test, self.keep_prob: 1.0})
-
-                    print "Epoch: {} Batch: {} Train Loss: {} Test Loss: {} {} {}".format(j+1, i+1, loss_train, test_l1, test_l2, test_l3)
+                    # test set is evaluated every eval_every batches and after the last batch of the epoch
+                    if (self.eval_every and (i+1) % self.eval_every == 0) or i == batch_num-1:
+                        test_l1, test_l2, test_l3 = self.evaluate(sess)
+                        print "Epoch: {} Batch: {} Train Loss: {} Test Loss: {} {} {}".format(j+1, i+1, loss_train, test_l1, test_l2, test_l3)
+                    else:
+                        print "Epoch: {} Batch: {} Train Loss: {}".format(j+1, i+1, loss_train)
 
                 self.train_loss_tol = np.append(self.train_loss_tol, loss_train)
                 self.test_loss_tol = np.append(self.test_loss_tol, [test_l1, test_l2, test_l3])
@@ -106,7 +128,8 @@ if __name__ == '__main__':
     cfg = {'lr': 0.15,
            'epoch': 400,
            'batch_size': 64,
-           'conv1_channel': 32
+           'conv1_channel': 32,
+           'eval_every': 0,  # batches between test evaluations, 0 evaluates once per epoch
            }
 
     save_dir = './Batch_' + str(cfg['batch_size']) + '_epoch_' + str(cfg['epoch']) + '_lr_' + str(cfg['lr'])
@@ -1,38 +1,64 @@
 import numpy as np
 import os
 import warnings
-
-
-def prepare_data(test_ratio):
-
-    # process x
-    x_tol = np.empty((100, 100), dtype=float)
-    for name in sorted(os.listdir('unnormalized data')):
-        if name.endswith('.npy'):
-            print "Reading x data file " + name
-            x_tol = np.dstack((x_tol, np.load('unnormalized data/' + name)))
-    x_tol = x_tol[:, :, 1:]
-
-    # arrange dimensions for tensorflow
-    x_tol = np.expand_dims(np.transpose(x_tol, (2, 0, 1)), axis=3)
+from multiprocessing.pool import ThreadPool
+
+
+def read_csv_files(folder, num_cols, pool):
+    # input: folder of csv files, number of columns and thread pool
+    # output: rows of all csv files in name order, files are read in parallel and stacked once
+    names = [x for x in sorted(os.listdir(folder)) if x.endswith('.csv')]
+    rows = []
+    for name, values in zip(names, pool.imap(lambda x: np.genfromtxt(folder + '/' + x, delimiter=',', dtype=float), names)):
+        print "Reading data file " + name
+        rows.append(np.reshape(values, (-1, num_cols)))
+    return np.concatenate(rows) if rows else np.empty((0, num_cols))
+
+
+def prepare_data(test_ratio, num_workers=4):
+
+    pool = ThreadPool(num_workers)
+
+    # process x, first pass counts the images of every file from the npy headers
+    x_names = [x for x in sorted(os.listdir('unnormalized data')) if x.endswith('.npy')]
+    x_counts = []
+    for name in x_names:
+        shape = np.load('unnormalized data/' + name, mmap_mode='r').shape
+        if shape[:2] != (100, 100):
+            raise ValueError("{} has shape {}, expect 100 x 100 images".format(name, shape))
+        x_counts.append(1 if len(shape) == 2 else shape[2])
+    x_offsets = [int(x) for x in np.concatenate([[0], np.cumsum(x_counts)])]
+    x_idx = int(test_ratio * x_offsets[-1])
+
+    # second pass fills x_test.npy and x_train.npy in place, arranged for tensorflow, and takes the max on the way
+    x_test = np.lib.format.open_memmap('x_test.npy', mode='w+', dtype=float, shape=(x_idx, 100, 100, 1))
+    x_train = np.lib.format.open_memmap('x_train.npy', mode='w+', dtype=float, shape=(x_offsets[-1] - x_idx, 100, 100, 1))
+
+    def fill(i):
+        x = np.load('unnormalized data/' + x_names[i])
+        x = np.transpose(np.reshape(x, (100, 100, -1)), (2, 0, 1))
+        start, end = x_offsets[i], x_offsets[i+1]
+        num_test = max(min(end, x_idx) - start, 0)
+        if num_test > 0:
+            x_test[start:start+num_test, :, :, 0] = x[:num_test]
+        if num_test < end - start:
+            x_train[start+num_test-x_idx:end-x_idx, :, :, 0] = x[num_test:]
+        return np.amax(x)
+
+    x_max = -np.inf
+    for name, file_max in zip(x_names, pool.imap(fill, range(len(x_names)))):
+        print "Reading x data file " + name
+        x_max = max(x_max, file_max)
 
     # normalization: the critical value used for x_tol is 59000
-    x_tol = x_tol/np.amax(x_tol)
-
-    x_idx = int(test_ratio * x_tol.shape[0])
-    x_test = x_tol[:x_idx, :, :, :]
-    x_train = x_tol[x_idx:, :, :, :]
-
-    np.save('x_train', x_train)
-    np.save('x_test', x_test)
+    for x in [x_test, x_train]:
+        for i in range(0, x.shape[0], 1000):
+            x[i:i+1000] /= x_max
+        x.flush()
+    x_train_size, x_test_size = x_train.shape[0], x_test.shape[0]
 
     # process y
-    y_tol = np.empty((1, 10))
-    for name in sorted(os.listdir('unnormalized data')):
-        if name.endswith('.csv'):
-            y_tol = np.vstack((y_tol, np.genfromtxt('unnormalized data/' + name, delimiter=',', dtype=float)))
-            print "Reading y data file " + name
-    y_tol = y_tol[1:, :]
+    y_tol = read_csv_files('unnormalized data', 10, pool)
     y_idx = int(test_ratio * y_tol.shape[0])
 
     y_test_range = np.concatenate((y_tol[:y_idx, 0:2], y_tol[:y_idx, 8:10]), axis=1) # save range for model performance evaluation
@@ -51,12 +77,8 @@ def prepare_data(test_ratio):
     np.save('y_test', y_test)
 
     # process other information
-    other_tol = np.empty((1, 12))
-    for name in sorted(os.listdir('start_end')):
-        if name.endswith('.csv'):
-            other_tol = np.vstack((other_tol, np.genfromtxt('start_end/' + name, delimiter=',', dtype=float)))
-            print "Reading data file " + name
-    other_tol = other_tol[1:, :]
+    other_tol = read_csv_files('start_end', 12, pool)
+    pool.close()
 
     other_idx = int(test_ratio * other_tol.shape[0])
     other_test = np.array(other_tol[:other_idx, 4:], dtype='int')
@@ -68,7 +90,7 @@ def prepare_data(test_ratio):
     if x_idx != y_idx or x_idx != other_idx:
         warnings.warn("The size of dataset X, dataset Y and other information dataset are not equal. Please check for possible reasons.")
     else:
-        print "Training set is " + str(x_train.shape[0]) + ". Testing set is " + str(x_test.shape[0]) + "."
+        print "Training set is " + str(x_train_size) + ". Testing set is " + str(x_test_size) + "."
         print 'Done.'
 
 
@@ -1,13 +1,13 @@
 from netCDF4 import Dataset
-import matplotlib.pyplot as plt
 import os
 import pyproj
 from utils import *
+from render_queue import render_queue
 import cv2 as cv
 
 class load_ET(object):
 
-    def __init__(self, date):
+    def __init__(self, date, renderer=None):
 
         a = 2559500
         b = 1759500
@@ -17,6 +17,7 @@ class load_ET(object):
         self.lon = np.zeros_like(self.x, dtype='float64')  # allocate space
         self.lat = np.zeros_like(self.y, dtype='float64')
         self.date = date
+        self.renderer = renderer  # render_queue for the figures, no figures are drawn if not given
 
     def save_labels(self):
 
@@ -72,24 +73,25 @@ class load_ET(object):
 
         print ('There is ' + repr(len(handle)) + ' data files')
 
+        # the pictures are the output here, use a renderer of its own if none is given
+        renderer = self.renderer if self.renderer is not None else render_queue()
+
         for i in range(len(handle)):
         #for i in range(10):
-            data = Dataset("data/" + str(self.date) + "ET/" + handle[i])
-            values = np.squeeze(data.variables['ECHO_TOP'])  # extract values
-
             # save EchoTop values and restore a 3d array
             #self.GY.append(values)
 
-            plt.contourf(self.lon, self.lat, values)
-            plt.xlabel("Longitude")
-            plt.ylabel("Latitude")
-            plt.title(handle[i])
-            # plt.axes([self.lon.min(), self.lon.max(), self.lat.min(), self.lat.max()])
-            plt.show()
-
-            plt.savefig('EchoTopPic/' + str('{date:%Y-%m-%d_%H:%M:%S}'.format(date=datetime.datetime.now())))
+            # one picture per data file, named after the file, the worker reads the full size frame itself
+            renderer.submit({'file': 'EchoTopPic/' + os.path.splitext(handle[i])[0],
+                             'contourf_file': (self.lon, self.lat, "data/" + str(self.date) + "ET/" + handle[i], 'ECHO_TOP'),
+                             'xlabel': "Longitude",
+                             'ylabel': "Latitude",
+                             'title': handle[i]})
             print ('I\'m reading file ' + repr(i))
 
+        if renderer is not self.renderer:
+            renderer.close()
+
         #io.savemat('EchoTop_20170406_WholeDay.mat', {'EchoTop': np.asarray(self.GY)})  # save whole day values into mat file
 
     def plot_weather_contour(self, unix_time, call_sign):
@@ -106,13 +108,34 @@ class load_ET(object):
         nearest_value = make_up_zeros(str(nearest_value))  # make up zeros for 0 230 500 730
 
         # find compared nc file
-        data = Dataset("data/" + pin[:8] + "EchoTop/ciws.EchoTop." + pin[:8] + "T" + str(pin[-6:-4]) + nearest_value + "Z.nc")
+        file_name = "data/" + pin[:8] + "EchoTop/ciws.EchoTop." + pin[:8] + "T" + str(pin[-6:-4]) + nearest_value + "Z.nc"
+        data = Dataset(file_name)
         values = np.squeeze(data.variables['ECHO_TOP'])  # extract values
-        plt.contourf(self.lon, self.lat, values)
 
-        plt.savefig('EchoTopPic/' + str(call_sign) + ' ' + pin)
+        if self.renderer is not None:
+            self.renderer.submit({'file': 'EchoTopPic/' + str(call_sign) + ' ' + pin,
+                                  'contourf_file': (self.lon, self.lat, file_name, 'ECHO_TOP')})
+
+        return values
+
+    def render_crop(self, num, pin, call_sign, lon_new, lat_new, values, y_train, lon_start_idx_ori, lon_end_idx_ori,
+                    lat_start_idx_ori, lat_end_idx_ori, hold):
+        # queue the figure of a cropped weather contour, with the flight plan and the deviation points if hold is True
+
+        if self.renderer is None:
+            return
+
+        job = {'file': 'x_train/' + str(call_sign) + ' ' + pin + ' ' + str(num),
+               'contourf': (lon_new, lat_new, values)}
+
+        if hold is True:
+            xx = np.asarray([self.lon[lon_start_idx_ori], y_train[0], y_train[2], y_train[4], self.lon[lon_end_idx_ori]])
+            yy = np.asarray([self.lat[lat_start_idx_ori], y_train[1], y_train[3], y_train[5], self.lat[lat_end_idx_ori]])
+            job['plots'] = [((xx, yy, "--ko"), {'linewidth': 2}),
+                            (([xx[0], xx[-1]], [yy[0], yy[-1]], "-k*"), {}),
+                            ((y_train[0], y_train[1], 'r*', y_train[2], y_train[3], 'g*', y_train[4], y_train[5], 'b*'), {})]
 
-        # plt.show()
+        self.renderer.submit(job)
 
     def crop_weather_contour_FET(self, num, unix_time, call_sign, lat_start_idx, lat_end_idx, lon_start_idx, lon_end_idx, y_train, lon_start_idx_ori, lon_end_idx_ori, lat_start_idx_ori, lat_end_idx_ori, hold=False):
 
@@ -148,23 +171,9 @@ class load_ET(object):
         lon_new = np.linspace(self.lon[lon_start_idx], self.lon[lon_end_idx], num=100)
         lat_new = np.linspace(self.lat[lat_start_idx], self.lat[lat_end_idx], num=100)
 
-        # plt.contourf(self.lon[lon_start_idx:lon_end_idx], self.lat[lat_start_idx:lat_end_idx], resized_values)
-        plt.contourf(lon_new, lat_new, resized_values)
-
-        #plt.contourf(lon_new, lat_new, scaled_values)
-
-        if hold is True:
-            plt.hold(True)
-            xx = np.asarray([self.lon[lon_start_idx_ori], y_train[0], y_train[2], y_train[4], self.lon[lon_end_idx_ori]])
-            yy = np.asarray([self.lat[lat_start_idx_ori], y_train[1], y_train[3], y_train[5], self.lat[lat_end_idx_ori]])
-            plt.plot(xx, yy, "--ko", linewidth=2)
-            plt.plot([xx[0], xx[-1]], [yy[0], yy[-1]], "-k*")
-            plt.plot(y_train[0], y_train[1], 'r*', y_train[2], y_train[3], 'g*', y_train[4], y_train[5], 'b*')
-        #plt.show()
-
-        # save figure
-        plt.savefig('x_train/' + str(call_sign) + ' ' + pin + ' ' + str(num))
-        plt.hold(False)
+        # queue the figure, the x_train matrix does not wait for it
+        self.render_crop(num, pin, call_sign, lon_new, lat_new, resized_values, y_train,
+                         lon_start_idx_ori, lon_end_idx_ori, lat_start_idx_ori, lat_end_idx_ori, hold)
 
         # return the x_train matrix
         return resized_values
@@ -210,24 +219,9 @@ class load_ET(object):
         lon_new = np.linspace(self.lon[lon_start_idx], self.lon[lon_end_idx], num=100)
         lat_new = np.linspace(self.lat[lat_start_idx], self.lat[lat_end_idx], num=100)
 
-        # plt.contourf(self.lon[lon_start_idx:lon_end_idx], self.lat[lat_start_idx:lat_end_idx], resized_values)
-        #plt.contourf(lon_new, lat_new, scaled_values)
-        plt.contourf(lon_new, lat_new, resized_values)
-
-        if hold is True:
-            plt.hold(True)
-            xx = np.asarray(
-                [self.lon[lon_start_idx_ori], y_train[0], y_train[2], y_train[4], self.lon[lon_end_idx_ori]])
-            yy = np.asarray(
-                [self.lat[lat_start_idx_ori], y_train[1], y_train[3], y_train[5], self.lat[lat_end_idx_ori]])
-            plt.plot(xx, yy, "--ko", linewidth=2)
-            plt.plot([xx[0], xx[-1]], [yy[0], yy[-1]], "-k*")
-            plt.plot(y_train[0], y_train[1], 'r*', y_train[2], y_train[3], 'g*', y_train[4], y_train[5], 'b*')
-        # plt.show()
-
-        # save figure
-        plt.savefig('x_train/' + str(call_sign) + ' ' + pin + ' ' + str(num))
-        plt.hold(False)
+        # queue the figure, the x_train matrix does not wait for it
+        self.render_crop(num, pin, call_sign, lon_new, lat_new, resized_values, y_train,
+                         lon_start_idx_ori, lon_end_idx_ori, lat_start_idx_ori, lat_end_idx_ori, hold)
 
         # return the x_train matrix
         return resized_values
@@ -243,10 +237,14 @@ if __name__ == '__main__':
     unix_time = 1491450567.000  # a correct time
     call_sign = 'AAL717'
 
-    fun = load_ET(date)
+    renderer = render_queue()
+
+    fun = load_ET(date, renderer)
     # fun.save_labels()  # only need to run this function once
     fun.load_labels()
     fun.save_pics()
     fun.plot_weather_contour(unix_time, call_sign)
 
+    renderer.close()
+
 
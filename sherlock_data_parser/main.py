@@ -1,18 +1,20 @@
 from jpype import *
 from FAA_parser import FAA_Parser
 from CIWS_parser import load_ET
-import matplotlib.pyplot as plt
+from render_queue import render_queue
 from utils import *
+from spatial_matcher import spatial_matcher
 import os
 import csv
 
 
 class FAA_ENGINE(object):
 
-    def __init__(self, call_sign, date):  # this engine takes explicitly two inputs, date and flight call sign
+    def __init__(self, call_sign, date, renderer=None):  # this engine takes explicitly two inputs, date and flight call sign
 
         self.time = date
         self.call_sign = call_sign
+        self.renderer = renderer  # render_queue for the figures, no figures are drawn if not given
         self.threshold = 0.2
         self.lon = np.load('lon.npy')
         self.lat = np.load('lat.npy')
@@ -45,31 +47,34 @@ class FAA_ENGINE(object):
         if aclist is None:
             return
 
+        flight_plans = []
         for i in range(len(aclist)):
             ac = aircraftInterface.select_aircraft(aclist[i])
-            lon = ac.getFlight_plan_longitude_array()
-            lat = ac.getFlight_plan_latitude_array()
+            lon = np.asarray(ac.getFlight_plan_longitude_array())
+            lat = np.asarray(ac.getFlight_plan_latitude_array())
 
             # save original flightplan waypoint coords as a csv file
             if i == 0:
                 np.savetxt("flight_plan_coords/" + self.call_sign + "_" + str(i) + ".csv",
                            np.asarray([lon, lat]).T, delimiter=",")
 
-            plt.plot(lon, lat)
-            plt.hold(True)
+            flight_plans.append(((lon, lat), {}))
 
-            plt.legend(self.datetime[i])
+        if self.renderer is None:
+            return
 
-        plt.savefig('flight_plan_plot/flight_plan_' + self.call_sign + '_' + self.time)
+        # queue the flight plans figure, one legend entry per flight plan
+        legend = [str(x) for x in self.datetime[:len(aclist)]]
+        self.renderer.submit({'file': 'flight_plan_plot/flight_plan_' + self.call_sign + '_' + self.time,
+                              'plots': flight_plans,
+                              'legend': legend})
 
         # draw real trajectory along with flight plans
         if draw_traj is True:
             traj = np.genfromtxt('traj_csv/' + self.time + '_' + self.call_sign + '.csv', delimiter=",")  # load csv file
-            plt.plot(traj[:, 1], traj[:, 2], 'k--')
-            plt.savefig('traj_plot/traj_' + self.call_sign + '_' + self.time)
-
-        plt.hold(False)
-        # plt.show()
+            self.renderer.submit({'file': 'traj_plot/traj_' + self.call_sign + '_' + self.time,
+                                  'plots': flight_plans + [((traj[:, 1], traj[:, 2], 'k--'), {})],
+                                  'legend': legend})
 
     def fetch_data(self, count):
 
@@ -87,31 +92,18 @@ class FAA_ENGINE(object):
 
         trajectory = np.genfromtxt("traj_csv/" + self.time + "_" + self.call_sign + '.csv', delimiter=",")[:, -3:-1]
 
-        max_distance = []  # maximum distance
-        max_point = np.empty((0, 2))  # maximum point
-        for i in range(0, len(waypoints)-1):
-            closest_point_start_idx = spatial.KDTree(trajectory).query(waypoints[i, :])[1]
-            closest_point_end_idx = spatial.KDTree(trajectory).query(waypoints[i+1, :])[1]
+        # closest trajectory point of every waypoint, one tree for the trajectory
+        closest_point_idx = spatial_matcher(trajectory, lon_lat=True).query(waypoints)[1]
 
-            if closest_point_start_idx >= closest_point_end_idx:
-                traj_max_point, traj_max_distance = [0, 0], 0
-            else:
-                traj_max_point, traj_max_distance = calculate_max_distance(waypoints[i, :], waypoints[i+1, :],
-                                                        trajectory[closest_point_start_idx:closest_point_end_idx, :])
-
-            max_point = np.vstack([max_point, traj_max_point])
-            max_distance = np.append(max_distance, traj_max_distance)
+        # deviation of every flight plan segment in one array operation, the ranges of segments with maximum
+        # distance greater than the given threshold give the start waypoint and the end waypoint of the weather plot
+        max_distance, max_point, wp_range = flight_deviation(waypoints, trajectory, closest_point_idx, self.threshold)
 	print max_distance
 
         with open('statistics.csv', 'a') as f3:
             writer = csv.writer(f3, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
             writer.writerow(max_distance)
 
-        # get the idx of points maximum distance greater than the given threshold value
-        # then range it to get the start waypoint and the end waypoint to get the weather plot
-
-        wp_range = ranges(np.squeeze(np.where(max_distance > self.threshold)))
-
         wp_time = np.genfromtxt("traj_csv/" + self.time + "_" + self.call_sign + '.csv', delimiter=",")[:, 0]
 
         print "Found " + str(len(wp_range)) + " useful data points from the database of flight " + self.call_sign
@@ -124,7 +116,7 @@ class FAA_ENGINE(object):
             print "start waypoint: " + str(start_pt)  # start point of the weather contour
             print "return waypoint: " + str(end_pt)  # end point of the weather contour
 
-            wp_time_idx = spatial.KDTree(trajectory).query(start_pt)[1]
+            wp_time_idx = closest_point_idx[wp_range[i][0]]
             weather_plot_time = wp_time[wp_time_idx]
 
             lon_start_idx_ori = find_nearest_index(self.lon, start_pt[0])
@@ -174,7 +166,7 @@ class FAA_ENGINE(object):
             #     lat_end_idx = lat_end_idx + 1
 
             # save x_train
-            x_train = load_ET(self.time).crop_weather_contour_ET(i, weather_plot_time, self.call_sign,
+            x_train = load_ET(self.time, self.renderer).crop_weather_contour_ET(i, weather_plot_time, self.call_sign,
                                                     lat_start_idx[0], lat_end_idx[0], lon_start_idx[0], lon_end_idx[0],
                                                     y_train,
                                                     lon_start_idx_ori[0], lon_end_idx_ori[0], lat_start_idx_ori[0], lat_end_idx_ori[0],
@@ -194,6 +186,9 @@ if __name__ == '__main__':
     # flight call sign count index
     count = 0
 
+    # figures are drawn by background processes, started before the JVM, set to None to skip all figures
+    renderer = render_queue()
+
     # start NATS server
     # need to start a new process, not finished
     # start_NATS()
@@ -233,7 +228,7 @@ if __name__ == '__main__':
                 print("Start reading flight number " + str(count))
 
                 # run the FAA ENGINE to fetch data
-                fun = FAA_ENGINE(row[0], date)
+                fun = FAA_ENGINE(row[0], date, renderer)
                 #fun = FAA_ENGINE("CGDHS", date)
                 fun.run_parser_and_save_files()
                 # fun.weather_contour()
@@ -248,4 +243,7 @@ if __name__ == '__main__':
             #except:
                 #pass
 
+    if renderer is not None:
+        renderer.close()
+
     shutdownJVM()
@@ -0,0 +1,75 @@
+# This file renders the figures of the data generation in background processes.
+# A render job is a dict of arrays describing one figure, the data path queues the jobs and carries on while a pool
+# of workers draws them with the Agg backend, so no display is needed and plotting does not hold up the data.
+
+import collections
+import multiprocessing
+import numpy as np
+
+
+def render_figure(job):
+    # input: render job with the output 'file' and optional 'contourf' (x, y, z), 'contourf_file' (x, y, netcdf file,
+    #        variable), 'plots' [(args, kwargs)], 'legend', 'title', 'xlabel' and 'ylabel'
+    # output: file name of the saved figure
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    # a new figure for every job, nothing is shared with pyplot
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+
+    if job.get('contourf') is not None:
+        ax.contourf(*job['contourf'])
+    if job.get('contourf_file') is not None:
+        # full size frames are read here, the queued job only carries the file name
+        from netCDF4 import Dataset
+        x, y, file_name, variable = job['contourf_file']
+        data = Dataset(file_name)
+        z = np.squeeze(data.variables[variable])
+        data.close()
+        ax.contourf(x, y, z)
+    for args, kwargs in job.get('plots', []):
+        ax.plot(*args, **kwargs)
+    if job.get('legend') is not None:
+        ax.legend(job['legend'])
+    if job.get('title') is not None:
+        ax.set_title(job['title'])
+    if job.get('xlabel') is not None:
+        ax.set_xlabel(job['xlabel'])
+    if job.get('ylabel') is not None:
+        ax.set_ylabel(job['ylabel'])
+
+    fig.savefig(job['file'])
+    return job['file']
+
+
+class render_queue(object):
+
+    def __init__(self, num_workers=None, max_pending=100):
+        # start the workers before the JVM or any other threads of the data path
+        self.pool = multiprocessing.Pool(num_workers)  # one worker per cpu if not given
+        self.max_pending = max_pending  # queued jobs before submit waits for the oldest one
+        self.pending = collections.deque()
+        self.num_rendered = 0
+
+    def wait(self, result):
+        # a failed figure is reported, the data generation goes on
+        try:
+            result.get()
+            self.num_rendered += 1
+        except Exception as e:
+            print("Render failed: " + repr(e))
+
+    def submit(self, job):
+        while len(self.pending) >= self.max_pending:
+            self.wait(self.pending.popleft())
+        self.pending.append(self.pool.apply_async(render_figure, (job,)))
+
+    def close(self):
+
+        while self.pending:
+            self.wait(self.pending.popleft())
+        self.pool.close()
+        self.pool.join()
+        print("Rendered " + str(self.num_rendered) + " figures.")
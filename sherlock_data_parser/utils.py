@@ -106,6 +106,64 @@ def ranges(nums):
     return list(zip(edges, edges))
 
 
+def batch_deviation(waypoints, trajectories, closest_idx, threshold):
+    # input: lists of flight plan waypoints (m x 2), trajectories (n x 2) and the closest trajectory index of each
+    #        waypoint, one of each per flight, and the deviation threshold
+    # output: list of (maximum distance, maximum point, ranges over threshold) per flight, same as
+    #         calculate_max_distance on each flight plan segment but the maximum point is the real argmax,
+    #         segments with no trajectory points in between return [0, 0] and 0
+
+    # flight plan segments of all flights
+    a = np.concatenate([np.reshape(w, (-1, 2))[:-1] for w in waypoints]).astype(float)
+    b = np.concatenate([np.reshape(w, (-1, 2))[1:] for w in waypoints]).astype(float)
+    seg_offsets = np.cumsum([0] + [len(x) for x in (np.reshape(w, (-1, 2))[1:] for w in waypoints)])
+
+    # trajectory points between the closest points of the segment start and end waypoints
+    traj_offsets = np.cumsum([0] + [len(t) for t in trajectories])
+    points = np.concatenate([np.reshape(t, (-1, 2)) for t in trajectories]).astype(float)
+    start = np.concatenate([traj_offsets[i] + np.asarray(closest_idx[i], dtype=int)[:-1] for i in range(len(waypoints))])
+    end = np.concatenate([traj_offsets[i] + np.asarray(closest_idx[i], dtype=int)[1:] for i in range(len(waypoints))])
+    length = np.maximum(end - start, 0)
+    seg = np.repeat(np.arange(len(a)), length)
+    pos = np.arange(length.sum()) - np.repeat(np.cumsum(length) - length, length) + start[seg]
+
+    # cross track distance of every point to its segment, twice the triangle area over the segment length
+    ab = b - a
+    ap = points[pos] - a[seg]
+    area = np.abs(ab[seg, 0] * ap[:, 1] - ab[seg, 1] * ap[:, 0])
+
+    max_distance = np.zeros(len(a))
+    max_point = np.zeros((len(a), 2))
+    nonempty = length > 0
+    seg_start = (np.cumsum(length) - length)[nonempty]
+    if len(seg_start) > 0:
+        max_area = np.maximum.reduceat(area, seg_start)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            max_distance[nonempty] = max_area / np.sqrt(np.sum(ab[nonempty] ** 2, axis=1))
+
+        # first point reaching the maximum of each segment
+        first = np.where(area == np.repeat(max_area, length[nonempty]), np.arange(len(area)), len(area))
+        max_point[nonempty] = points[pos[np.minimum.reduceat(first, seg_start)]]
+
+    return [(max_distance[seg_offsets[i]:seg_offsets[i+1]], max_point[seg_offsets[i]:seg_offsets[i+1]],
+             deviation_ranges(max_distance[seg_offsets[i]:seg_offsets[i+1]], threshold)) for i in range(len(waypoints))]
+
+
+def flight_deviation(waypoints, trajectory, closest_idx, threshold):
+    # single flight version of batch_deviation
+    return batch_deviation([waypoints], [trajectory], [closest_idx], threshold)[0]
+
+
+def deviation_ranges(max_distance, threshold):
+    # input: maximum distance of each flight plan segment and the threshold
+    # output: list of (first, last) segment index of the runs over threshold, same as ranges
+    idx = np.where(np.asarray(max_distance) > threshold)[0]
+    if len(idx) == 0:
+        return []
+    breaks = np.where(np.diff(idx) > 1)[0]
+    return list(zip(np.append(idx[:1], idx[breaks + 1]).tolist(), np.append(idx[breaks], idx[-1:]).tolist()))
+
+
 def get_y_train(range, array, start_pt, end_pt):
 
     # one waypoint
@@ -304,6 +362,7 @@ if __name__ == '__main__':
     c = np.asarray([[2, 1], [3, 2], [4, 3], [5, 4]])
     point, distance = calculate_max_distance(a, b, c)
     print point, distance
+    print flight_deviation(np.asarray([a, b]), c, [0, len(c)], 0.2)
 
     array = np.asarray([1,2,3,4,5,6,7,8,9,0])
     num = np.asarray([3.4])
@@ -0,0 +1,112 @@
+# This file classifies the deviation samples as correlated with weather or not in batches.
+# The start to end diagonals of all samples are rasterized at once and the weather values along them are reduced
+# with array operations, the splits are written in bulk.
+
+import numpy as np
+import os
+import csv
+
+
+def diagonal_index(coords, x_dim=100):
+    # input: columns 4:12 of the start_and_end rows (n x 8), start and end points followed by the image range
+    # output: rows and columns of the pixels on the start to end line of every sample (n x steps) and the mask of
+    #         the distinct pixels, same pixels as rounding LineString.interpolate at every unit of length
+    coords = np.asarray(coords, dtype=float)
+    r1 = (coords[:, 6] - coords[:, 4]) / x_dim
+    r2 = (coords[:, 7] - coords[:, 5]) / x_dim
+
+    # round half away from zero like the python 2 round, coordinates are not negative
+    x1 = np.clip(np.floor((coords[:, 0] - coords[:, 4]) / r1 + 0.5), 0, x_dim - 1)
+    x2 = np.clip(np.floor((coords[:, 2] - coords[:, 4]) / r1 + 0.5), 0, x_dim - 1)
+    y1 = np.clip(np.floor((coords[:, 1] - coords[:, 5]) / r2 + 0.5), 0, x_dim - 1)
+    y2 = np.clip(np.floor((coords[:, 3] - coords[:, 5]) / r2 + 0.5), 0, x_dim - 1)
+
+    # points at every unit of length, the points past the end of shorter lines stay on their end point
+    length = np.hypot(x2 - x1, y2 - y1)
+    steps = np.arange(int(np.ceil(length.max())) + 1 if len(length) else 1)
+    t = np.minimum(steps[None, :] / np.where(length > 0, length, 1)[:, None], 1)
+    t[length == 0] = 0
+    px = np.floor(x1[:, None] + (x2 - x1)[:, None] * t + 0.5).astype(int)
+    py = np.floor(y1[:, None] + (y2 - y1)[:, None] * t + 0.5).astype(int)
+
+    # the pixels along a line are monotonic, a repeated pixel always follows itself
+    distinct = np.ones(px.shape, dtype=bool)
+    distinct[:, 1:] = (px[:, 1:] != px[:, :-1]) | (py[:, 1:] != py[:, :-1])
+    return px, py, distinct
+
+
+def diagonal_values(x, px, py, distinct):
+    # input: weather images (n x x_dim x x_dim) and the diagonal pixels of diagonal_index
+    # output: max and sum of the weather along the diagonal of every sample
+    values = x[np.arange(x.shape[0])[:, None], px, py]
+    return np.max(np.where(distinct, values, -np.inf), axis=1), np.sum(np.where(distinct, values, 0), axis=1)
+
+
+class correlation_classifier(object):
+
+    def __init__(self, cfg):
+        self.threshold = cfg['threshold']
+        self.criterion = cfg.get('criterion', 'max')  # 'max' or 'sum' of the weather along the diagonal
+        self.x_dim = cfg.get('x_dim', 100)
+        self.batch_size = cfg.get('batch_size', 1000)  # samples loaded and reduced at once
+        self.details = cfg.get('details', True)  # also write values_diag.csv, start_end splits and x_corr_tol.npy
+
+        # load npy file name in a list and the csv files
+        self.x_train_list = sorted([x.split('.')[0] for x in os.listdir("x_train_npy/")], key=int)
+        with open('y_train.csv') as f:
+            self.y_train = list(csv.reader(f))
+        with open('start_and_end.csv') as f:
+            self.start_end = list(csv.reader(f))
+        self.size = min(len(self.y_train), len(self.start_end))
+        self.coords = np.asarray([x[4:12] for x in self.start_end[:self.size]], dtype=float)
+
+    def load_batch(self, idx):
+        # input: sample indices of the batch
+        # output: weather images of the batch in one preallocated array
+        x = np.empty((len(idx), self.x_dim, self.x_dim), dtype=float)
+        for i in range(len(idx)):
+            x[i] = np.load("x_train_npy/" + self.x_train_list[idx[i]] + ".npy")
+        return x
+
+    def classify(self):
+
+        values = np.empty((self.size, 2))
+        corr = np.zeros(self.size, dtype=bool)
+        x_corr = []
+
+        for i in range(0, self.size, self.batch_size):
+            idx = np.arange(i, min(i + self.batch_size, self.size))
+            x = self.load_batch(idx)
+
+            px, py, distinct = diagonal_index(self.coords[idx], self.x_dim)
+            values[idx, 0], values[idx, 1] = diagonal_values(x, px, py, distinct)
+            corr[idx] = values[idx, 0 if self.criterion == 'max' else 1] >= self.threshold
+
+            for j in range(len(idx)):
+                np.save(('corr_weather/' if corr[idx[j]] else 'uncorr_weather/') + str(idx[j]) + '.npy', x[j])
+            if self.details:
+                x_corr += list(x[corr[idx]])
+
+        self.write_splits(values, corr)
+        if self.details:
+            np.save('x_corr_tol.npy', np.dstack(x_corr) if x_corr else np.empty((self.x_dim, self.x_dim, 0)))
+
+        print("{} of {} samples are correlated with weather.".format(int(np.sum(corr)), self.size))
+        return values, corr
+
+    def write_splits(self, values, corr):
+        # write the rows of both splits, each file is opened once
+
+        def write_rows(file_name, rows):
+            with open(file_name, 'w') as f:
+                fwriter = csv.writer(f, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+                fwriter.writerows(rows)
+
+        y_rows = [self.start_end[c][0:2] + self.y_train[c] + self.start_end[c][2:4] for c in range(self.size)]
+        write_rows('y_train_corr.csv', [y_rows[c] for c in range(self.size) if corr[c]])
+        write_rows('y_train_uncorr.csv', [y_rows[c] for c in range(self.size) if not corr[c]])
+
+        if self.details:
+            write_rows('values_diag.csv', values)
+            write_rows('start_end_corr.csv', [self.start_end[c] for c in range(self.size) if corr[c]])
+            write_rows('start_end_uncorr.csv', [self.start_end[c] for c in range(self.size) if not corr[c]])
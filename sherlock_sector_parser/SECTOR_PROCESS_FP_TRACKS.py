@@ -17,6 +17,9 @@ import pandas as pd
 import numpy as np
 import utils as ut
 import pickle
+from fix_database import fix_database
+from route_cache import route_cache
+from spatial_matcher import spatial_matcher
 
 
 class sector_processer(object):
@@ -29,9 +32,21 @@ class sector_processer(object):
         self.fp_raw = np.load('{}/FP_{}_{}.npy'.format(self.sector_name, self.sector_name, self.date))
         self.traj_raw = np.load('{}/TRACKS_{}_{}.npy'.format(self.sector_name, self.sector_name, self.date), encoding='latin1')
 
+        # local fix database, flight plans are fetched from the web if not given
+        self.fix_db = fix_database(cfg) if cfg.get('fix_database') else None
+        self.route_db = route_cache(cfg) if cfg.get('route_cache') else None  # cache of the resolved routes
+        self.geodesic = cfg.get('geodesic_matching', False)  # match waypoints by great circle distance
+
     def process(self):
         dict_traj_return = {}
         dict_fp_return = {}
+
+        # resolve the flight plans of the day in bulk
+        if self.fix_db is not None and self.route_db is not None:
+            self.route_db.resolve_batch(list(self.fp_raw.item().values()), self.fix_db.resolve_batch, prefetch=True)
+        elif self.fix_db is not None:
+            self.fix_db.resolve_batch(list(self.fp_raw.item().values()))
+
         for key in self.fp_raw.item():
             print("Processing Flight {}".format(key))
             try:
@@ -46,6 +61,9 @@ class sector_processer(object):
         pickle.dump(dict_fp_return, open('FP_{}_{}.p'.format(self.sector_name, self.date), 'wb'))
         pickle.dump(dict_traj_return, open('TRACKS_{}_{}.p'.format(self.sector_name, self.date), 'wb'))
 
+        if self.route_db is not None:
+            self.route_db.report()
+
         #data = pickle.load(open('FP_{}_{}.p'.format(self.sector_name, self.date), 'rb'))
 
     def process_traj_fp(self, key):
@@ -57,29 +75,24 @@ class sector_processer(object):
         self.traj[1] = self.traj[1].astype(int)
         self.traj = self.traj.set_index(1, drop=True)
 
-        # interpolate trajectory data to 1 second interval
-        self.total_time = np.arange(self.traj.index[0], self.traj.index[-1])
-        self.traj = self.traj.reindex(self.total_time, fill_value=np.nan)
+        if self.traj.index.duplicated().any():
+            raise ValueError("cannot reindex from a duplicate axis")
 
-        # fill nan values using linear interpolation
-        self.traj = self.traj.interpolate(method='linear')  # interpolated trajectory with 1 second interval
+        # 1 second time grid of the trajectory, only the points on the grid are used by the linear interpolation
+        self.total_time = np.arange(self.traj.index[0], self.traj.index[-1])
+        on_grid = (self.traj.index >= self.traj.index[0]) & (self.traj.index < self.traj.index[-1])
+        traj_time, traj_values = np.asarray(self.traj.index)[on_grid], np.asarray(self.traj)[on_grid]
 
         # parse string format of flight plan
-        self.fp = ut.fetch_from_web(self.fp_raw.item().get(key))
-        lat, lon = np.asarray(self.traj[9]), np.asarray(self.traj[10])
+        self.fp = ut.resolve_flight_plan(self.fp_raw.item().get(key), self.fix_db, self.route_db)
+        lat_lon = ut.interpolate_linear(traj_time, traj_values[:, [0, 1]], self.total_time)
 
         # find the time and altitude for flight plan points
-        unix_time_fp = []
-        altitude_fp = []
-        out_idx = []
-        for i in range(len(self.fp)):
-            nn = (self.fp[i][0] - lat) ** 2 + (self.fp[i][-1] - lon) ** 2
-            if nn.min() > 0.5:  # get the fp index that are out of the sector range
-                out_idx += [i]
-            else:
-                row_idx = np.unravel_index(nn.argmin(), nn.shape)
-                altitude_fp += [self.traj.iloc[row_idx][11]]
-                unix_time_fp += [self.traj.index[row_idx]]
+        distance, idx = spatial_matcher(lat_lon, self.geodesic).query(self.fp[:, [0, -1]])
+        out = distance ** 2 > 0.5  # get the fp index that are out of the sector range
+        out_idx = list(np.where(out)[0])
+        unix_time_fp = list(self.total_time[idx[~out]])
+        altitude_fp = ut.interpolate_linear(traj_time, traj_values[:, 2], unix_time_fp)
 
         # remove flight plan points out of the sector
         self.fp = np.delete(self.fp, out_idx, axis=0)
@@ -91,28 +104,34 @@ class sector_processer(object):
         self.fp[0] = self.fp[0].astype(int)
         self.fp = self.fp.set_index(0, drop=True)
 
-        # interpolate fp data to 1 second interval
+        # flight plan points on its 1 second grid are used by the linear interpolation
         self.total_time_fp = np.arange(self.fp.index[0], self.fp.index[-1]+1)
-        self.fp = self.fp.reindex(self.total_time_fp, fill_value=np.nan)
-
-        # fill nan values using linear interpolation
-        self.fp = self.fp.interpolate(method='linear')  # interpolated fp with 1 second interval
+        on_grid_fp = (self.fp.index >= self.fp.index[0]) & (self.fp.index <= self.fp.index[-1])
+        if self.fp.index[on_grid_fp].duplicated().any():
+            raise ValueError("cannot reindex from a duplicate axis")
 
         # cut trajectory points between flight plan, use time match
         start_time = int(unix_time_fp[0])
         end_time = int(unix_time_fp[-1])
-        self.traj = self.traj.loc[start_time:end_time, :]
+        cut_time = self.total_time[(self.total_time >= start_time) & (self.total_time <= end_time)]
 
         # get samples with sample interval
-        self.sample_interval = int(len(self.traj) / self.length)
+        self.sample_interval = int(len(cut_time) / self.length)
+
+        # evaluate the trajectory and flight plan at the sample time only
+        traj_sample_time = cut_time[int((len(cut_time) - self.sample_interval * self.length) / 2):
+                                    int((len(cut_time) + self.sample_interval * self.length) / 2):
+                                    self.sample_interval]
+        fp_sample_time = self.total_time_fp[int((len(self.total_time_fp) - self.sample_interval * self.length) / 2):
+                                            int((len(self.total_time_fp) + self.sample_interval * self.length) / 2):
+                                            self.sample_interval]
 
         # get the return trajectory and flight plan
-        self.traj_return = self.traj.iloc[int((len(self.traj) - self.sample_interval * self.length) / 2):
-                                          int((len(self.traj) + self.sample_interval * self.length) / 2):
-                                          self.sample_interval, :]
-        self.fp_return = self.fp.iloc[int((len(self.fp) - self.sample_interval * self.length) / 2):
-                                          int((len(self.fp) + self.sample_interval * self.length) / 2):
-                                          self.sample_interval, :]
+        self.traj_return = pd.DataFrame(ut.interpolate_linear(traj_time, traj_values, traj_sample_time),
+                                        index=pd.Index(traj_sample_time, name=1), columns=self.traj.columns)
+        self.fp_return = pd.DataFrame(ut.interpolate_linear(np.asarray(self.fp.index)[on_grid_fp],
+                                                            np.asarray(self.fp)[on_grid_fp], fp_sample_time),
+                                      index=pd.Index(fp_sample_time, name=0), columns=self.fp.columns)
 
 
 if __name__ == '__main__':
@@ -120,5 +139,7 @@ if __name__ == '__main__':
     cfg['date'] = '20190805'
     cfg['sector_name'] = 'ZID'
     cfg['number_of_points'] = 50
+    cfg['fix_database'] = 'myFPDB.csv'  # local fix database, comment out to fetch flight plans from the web
+    cfg['route_cache'] = 'route_cache.db'  # resolved routes shared by all days, comment out to disable
     fun = sector_processer(cfg)
     fun.process()
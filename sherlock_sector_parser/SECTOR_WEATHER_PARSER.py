@@ -30,6 +30,12 @@ class weather_cube_generator(object):
         self.resize_ratio = cfg['resize_ratio']
         self.cube_size = cfg['cube_size']
         self.weather_path = cfg['weather_path']
+
+        # cube size and spacing can be lists to generate several cubes in one sweep
+        self.cube_spacing = cfg.get('cube_spacing', 1)
+        self.cube_list = [(size, spacing) for size in np.atleast_1d(self.cube_size)
+                          for spacing in np.atleast_1d(self.cube_spacing)]
+
         self.fp = pickle.load(open('FP_{}_{}.p'.format(self.sector_name, self.date), 'rb'))
         self.traj_dict = pickle.load(open('TRACKS_{}_{}.p'.format(self.sector_name, self.date), 'rb'))
 
@@ -44,17 +50,25 @@ class weather_cube_generator(object):
             pass
 
     def get_weather_cube(self):
-        weather_tensor_dict = {}
+        weather_tensor_dict = [{} for _ in self.cube_list]
         weather_point_dict = {}
         for self.call_sign, self.traj in self.traj_dict.items():
             print('Processing Flight {}'.format(self.call_sign))
             try:
-                weather_tensor_dict[self.call_sign], weather_point_dict[self.call_sign] = self.get_cube()
+                weather_tensor, weather_point_dict[self.call_sign] = self.get_cube()
+                for k in range(len(self.cube_list)):
+                    weather_tensor_dict[k][self.call_sign] = weather_tensor[k]
                 print("Finish weather data for {}.".format(self.call_sign))
             except:  # ignore file not found error
                 print("Error in weather data for {}".format(self.call_sign))
                 pass
-        pickle.dump(weather_tensor_dict, open('WEATHER_CUBE_{}_{}.p'.format(self.sector_name, self.date), 'wb'))
+        for (size, spacing), tensor_dict in zip(self.cube_list, weather_tensor_dict):
+            # keep the original file name when only one cube is generated
+            if len(self.cube_list) == 1 and spacing == 1:
+                file_name = 'WEATHER_CUBE_{}_{}.p'.format(self.sector_name, self.date)
+            else:
+                file_name = 'WEATHER_CUBE_{}_{}_{}_{}.p'.format(self.sector_name, self.date, size, spacing)
+            pickle.dump(tensor_dict, open(file_name, 'wb'))
         pickle.dump(weather_point_dict, open('WEATHER_POINT_{}_{}.p'.format(self.sector_name, self.date), 'wb'))
 
     def find_mean(self, x, y, values):
@@ -73,112 +87,46 @@ class weather_cube_generator(object):
 
     def get_cube(self):
 
-        y_max, y_min, x_max, x_min = lat2y(53.8742945085336), lat2y(19.35598953632181), lot2x(-61.65138656927017), lot2x(-134.3486134307298)
-
-        dim = np.int32(np.linspace(1, len(self.traj)-1, len(self.traj)-1))
-        nn = np.int32(np.linspace(1, self.cube_size, self.cube_size))
-        nn2 = np.int32(np.linspace(2, self.cube_size, self.cube_size-1))
-
-        s_y = np.linspace(y_min, y_max, int(3520/self.resize_ratio))
-        s_x = np.linspace(x_min, x_max, int(5120/self.resize_ratio))
-
-        step_x = s_x[1] - s_x[0]
-        step_y = s_y[1] - s_y[0]
-
-        weather_tensor = []
-        point_t = []
-
         # information need from the original data file
         x = np.asarray(self.traj[10])  # longitude
         y = np.asarray(self.traj[9])  # latitude
         t = np.asarray(self.traj.index.values)  # unix time
 
-        start = time.time()
-
-        for i in dim:
-
-            # compute index
-            if (i+1) % int((len(self.traj)/10)) == 0:
-                print("Working on Point {}/{}".format(1+i, len(self.traj)))
-
-            # check weather file exists at time i
-            weather_file = check_convective_weather_files(self.weather_path, t[i])
-            data = Dataset(weather_file)
-            values = np.squeeze(data.variables['ECHO_TOP'])
+        # trajectory geometry is shared by all cube sizes
+        geometry = cube_geometry(x, y)
+        x_p, y_p = point_index(geometry, self.resize_ratio)
 
-            # search direction
-            dx_ = x[i] - x[i-1] + 1e-8
-            dire_x = dx_/np.abs(dx_)
-            dy_ = y[i] - y[i-1] + 1e-8
-            dire_y = dy_ / np.abs(dy_)
+        # weather file of every point, consecutive points usually share the same file
+        weather_files = [check_convective_weather_files(self.weather_path, t[i]) for i in range(1, len(t))]
+        frame_start = [i for i in range(len(weather_files)) if i == 0 or weather_files[i] != weather_files[i-1]]
+        frame_end = frame_start[1:] + [len(weather_files)]
 
-            # Line 1  Along the Traj
-            slope_m = (lat2y(y[i]) - lat2y(y[i-1]) + 1e-8) / (lot2x(x[i]) - lot2x(x[i-1]) + 1e-8)
-            angle_m = math.atan(slope_m)
+        weather_tensor = [np.zeros((len(weather_files), size, size)) for size, _ in self.cube_list]
+        point_t = []
 
-            # Line 2 Bottom Boundary
-            slope_b = -(lot2x(x[i]) - lot2x(x[i-1]) + 1e-8) / (lat2y(y[i]) - lat2y(y[i-1]) + 1e-8)
-            angle_b = math.atan(slope_b)
+        start = time.time()
 
-            delta_Xb = np.abs(step_x * self.cube_size * math.cos(angle_b))
-            Y_b = lambda s: slope_b * (s - lot2x(x[i])) + lat2y(y[i])
-            Xb_2 = lot2x(x[i]) + 0.5 * delta_Xb  # x-coord right-bottom corner
-            Yb_2 = Y_b(Xb_2)  # y-coord right-bottom corner
+        for a, b in zip(frame_start, frame_end):
 
-            # point count
-            h = 0
+            # decode the weather file once for all points and cube sizes
+            data = Dataset(weather_files[a])
+            values = np.ma.filled(np.squeeze(data.variables['ECHO_TOP']), 0)
+            data.close()
 
-            # store 20x20 values
-            weather_v = np.zeros((self.cube_size**2, 1))
+            geometry_frame = {key: value[a:b] for key, value in geometry.items()}
 
             # save weather values at traj point
-            x_p = np.int(round((lot2x(x[i]) - x_min)/step_x))
-            y_p = np.int(round((lat2y(y[i]) - y_min) / step_y))
-
-            point_t_values = self.find_mean(x_p, y_p, values)
-            point_t.append((x_p, y_p, point_t_values))
-
-            # Loop to generate all points coordinates
-            for i in nn:
-
-                d_x0 = np.abs(step_y * math.cos(angle_m))
-                d_y0 = np.abs(step_y * math.sin(angle_m))
-
-                Xb_2i = np.int(round((Xb_2 - x_min) / step_x))
-                Yb_2i = np.int(round((Yb_2 - y_min) / step_y))
-
-                point = (Xb_2i, Yb_2i)
-
-                weather_v[h] = self.find_mean(Xb_2i, Yb_2i, values)
-
-                h = h + 1
-
-                for j in nn2:
-
-                    d_x = np.abs(step_x * math.cos(angle_b))
-
-                    Y_b2 = lambda s: slope_b * (s - Xb_2) + Yb_2
-                    x_ = Xb_2 - d_x * (j - 1)
-                    y_ = Y_b2(x_)
-
-                    x_i = np.int(round((x_ - x_min) / step_x))
-                    y_i = np.int(round((y_ - y_min) / step_y))
-
-                    point = (x_i, y_i)  # index of weather
-
-                    weather_v[h] = self.find_mean(x_i, y_i, values)
-
-                    h = h + 1
-
-                Xb_2 = Xb_2 + dire_x * d_x0
-                Yb_2 = Yb_2 + dire_y * d_y0
+            point_t_values = find_mean_index(values, x_p[a:b], y_p[a:b], self.resize_ratio)
+            point_t += list(zip(x_p[a:b], y_p[a:b], point_t_values))
 
-            weather_v = weather_v.reshape(self.cube_size, self.cube_size)
-            weather_tensor.append(weather_v)
+            # only the final gather is repeated per cube size
+            for k, (size, spacing) in enumerate(self.cube_list):
+                x_i, y_i = cube_index(geometry_frame, size, spacing, self.resize_ratio)
+                weather_tensor[k][a:b] = find_mean_index(values, x_i, y_i, self.resize_ratio)
 
         print("Total time for one trajectory is: ", time.time() - start)
 
-        return weather_tensor, point_t
+        return [list(tensor) for tensor in weather_tensor], point_t
         # save data
         # np.save('weather_data/{}_{}_ET/{}'.format(self.date, self.sector_name, self.call_sign), weather_tensor)
         # np.save('weather_data/{}_{}_ET_point/{}'.format(self.date, self.sector_name, self.call_sign), point_t)
@@ -190,7 +138,7 @@ if __name__ == '__main__':
     cfg = {}
     cfg['date'] = '20190805'
     cfg['sector_name'] = 'ZID'
-    cfg['cube_size'] = 25
+    cfg['cube_size'] = 25  # a list of sizes generates all cubes in one sweep
     cfg['resize_ratio'] = 1
     cfg['weather_path'] = '/media/ypang6/paralab/Research/data/'
     fun = weather_cube_generator(cfg)
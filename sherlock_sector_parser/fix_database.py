@@ -0,0 +1,142 @@
+#! /home/anaconda3 python
+#-*- coding: utf-8 -*-
+
+"""
+@Date: 2026-10-19
+
+This Python script is the local fix database (airports, waypoints and navaids) used to resolve flight plan strings.
+The database csv (name, latitude, longitude, optional kind) is parsed once into a hash index and cached next to it
+as a compact npz file, so the next run loads it without parsing the csv.
+Flight plans are resolved offline in bulk with resolve_batch, fixes missing from the database are listed once for
+the whole batch and can be fetched from https://opennav.com and appended to the database.
+
+"""
+
+import os
+import csv
+import numpy as np
+from utils import split_flight_plan, fetch_fix
+
+
+class fix_database(object):
+    def __init__(self, cfg):
+        self.db_file = cfg.get('fix_database', 'myFPDB.csv')
+        self.fetch_missing = cfg.get('fetch_missing_fixes', False)  # query missing fixes from the web
+
+        self.resolved = {}  # flight plan string to coordinates
+        self.missing = set()
+        self.load()
+
+    def load(self):
+
+        cache_file = os.path.splitext(self.db_file)[0] + '.npz'  # compact copy of the csv
+        if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(self.db_file):
+            data = np.load(cache_file)
+            name, kind, coords = data['name'].tolist(), data['kind'].tolist(), data['coords']
+        else:
+            name, kind, coords = [], [], []
+            with open(self.db_file, 'rt') as f:
+                for row in csv.reader(f, delimiter=','):
+                    try:
+                        coords += [[float(row[1]), float(row[2])]]
+                    except (ValueError, IndexError):  # skip header and broken rows
+                        continue
+                    name += [row[0]]
+                    kind += [row[3] if len(row) > 3 else '']
+            coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+            np.savez(cache_file, name=np.asarray(name, dtype=str), kind=np.asarray(kind, dtype=str), coords=coords)
+
+        # hash index of the fixes, the first row of a name wins, waypoints before navaids
+        self.coords = coords
+        self.airports = {}
+        self.fixes = {}
+        for priority in ['airport', 'waypoint', '', 'navaid']:
+            for i in range(len(name)):
+                if kind[i] == priority or (priority == '' and kind[i] not in ['airport', 'waypoint', 'navaid']):
+                    (self.airports if priority == 'airport' else self.fixes).setdefault(name[i], i)
+
+        print("Loaded {} fixes from {}.".format(len(name), self.db_file))
+
+    def lookup(self, name, airport=False):
+        # input: fix name, True for the departure and arrival airports
+        # output: row of the fix in self.coords, None if the fix is not in the database
+        if airport:
+            return self.airports.get(name, self.fixes.get(name))
+        return self.fixes.get(name, self.airports.get(name))
+
+    def resolve(self, str):
+        # input: flight plan string
+        # output: flight plan as np.array, waypoints not found are skipped, error if an airport is not found
+        if str in self.resolved:
+            return self.resolved[str]
+
+        str_list = split_flight_plan(str)
+        index = []
+        for n in range(len(str_list)):
+            airport = n == 0 or n == len(str_list) - 1
+            i = self.lookup(str_list[n], airport)
+            if i is not None:
+                index += [i]
+            elif airport:
+                raise KeyError("Airport {} not found in {}.".format(str_list[n], self.db_file))
+            else:
+                print("Waypoint {} not found in {}.".format(str_list[n], self.db_file))
+
+        self.resolved[str] = self.coords[index]
+        return self.resolved[str]
+
+    def resolve_batch(self, str_list):
+        # input: list of flight plan strings, e.g. all flight plans of a day
+        # output: list of flight plans as np.array, None for plans that can not be resolved
+        fix_list = [split_flight_plan(x) for x in str_list if x not in self.resolved]
+
+        # collect the fixes missing from the database once for the whole batch
+        self.missing = set()
+        for fp in fix_list:
+            for n in range(len(fp)):
+                if self.lookup(fp[n], n == 0 or n == len(fp) - 1) is None:
+                    self.missing.add((fp[n], n == 0 or n == len(fp) - 1))
+        if self.missing:
+            print("{} fixes not found in {}.".format(len(self.missing), self.db_file))
+            if self.fetch_missing:
+                self.fetch(sorted(self.missing))
+
+        fp_list = []
+        for x in str_list:
+            try:
+                fp_list += [self.resolve(x)]
+            except KeyError as e:
+                print(e)
+                fp_list += [None]
+        return fp_list
+
+    def fetch(self, missing):
+        # input: list of (fix name, is airport) not in the database
+        # output: fixes found on the web are added to the index and appended to the database csv
+        rows = []
+        for name, airport in missing:
+            for kind in (['airport'] if airport else ['waypoint', 'navaid']):
+                try:
+                    lat, lon = fetch_fix(name, kind)
+                    rows += [[name, float(lat), float(lon), kind]]
+                    break
+                except:
+                    continue
+            else:
+                print("Fix {} not found from {}.".format(name, "https://opennav.com"))
+
+        if not rows:
+            return
+
+        with open(self.db_file, 'a') as f:
+            csv.writer(f, delimiter=',').writerows(rows)
+        try:
+            os.remove(os.path.splitext(self.db_file)[0] + '.npz')  # cache is rebuilt on the next load
+        except OSError:
+            pass
+
+        for row in rows:
+            (self.airports if row[3] == 'airport' else self.fixes).setdefault(row[0], len(self.coords))
+            self.coords = np.vstack([self.coords, [row[1:3]]])
+            self.missing.discard((row[0], row[3] == 'airport'))
+        print("Added {} fixes to {}.".format(len(rows), self.db_file))
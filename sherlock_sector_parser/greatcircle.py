@@ -190,7 +190,195 @@ class GreatCircleRoute(object):
 
         return phi2, lembda2, alpha21
 
-        
+
+
+class GreatCircleRouteBatch(object):
+
+    def __init__(self, lon1, lat1, lon2, lat2):
+        # input: arrays of start and end coordinates in degrees, one entry per city pair
+        # WGS84
+        self.ra = 6378137.0
+        self.rb = 6356752.3142
+        self.rmajor = (2 * self.ra + self.rb) / 3.
+        self.rminor = (2 * self.ra + self.rb) / 3.
+
+        lon1, lat1, lon2, lat2 = [np.atleast_1d(np.asarray(x, dtype=float)) for x in (lon1, lat1, lon2, lat2)]
+
+        # start and end points
+        self.lon1 = np.radians(lon1)
+        self.lat1 = np.radians(lat1)
+        self.lon2 = np.radians(lon2)
+        self.lat2 = np.radians(lat2)
+
+        self.f = (self.rmajor - self.rminor) / self.rmajor
+        self.distance, self.azimuth12, self.azimuth21 = vinc_dist_batch(self.f, self.rmajor, self.lat1, self.lon1,
+                                                                        self.lat2, self.lon2)
+
+        # Great Circle Arc Length, same as GreatCircleRoute which takes the coordinates in degrees
+        self.gcarclen = 2. * np.arcsin(np.sqrt((np.sin((lat1 - lat2) / 2)) ** 2 + np.cos(lat1) * np.cos(lat2) * (np.sin((lon1 - lon2) / 2)) ** 2))
+
+        # Check Antipodal
+        self.antipodal = self.gcarclen == math.pi
+
+    def points(self, npoints):
+        # output: points (pairs x npoints x 2) as longitude and latitude in degrees, same as GreatCircleRoute.points
+        d = self.gcarclen[:, None]
+
+        delta = 1.0 / (npoints - 1)
+
+        f = delta * np.arange(npoints)  # f=0 is point 1, f=1 is point 2.
+
+        lat1, lat2 = self.lat1[:, None], self.lat2[:, None]
+        lon1, lon2 = self.lon1[:, None], self.lon2[:, None]
+
+        # perfect sphere, use great circle formula
+        if self.f == 0.:
+            A = np.sin((1 - f) * d) / np.sin(d)
+            B = np.sin(f * d) / np.sin(d)
+            x = A * np.cos(lat1) * np.cos(lon1) + B * np.cos(lat2) * np.cos(lon2)
+            y = A * np.cos(lat1) * np.sin(lon1) + B * np.cos(lat2) * np.sin(lon2)
+            z = A * np.sin(lat1) + B * np.sin(lat2)
+            lats = np.degrees(np.arctan2(z, np.sqrt(x ** 2 + y ** 2)))
+            lons = np.degrees(np.arctan2(y, x))
+        # use ellipsoid formulas, all pairs step together
+        else:
+            incdist = self.distance / (npoints - 1)
+            latpt, lonpt, azimuth = self.lat1, self.lon1, self.azimuth12
+            lats, lons = [latpt], [lonpt]
+            for n in range(npoints - 2):
+                latpt, lonpt, alpha21 = vinc_pt_batch(self.f, self.rmajor, latpt, lonpt, azimuth, incdist)
+                d, azimuth, a21 = vinc_dist_batch(self.f, self.rmajor, latpt, lonpt, self.lat2, self.lon2)
+                lats.append(latpt)
+                lons.append(lonpt)
+            lats.append(self.lat2)
+            lons.append(self.lon2)
+            lats, lons = np.degrees(np.column_stack(lats)), np.degrees(np.column_stack(lons))
+
+        return np.stack((lons, lats), axis=-1)
+
+
+def vinc_dist_batch(f, a, phi1, lembda1, phi2, lembda2):
+    # input: flattening, major axis and arrays of start and end points in radians
+    # output: arrays of distance and forward and backward azimuth, same as GreatCircleRoute.vinc_dist on each pair,
+    #         the iteration stops for each pair on its own
+    phi1, lembda1, phi2, lembda2 = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (phi1, lembda1, phi2, lembda2)])
+    shape = phi1.shape
+    phi1, lembda1, phi2, lembda2 = [x.ravel() for x in (phi1, lembda1, phi2, lembda2)]
+
+    two_pi = 2.0 * math.pi
+    b = a * (1.0 - f)
+    U1 = np.arctan((1 - f) * np.tan(phi1))
+    U2 = np.arctan((1 - f) * np.tan(phi2))
+    omega = lembda2 - lembda1
+
+    # coincident points return zeros
+    same = (np.abs(phi2 - phi1) < 1e-8) & (np.abs(lembda2 - lembda1) < 1e-8)
+
+    lembda = omega.copy()
+    sqr_sin_sigma, Sin_sigma, Cos_sigma, sigma, Cos2sigma_m, cos_sq_alpha = [np.zeros(len(omega)) for _ in range(6)]
+    active = ~same
+    for _ in range(1000):
+        if not active.any():
+            break
+        i = np.where(active)[0]
+        l, u1, u2 = lembda[i], U1[i], U2[i]
+        sqr_sin_sigma[i] = (np.cos(u2) * np.sin(l)) ** 2 + (np.cos(u1) * np.sin(u2) - np.sin(u1) * np.cos(u2) * np.cos(l)) ** 2
+        Sin_sigma[i] = np.sqrt(sqr_sin_sigma[i])
+        Cos_sigma[i] = np.sin(u1) * np.sin(u2) + np.cos(u1) * np.cos(u2) * np.cos(l)
+        sigma[i] = np.arctan2(Sin_sigma[i], Cos_sigma[i])
+        Sin_alpha = np.cos(u1) * np.cos(u2) * np.sin(l) / np.sin(sigma[i])
+        cos_sq_alpha[i] = np.cos(np.arcsin(Sin_alpha)) ** 2
+        Cos2sigma_m[i] = np.cos(sigma[i]) - (2 * np.sin(u1) * np.sin(u2) / cos_sq_alpha[i])
+        C = (f / 16) * cos_sq_alpha[i] * (4 + f * (4 - 3 * cos_sq_alpha[i]))
+        lembda[i] = omega[i] + (1 - C) * f * Sin_alpha * (sigma[i] + C * np.sin(sigma[i]) * (Cos2sigma_m[i] + C * np.cos(sigma[i]) * (-1 + 2 * Cos2sigma_m[i] ** 2)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            active[i] = (lembda[i] != 0) & (np.abs((l - lembda[i]) / lembda[i]) > 1.0e-9)
+
+    u2 = cos_sq_alpha * (a * a - b * b) / (b * b)
+    A = 1 + (u2 / 16384) * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = (u2 / 1024) * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * Sin_sigma * (Cos2sigma_m + (B / 4) * (Cos_sigma * (-1 + 2 * Cos2sigma_m ** 2) - (B / 6) * Cos2sigma_m * (-3 + 4 * sqr_sin_sigma) * (-3 + 4 * Cos2sigma_m ** 2)))
+    s = b * A * (sigma - delta_sigma)
+    alpha12 = np.arctan2((np.cos(U2) * np.sin(lembda)), (np.cos(U1) * np.sin(U2) - np.sin(U1) * np.cos(U2) * np.cos(lembda)))
+    alpha21 = np.arctan2((np.cos(U1) * np.sin(lembda)), (-np.sin(U1) * np.cos(U2) + np.cos(U1) * np.sin(U2) * np.cos(lembda)))
+
+    alpha12 = np.where(alpha12 < 0.0, alpha12 + two_pi, alpha12)
+    alpha12 = np.where(alpha12 > two_pi, alpha12 - two_pi, alpha12)
+
+    alpha21 = alpha21 + two_pi / 2.0
+    alpha21 = np.where(alpha21 < 0.0, alpha21 + two_pi, alpha21)
+    alpha21 = np.where(alpha21 > two_pi, alpha21 - two_pi, alpha21)
+
+    s, alpha12, alpha21 = [np.where(same, 0.0, x).reshape(shape) for x in (s, alpha12, alpha21)]
+    return s, alpha12, alpha21
+
+
+def vinc_pt_batch(f, a, phi1, lembda1, alpha12, s):
+    # input: flattening, major axis and arrays of start points, azimuth in radians and distance
+    # output: arrays of end points and backward azimuth, same as GreatCircleRoute.vinc_pt on each entry
+    phi1, lembda1, alpha12, s = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (phi1, lembda1, alpha12, s)])
+
+    two_pi = 2.0 * math.pi
+
+    alpha12 = np.where(alpha12 < 0.0, alpha12 + two_pi, alpha12)
+    alpha12 = np.where(alpha12 > two_pi, alpha12 - two_pi, alpha12)
+
+    b = a * (1.0 - f)
+    TanU1 = (1 - f) * np.tan(phi1)
+    U1 = np.arctan(TanU1)
+    sigma1 = np.arctan2(TanU1, np.cos(alpha12))
+    Sinalpha = np.cos(U1) * np.sin(alpha12)
+    cosalpha_sq = 1.0 - Sinalpha * Sinalpha
+    u2 = cosalpha_sq * (a * a - b * b) / (b * b)
+
+    A = 1.0 + (u2 / 16384) * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = (u2 / 1024) * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+
+    # Starting with the approximation
+    sigma = (s / (b * A))
+    last_sigma = 2.0 * sigma + 2.0  # something impossible
+    two_sigma_m = 2 * sigma1 + sigma
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        active = np.abs((last_sigma - sigma) / sigma) > 1.0e-9
+        for _ in range(1000):
+            if not active.any():
+                break
+            two_sigma_m = np.where(active, 2 * sigma1 + sigma, two_sigma_m)
+            delta_sigma = B * np.sin(sigma) * (np.cos(two_sigma_m) + (B / 4) * (np.cos(sigma) * (-1 + 2 * np.cos(two_sigma_m) ** 2 -
+                                               (B / 6) * np.cos(two_sigma_m) * (-3 + 4 * np.sin(sigma) ** 2) * (-3 + 4 * np.cos(two_sigma_m) ** 2))))
+            last_sigma = sigma
+            sigma = np.where(active, (s / (b * A)) + delta_sigma, sigma)
+            active = active & (np.abs((last_sigma - sigma) / sigma) > 1.0e-9)
+
+    phi2 = np.arctan2((np.sin(U1) * np.cos(sigma) + np.cos(U1) * np.sin(sigma) * np.cos(alpha12)),
+                      ((1 - f) * np.sqrt(Sinalpha ** 2 + (np.sin(U1) * np.sin(sigma) - np.cos(U1) * np.cos(sigma) * np.cos(alpha12)) ** 2)))
+
+    lembda = np.arctan2((np.sin(sigma) * np.sin(alpha12)), (np.cos(U1) * np.cos(sigma) - np.sin(U1) * np.sin(sigma) * np.cos(alpha12)))
+    C = (f / 16) * cosalpha_sq * (4 + f * (4 - 3 * cosalpha_sq))
+    omega = lembda - (1 - C) * f * Sinalpha * (sigma + C * np.sin(sigma) * (np.cos(two_sigma_m) + C * np.cos(sigma) * (-1 + 2 * np.cos(two_sigma_m) ** 2)))
+    lembda2 = lembda1 + omega
+    alpha21 = np.arctan2(Sinalpha, (-np.sin(U1) * np.sin(sigma) + np.cos(U1) * np.cos(sigma) * np.cos(alpha12)))
+    alpha21 = alpha21 + two_pi / 2.0
+
+    alpha21 = np.where(alpha21 < 0.0, alpha21 + two_pi, alpha21)
+    alpha21 = np.where(alpha21 > two_pi, alpha21 - two_pi, alpha21)
+
+    return phi2, lembda2, alpha21
+
+
+def distance_matrix(lon1, lat1, lon2=None, lat2=None):
+    # input: coordinates in degrees of the first and second set of points, the first set again if not given
+    # output: distance (n1 x n2) and forward azimuth in radians between all pairs, same sphere as GreatCircleRoute
+    if lon2 is None:
+        lon2, lat2 = lon1, lat1
+    a = (2 * 6378137.0 + 6356752.3142) / 3.
+    lat1, lon1 = np.radians(np.asarray(lat1, dtype=float))[:, None], np.radians(np.asarray(lon1, dtype=float))[:, None]
+    lat2, lon2 = np.radians(np.asarray(lat2, dtype=float))[None, :], np.radians(np.asarray(lon2, dtype=float))[None, :]
+    distance, azimuth12, azimuth21 = vinc_dist_batch(0., a, lat1, lon1, lat2, lon2)
+    return distance, azimuth12
+
+
 if __name__ == "__main__":
     sector = 'ZTL'
     date = 20190624
@@ -198,9 +386,11 @@ if __name__ == "__main__":
 
     dict_fp = pickle.load(open('FP_{}_{}.p'.format(sector, date), 'rb'))
 
-    dict_gc = {}
-    for flight_id, fp in dict_fp.items():
-        dict_gc[flight_id] = GreatCircleRoute(fp.iloc[0][2], fp.iloc[0][1], fp.iloc[-1][2], fp.iloc[-1][1]).points(number_of_points_gc)
+    # great circle routes of all flights in one call
+    flight_ids = list(dict_fp.keys())
+    gc = GreatCircleRouteBatch([dict_fp[x].iloc[0][2] for x in flight_ids], [dict_fp[x].iloc[0][1] for x in flight_ids],
+                               [dict_fp[x].iloc[-1][2] for x in flight_ids], [dict_fp[x].iloc[-1][1] for x in flight_ids])
+    dict_gc = dict(zip(flight_ids, gc.points(number_of_points_gc)))
 
     pickle.dump(dict_gc, open('GC_{}_{}.p'.format(sector, date), 'wb'))
 
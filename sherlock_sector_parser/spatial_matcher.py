@@ -0,0 +1,48 @@
+#! /home/anaconda3 python
+#-*- coding: utf-8 -*-
+
+"""
+@Date: 2026-10-19
+
+This Python script matches flight plan waypoints to the closest trajectory points.
+One KD-tree is built per trajectory and all waypoints are answered in one vectorized query.
+Distances are raw degree distances by default, or great circle distances with geodesic=True, where the points are
+put on the unit sphere so the closest chord is the closest great circle.
+
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class spatial_matcher(object):
+    def __init__(self, points, geodesic=False, lon_lat=False):
+        # input: trajectory points (n x 2) in degrees, latitude first, or longitude first with lon_lat=True
+        self.geodesic = geodesic
+        self.lon_lat = lon_lat
+
+        points = np.asarray(points, dtype=float)
+        valid = np.where(~np.isnan(points).any(axis=1))[0]
+
+        # repeated points resolve to the first index, same as argmin over the trajectory
+        first = np.unique(points[valid], axis=0, return_index=True)[1]
+        self.index = valid[np.sort(first)]
+        self.tree = cKDTree(self.embed(points[self.index]))
+
+    def embed(self, points):
+        # input: points (n x 2) in degrees
+        # output: points in degrees, or unit vectors (n x 3) in geodesic mode
+        if not self.geodesic:
+            return points
+        lat, lon = (points[:, 1], points[:, 0]) if self.lon_lat else (points[:, 0], points[:, 1])
+        lat, lon = np.radians(lat), np.radians(lon)
+        return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+    def query(self, waypoints):
+        # input: waypoints (m x 2) in the same order as the trajectory points
+        # output: distance to the closest trajectory point, in degrees or in degrees of great circle arc,
+        #         and the index of the closest trajectory point
+        distance, idx = self.tree.query(self.embed(np.atleast_2d(np.asarray(waypoints, dtype=float))))
+        if self.geodesic:
+            distance = np.degrees(2 * np.arcsin(np.minimum(distance / 2, 1)))
+        return distance, self.index[idx]